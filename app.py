@@ -1,19 +1,176 @@
+import atexit
+import base64
+import bisect
+import cProfile
+import csv
+import hashlib
+import hmac
+import gzip
+import json
+import marshal
+import mimetypes
 import os
+import random
+import re
+import secrets
+import shutil
 import sqlite3
-from datetime import datetime
-from typing import Dict, List
+import struct
+import subprocess
+import tempfile
+import urllib.request
+import zlib
+from functools import lru_cache
+from itertools import groupby
+from collections import OrderedDict, namedtuple
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
 
+import click
 import stripe
 import smtplib
 import sys
 import threading
+import time
 from email.message import EmailMessage
-from flask import Flask, render_template, request, session, redirect, url_for, jsonify, abort, flash
+from flask import Flask, render_template, request, session, redirect, url_for, jsonify, abort, flash, g, make_response
+from flask import send_file, stream_template, stream_with_context
+from flask import before_render_template, template_rendered
+from flask.cli import AppGroup
+from flask.json.tag import TaggedJSONSerializer
+from flask.sessions import SessionInterface, SessionMixin
+from markupsafe import Markup
+from werkzeug.datastructures import CallbackDict
+from werkzeug.local import Local
+from werkzeug.security import safe_join
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-DB_PATH = os.path.join(BASE_DIR, "shop.db")
+DB_PATH = os.environ.get("SHOP_DB_PATH", os.path.join(BASE_DIR, "shop.db"))
 DB_INIT_LOCK = threading.Lock()
 DB_INITIALIZED = False
+DB_POOL_SIZE = int(os.environ.get("SHOP_DB_POOL_SIZE", "8"))
+DB_POOL_TIMEOUT = float(os.environ.get("SHOP_DB_POOL_TIMEOUT", "5"))
+CATALOG_CACHE_TTL = float(os.environ.get("SHOP_CATALOG_CACHE_TTL", "2"))
+CATALOG_CACHE_MAX_ITEMS = int(os.environ.get("SHOP_CATALOG_CACHE_MAX_ITEMS", "50000"))
+FRAGMENT_CACHE_BYTES = int(os.environ.get("SHOP_FRAGMENT_CACHE_BYTES", str(16 * 1024 * 1024)))
+COMPRESS_ENABLED = os.environ.get("SHOP_COMPRESS", "1") == "1"
+COMPRESS_CACHE_BYTES = int(os.environ.get("SHOP_COMPRESS_CACHE_BYTES", str(8 * 1024 * 1024)))
+COMPRESS_CACHE_MAX_BODY = 1024 * 1024
+# mimetype -> smallest body worth compressing; types not listed are sent as is.
+COMPRESS_POLICY = {
+    "text/html": 512,
+    "text/css": 512,
+    "text/javascript": 512,
+    "application/javascript": 512,
+    "image/svg+xml": 512,
+    "application/json": 1024,
+    "text/plain": 1024,
+    "text/csv": 1024,
+}
+# Server preference among what the client accepts, and the level for each.
+COMPRESS_LEVELS = {"br": 5, "zstd": 3, "gzip": 6}
+CART_COUNT_SLOT = "\x00cart_count\x00"
+STREAM_FLUSH = "\x00flush\x00"
+STREAM_CHUNK_BYTES = int(os.environ.get("SHOP_STREAM_CHUNK_BYTES", "16384"))
+COMMENT_EDIT_SLOT = re.compile(r"<!--edit:(\d+)-->")
+SESSION_BACKEND = os.environ.get("SHOP_SESSION_BACKEND", "sqlite")
+SESSION_LIFETIME = int(os.environ.get("SHOP_SESSION_LIFETIME", str(30 * 24 * 3600)))
+SESSION_GC_INTERVAL = float(os.environ.get("SHOP_SESSION_GC_INTERVAL", "60"))
+SESSION_GC_BATCH = int(os.environ.get("SHOP_SESSION_GC_BATCH", "500"))
+SESSION_REDIS_URL = os.environ.get("SHOP_SESSION_REDIS_URL", "redis://127.0.0.1:6379/0")
+STATIC_MAX_AGE = int(os.environ.get("SHOP_STATIC_MAX_AGE", "3600"))
+ASSET_DIR = os.environ.get("SHOP_ASSET_DIR", os.path.join(BASE_DIR, "dist"))
+ASSET_EXTENSIONS = (".css", ".js")
+ASSET_MAX_AGE = 365 * 24 * 3600
+COMMENTS_PAGE_SIZE = int(os.environ.get("SHOP_COMMENTS_PAGE_SIZE", "20"))
+SEARCH_PAGE_SIZE = 20
+SEARCH_MAX_PAGE_SIZE = 50
+SEARCH_CANDIDATES = int(os.environ.get("SHOP_SEARCH_CANDIDATES", "250"))
+ARABIC_DIACRITICS = re.compile("[\u0610-\u061a\u064b-\u065f\u0670\u06d6-\u06ed\u0640]")
+ARABIC_LETTER_FOLDS = str.maketrans({"أ": "ا", "إ": "ا", "آ": "ا", "ٱ": "ا", "ى": "ي", "ئ": "ي", "ؤ": "و", "ة": "ه"})
+CATALOG_PAGE_SIZE = int(os.environ.get("SHOP_CATALOG_PAGE_SIZE", "60"))
+CATALOG_MAX_PAGE_SIZE = 200
+SALES_REPORT_DAYS = 30
+RELATED_TOP_K = int(os.environ.get("SHOP_RELATED_TOP_K", "8"))
+RELATED_ON_PAGE = 4
+# One related_products entry: (other product id, paid orders with both), little-endian uint32s.
+RELATED_ENTRY = struct.Struct("<II")
+CATALOG_SORTS = {
+    # sort name -> (ORDER BY, keyset columns, keyset comparison)
+    "id": ("id ASC", ("id",), ">"),
+    "newest": ("id DESC", ("id",), "<"),
+    "price_asc": ("price_cents ASC, id ASC", ("price_cents", "id"), ">"),
+    "price_desc": ("price_cents DESC, id DESC", ("price_cents", "id"), "<"),
+}
+CARD_FIELDS = ("id", "sku", "name", "description", "category", "badge", "price_cents", "image")
+ProductCard = namedtuple("ProductCard", CARD_FIELDS)
+CACHE_CONTROL = {
+    "index": "private, no-cache",
+    "product": "private, no-cache",
+    "cart": "private, no-cache",
+    "checkout": "no-store",
+    "checkout_success": "no-store",
+    "checkout_cancel": "no-store",
+    "metrics": "no-store",
+    "admin_profiles": "no-store",
+    "admin_profile": "no-store",
+    "admin_orders_csv": "no-store",
+    "admin_sales": "no-store",
+}
+IMAGE_CACHE_DIR = os.environ.get("SHOP_IMAGE_CACHE_DIR", os.path.join(BASE_DIR, "image_cache"))
+IMAGE_CACHE_BYTES = int(os.environ.get("SHOP_IMAGE_CACHE_BYTES", str(512 * 1024 * 1024)))
+IMAGE_WIDTHS = (120, 240, 320, 480, 640, 720, 900, 1200)
+IMAGE_MAX_AGE = int(os.environ.get("SHOP_IMAGE_MAX_AGE", str(365 * 24 * 3600)))
+IMAGE_FETCH_TIMEOUT = float(os.environ.get("SHOP_IMAGE_FETCH_TIMEOUT", "10"))
+IMAGE_MAX_SOURCE_BYTES = int(os.environ.get("SHOP_IMAGE_MAX_SOURCE_BYTES", str(20 * 1024 * 1024)))
+IMAGE_TOUCH_INTERVAL = 60
+# format -> (mimetype, Pillow save options)
+IMAGE_FORMATS = {
+    "avif": ("image/avif", {"quality": 60, "speed": 8}),
+    "webp": ("image/webp", {"quality": 80, "method": 4}),
+    "jpeg": ("image/jpeg", {"quality": 82, "optimize": True, "progressive": True}),
+}
+# Admin endpoints answer 404 until this is set; send it as "Authorization: Bearer <token>".
+ADMIN_TOKEN = os.environ.get("SHOP_ADMIN_TOKEN", "")
+PROFILE_SAMPLE_RATE = float(os.environ.get("SHOP_PROFILE_SAMPLE_RATE", "0"))
+PROFILE_SLOW_MS = float(os.environ.get("SHOP_PROFILE_SLOW_MS", "500"))
+PROFILE_MODE = os.environ.get("SHOP_PROFILE_MODE", "sample")
+PROFILE_INTERVAL = float(os.environ.get("SHOP_PROFILE_INTERVAL", "0.005"))
+PROFILE_ENDPOINTS = frozenset(
+    filter(None, os.environ.get("SHOP_PROFILE_ENDPOINTS", "product,create_checkout_session").split(","))
+)
+PROFILE_KEEP = int(os.environ.get("SHOP_PROFILE_KEEP", "20"))
+PROFILE_DIR = os.environ.get("SHOP_PROFILE_DIR", os.path.join(tempfile.gettempdir(), "shop-profiles"))
+# Shared by all processes of one server (gunicorn.conf.py sets it); empty = this process only.
+METRICS_DIR = os.environ.get("SHOP_METRICS_DIR", "")
+METRICS_FLUSH_INTERVAL = float(os.environ.get("SHOP_METRICS_FLUSH_INTERVAL", "5"))
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200)
+METRIC_SPECS = {
+    "shop_http_request_duration_seconds": ("Request latency by route, method and status.", LATENCY_BUCKETS),
+    "shop_http_request_sql_queries": ("SQL statements executed per request.", COUNT_BUCKETS),
+    "shop_http_request_sql_seconds": ("Time spent executing SQL per request.", LATENCY_BUCKETS),
+    "shop_template_render_seconds": ("Jinja render time by template.", LATENCY_BUCKETS),
+    "shop_stripe_request_seconds": ("Stripe API call latency by operation and outcome.", LATENCY_BUCKETS),
+    "shop_email_send_seconds": ("SMTP send latency per message by outcome.", LATENCY_BUCKETS),
+}
+DB_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA busy_timeout=5000",
+    "PRAGMA cache_size=-16000",
+    "PRAGMA mmap_size=134217728",
+    "PRAGMA temp_store=MEMORY",
+)
 
 app = Flask(__name__, static_folder="static", template_folder="templates")
 app.secret_key = os.environ.get("FLASK_SECRET_KEY", "dev-secret-change-me")
@@ -22,10 +179,41 @@ CURRENCY = os.environ.get("SHOP_CURRENCY", "USD")
 STRIPE_PUBLISHABLE_KEY = os.environ.get("STRIPE_PUBLISHABLE_KEY", "")
 STRIPE_SECRET_KEY = os.environ.get("STRIPE_SECRET_KEY", "")
 STRIPE_WEBHOOK_SECRET = os.environ.get("STRIPE_WEBHOOK_SECRET", "")
+# Point at a stripe-mock instance (e.g. http://localhost:12111) for local testing.
+STRIPE_API_BASE = os.environ.get("STRIPE_API_BASE", "")
+STRIPE_CONNECT_TIMEOUT = float(os.environ.get("STRIPE_CONNECT_TIMEOUT", "3"))
+STRIPE_READ_TIMEOUT = float(os.environ.get("STRIPE_READ_TIMEOUT", "8"))
+STRIPE_MAX_RETRIES = int(os.environ.get("STRIPE_MAX_RETRIES", "2"))
+STRIPE_POOL_SIZE = int(os.environ.get("STRIPE_POOL_SIZE", "16"))
 COOKIE_SECURE = os.environ.get("COOKIE_SECURE", "0") == "1"
 EMAIL_USER = os.environ.get("EMAIL_USER", "")
 EMAIL_APP_PASSWORD = os.environ.get("EMAIL_APP_PASSWORD", "")
 EMAIL_SENDER_NAME = os.environ.get("EMAIL_SENDER_NAME", "Aurora Store")
+SMTP_HOST = os.environ.get("SMTP_HOST", "smtp.gmail.com")
+SMTP_PORT = int(os.environ.get("SMTP_PORT", "465"))
+SMTP_SSL = os.environ.get("SMTP_SSL", "1") == "1"
+SMTP_TIMEOUT = float(os.environ.get("SMTP_TIMEOUT", "10"))
+EMAIL_BATCH_SIZE = int(os.environ.get("EMAIL_BATCH_SIZE", "20"))
+EMAIL_RATE_PER_SEC = float(os.environ.get("EMAIL_RATE_PER_SEC", "5"))
+EMAIL_MAX_ATTEMPTS = int(os.environ.get("EMAIL_MAX_ATTEMPTS", "6"))
+EMAIL_RETRY_BASE = float(os.environ.get("EMAIL_RETRY_BASE", "30"))
+EMAIL_RETRY_MAX = float(os.environ.get("EMAIL_RETRY_MAX", "3600"))
+EMAIL_CLAIM_TIMEOUT = float(os.environ.get("EMAIL_CLAIM_TIMEOUT", "300"))
+EMAIL_POLL_INTERVAL = float(os.environ.get("EMAIL_POLL_INTERVAL", "30"))
+WEBHOOK_BATCH_SIZE = int(os.environ.get("WEBHOOK_BATCH_SIZE", "200"))
+WEBHOOK_POLL_INTERVAL = float(os.environ.get("WEBHOOK_POLL_INTERVAL", "5"))
+# A hold lapses with its Stripe session, whose expires_at Stripe only takes 30 min to 24 h ahead;
+# the floor leaves a minute for the round trip between taking the hold and creating the session.
+STOCK_HOLD_TTL = min(max(int(os.environ.get("SHOP_STOCK_HOLD_TTL", "3600")), 31 * 60), 24 * 3600)
+STOCK_SWEEP_INTERVAL = float(os.environ.get("SHOP_STOCK_SWEEP_INTERVAL", "60"))
+STOCK_SWEEP_GRACE = float(os.environ.get("SHOP_STOCK_SWEEP_GRACE", "300"))
+STOCK_SWEEP_BATCH = int(os.environ.get("SHOP_STOCK_SWEEP_BATCH", "500"))
+WEBHOOK_ORDER_STATUS = {
+    "checkout.session.completed": "paid",
+    "checkout.session.async_payment_succeeded": "paid",
+    "checkout.session.async_payment_failed": "failed",
+    "checkout.session.expired": "expired",
+}
 
 try:
     import config  # local-only secrets
@@ -40,6 +228,7 @@ app.config.update(
     SESSION_COOKIE_HTTPONLY=True,
     SESSION_COOKIE_SAMESITE="Lax",
     SESSION_COOKIE_SECURE=COOKIE_SECURE,
+    SEND_FILE_MAX_AGE_DEFAULT=STATIC_MAX_AGE,
 )
 
 TEXT = {
@@ -53,6 +242,7 @@ TEXT = {
         "nav_contact": "Contact",
         "featured": "Featured Drops",
         "add_to_cart": "Add to cart",
+        "sold_out": "Sold out",
         "view": "View",
         "cart": "Cart",
         "checkout": "Checkout",
@@ -79,6 +269,16 @@ TEXT = {
         "edit": "Edit",
         "delete": "Delete",
         "save": "Save",
+        "all_categories": "All categories",
+        "sort_featured": "Featured",
+        "sort_newest": "Newest",
+        "sort_price_asc": "Price: low to high",
+        "sort_price_desc": "Price: high to low",
+        "apply": "Apply",
+        "more_products": "More products",
+        "view_all": "View all",
+        "more_comments": "Load more comments",
+        "related": "Frequently bought together",
     },
     "ar": {
         "brand": "متجر أورورا",
@@ -90,6 +290,7 @@ TEXT = {
         "nav_contact": "تواصل",
         "featured": "مختارات مميزة",
         "add_to_cart": "أضف للسلة",
+        "sold_out": "نفدت الكمية",
         "view": "عرض",
         "cart": "السلة",
         "checkout": "إتمام الدفع",
@@ -116,6 +317,16 @@ TEXT = {
         "edit": "تعديل",
         "delete": "حذف",
         "save": "حفظ",
+        "all_categories": "كل الفئات",
+        "sort_featured": "المميزة",
+        "sort_newest": "الأحدث",
+        "sort_price_asc": "السعر: من الأقل للأعلى",
+        "sort_price_desc": "السعر: من الأعلى للأقل",
+        "apply": "تطبيق",
+        "more_products": "منتجات أكثر",
+        "view_all": "عرض الكل",
+        "more_comments": "عرض تعليقات أكثر",
+        "related": "يُشترى معه غالبًا",
     },
 }
 
@@ -146,6 +357,7 @@ PRODUCTS_SEED = [
         "badge_ar": "محدود",
         "description_en": "Ultra smooth display and a battery that keeps up.",
         "description_ar": "شاشة انسيابية وبطارية تدوم طوال اليوم.",
+        "stock": 25,
     },
     {
         "sku": "AUR-CAM-03",
@@ -332,48 +544,1041 @@ def build_extra_products(start_index: int = 7):
 PRODUCTS_SEED.extend(build_extra_products())
 
 
-def get_db():
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
+def normalize_search_text(text: Optional[str]) -> str:
+    """Fold case, Arabic diacritics/tatweel and alef/yaa/taa-marbuta variants for FTS."""
+    if not text:
+        return ""
+    if text.isascii():
+        return text.lower()
+    return ARABIC_DIACRITICS.sub("", text).translate(ARABIC_LETTER_FOLDS).lower()
+
+
+class Metrics:
+    """Latency and count histograms for this process, exposed on /metrics.
+
+    With METRICS_DIR set, every process also writes its snapshot to
+    <dir>/<pid>.json every METRICS_FLUSH_INTERVAL seconds (and at exit), and
+    /metrics sums all files, like prometheus_client's multiprocess mode.
+    Files of exited workers are kept so counts never go backwards.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+        self._series: Dict[str, Dict[tuple, List[float]]] = {}
+        self._thread: Optional[threading.Thread] = None
+        atexit.register(self.flush)
+
+    def _check_fork(self):
+        if self._pid != os.getpid():
+            self._series = {}
+            self._thread = None
+            self._pid = os.getpid()
+
+    def observe(self, name: str, value: float, **labels):
+        buckets = METRIC_SPECS[name][1]
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._check_fork()
+            series = self._series.setdefault(name, {})
+            row = series.get(key)
+            if row is None:
+                # One slot per bucket plus +Inf, then the sum.
+                row = series[key] = [0] * (len(buckets) + 2)
+            row[bisect.bisect_left(buckets, value)] += 1
+            row[-1] += value
+
+    def snapshot(self) -> Dict[str, Dict[str, List[float]]]:
+        with self._lock:
+            self._check_fork()
+            return {
+                name: {json.dumps(key): list(row) for key, row in series.items()}
+                for name, series in self._series.items()
+            }
+
+    def start(self):
+        """Start this process's flush thread if METRICS_DIR is set and it is not running."""
+        if not self.directory or (self._pid == os.getpid() and self._thread is not None):
+            return
+        with self._lock:
+            self._check_fork()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="metrics-flush", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            time.sleep(METRICS_FLUSH_INTERVAL)
+            try:
+                self.flush()
+            except OSError as exc:
+                print(f"METRICS ERROR: flush failed: {exc}", file=sys.stderr)
+
+    def flush(self):
+        if not self.directory:
+            return
+        path = os.path.join(self.directory, f"{os.getpid()}.json")
+        with open(path + ".tmp", "w", encoding="utf-8") as fh:
+            json.dump(self.snapshot(), fh)
+        os.replace(path + ".tmp", path)
+
+    def collect(self) -> Dict[str, Dict[str, List[float]]]:
+        merged = self.snapshot()
+        if not self.directory:
+            return merged
+        own = f"{os.getpid()}.json"
+        for entry in os.listdir(self.directory):
+            if not entry.endswith(".json") or entry == own:
+                continue
+            try:
+                with open(os.path.join(self.directory, entry), encoding="utf-8") as fh:
+                    data = json.load(fh)
+            except (OSError, ValueError):
+                continue
+            for name, series in data.items():
+                target = merged.setdefault(name, {})
+                for key, row in series.items():
+                    current = target.get(key)
+                    if current is None:
+                        target[key] = row
+                    elif len(current) == len(row):
+                        target[key] = [a + b for a, b in zip(current, row)]
+        return merged
+
+    def render(self) -> str:
+        """Prometheus text exposition format (version 0.0.4)."""
+        lines = []
+        for name, series in sorted(self.collect().items()):
+            if name not in METRIC_SPECS:
+                continue
+            help_text, buckets = METRIC_SPECS[name]
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} histogram")
+            bounds = [repr(float(bound)) for bound in buckets] + ["+Inf"]
+            for key, row in sorted(series.items()):
+                labels = ",".join(f'{label}="{escape_label(value)}"' for label, value in json.loads(key))
+                prefix = labels + "," if labels else ""
+                cumulative = 0
+                for bound, count in zip(bounds, row[:-1]):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{{{prefix}le="{bound}"}} {cumulative}')
+                suffix = "{" + labels + "}" if labels else ""
+                lines.append(f"{name}_sum{suffix} {row[-1]}")
+                lines.append(f"{name}_count{suffix} {cumulative}")
+        return "\n".join(lines) + "\n"
+
+
+def escape_label(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+METRICS = Metrics(METRICS_DIR)
+# Context-local rather than thread-local, so it follows a request that asgi.py
+# runs across several executor threads.
+_REQUEST_STATS = Local()
+
+
+def _record_sql(started: float):
+    stats = getattr(_REQUEST_STATS, "current", None)
+    if stats is not None:
+        stats[0] += 1
+        stats[1] += time.perf_counter() - started
+
+
+class TimedCursor(sqlite3.Cursor):
+    def execute(self, sql, parameters=()):
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            _record_sql(started)
+
+    def executemany(self, sql, seq_of_parameters):
+        started = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            _record_sql(started)
+
+
+class TimedConnection(sqlite3.Connection):
+    """Counts statements and their time against the request running on this thread."""
+
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            _record_sql(started)
+
+    def executemany(self, sql, seq_of_parameters):
+        started = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            _record_sql(started)
+
+
+class ConnectionPool:
+    """Bounded pool of SQLite connections shared by the worker threads of one process.
+
+    Connections are configured once (WAL, pragmas) when opened and handed out
+    per app context by get_db(). A forked worker drops the parent's idle
+    connections instead of reusing them.
+    """
+
+    def __init__(self, path: str, size: int, timeout: float):
+        self.path = path
+        self.size = max(size, 1)
+        self.timeout = timeout
+        self._cond = threading.Condition()
+        self._idle: List[sqlite3.Connection] = []
+        self._open = 0
+        self._pid = os.getpid()
+        self.checkouts = 0
+        self.waits = 0
+        self.wait_seconds = 0.0
+        self.opened = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=self.timeout, check_same_thread=False, factory=TimedConnection)
+        conn.row_factory = sqlite3.Row
+        for pragma in DB_PRAGMAS:
+            conn.execute(pragma)
+        conn.create_function("search_normalize", 1, normalize_search_text, deterministic=True)
+        return conn
+
+    def _check_fork(self):
+        if self._pid != os.getpid():
+            self._idle = []
+            self._open = 0
+            self._pid = os.getpid()
+
+    def acquire(self) -> sqlite3.Connection:
+        with self._cond:
+            self._check_fork()
+            self.checkouts += 1
+            if not self._idle and self._open >= self.size:
+                self.waits += 1
+                started = time.perf_counter()
+                ready = self._cond.wait_for(lambda: self._idle or self._open < self.size, timeout=self.timeout)
+                self.wait_seconds += time.perf_counter() - started
+                if not ready:
+                    raise RuntimeError("database pool exhausted")
+            if self._idle:
+                return self._idle.pop()
+            self._open += 1
+            self.opened += 1
+        try:
+            return self._connect()
+        except Exception:
+            with self._cond:
+                self._open -= 1
+                self._cond.notify()
+            raise
+
+    def release(self, conn: sqlite3.Connection):
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            with self._cond:
+                self._open -= 1
+                self._cond.notify()
+            conn.close()
+            return
+        with self._cond:
+            self._idle.append(conn)
+            self._cond.notify()
+
+    def close_all(self):
+        with self._cond:
+            idle, self._idle = self._idle, []
+            self._open -= len(idle)
+        for conn in idle:
+            conn.close()
+
+    def stats(self) -> Dict[str, float]:
+        with self._cond:
+            return {
+                "size": self.size,
+                "open": self._open,
+                "idle": len(self._idle),
+                "in_use": self._open - len(self._idle),
+                "checkouts": self.checkouts,
+                "waits": self.waits,
+                "wait_seconds": round(self.wait_seconds, 6),
+                "opened": self.opened,
+            }
+
+
+DB_POOL = ConnectionPool(DB_PATH, DB_POOL_SIZE, DB_POOL_TIMEOUT)
+
+
+def get_db() -> sqlite3.Connection:
+    conn: Optional[sqlite3.Connection] = g.get("db")
+    if conn is None:
+        conn = g.db = DB_POOL.acquire()
     return conn
 
 
-def send_payment_email(to_email: str):
-    if not (EMAIL_USER and EMAIL_APP_PASSWORD):
-        print("EMAIL ERROR: missing EMAIL_USER or EMAIL_APP_PASSWORD", file=sys.stderr)
+@app.teardown_appcontext
+def release_db(exc):
+    conn = g.pop("db", None)
+    if conn is not None:
+        DB_POOL.release(conn)
+
+
+def payment_email_content():
+    subject = "تأكيد الدفع — شكراً لتسوقك معنا"
+    body = "\n".join(
+        [
+            f"مرحباً،",
+            "",
+            "تم إكمال عملية الدفع بنجاح. نشكرك على ثقتك وتسوقك معنا.",
+            "نحن نجهّز طلبك الآن، وسنرسل لك تحديثاً فور تجهيز الشحنة.",
+            "",
+            "لو عندك أي سؤال أو تحتاج مساعدة، تقدر ترد على هذا الإيميل مباشرة.",
+            "",
+            "تحياتنا،",
+            EMAIL_SENDER_NAME,
+        ]
+    )
+    return subject, body
+
+
+def enqueue_email(conn: sqlite3.Connection, to_email: str, subject: str, body: str):
+    """Append a message to the durable outbox; it is sent once the caller commits."""
+    conn.execute(
+        """
+        INSERT INTO email_outbox (to_email, subject, body, status, attempts, next_attempt_at, created_at)
+        VALUES (?, ?, ?, 'pending', 0, ?, ?)
+        """,
+        (to_email, subject, body, time.time(), datetime.utcnow().isoformat()),
+    )
+
+
+def queue_payment_email(to_email: str):
+    if not EMAIL_USER:
+        print("EMAIL ERROR: missing EMAIL_USER", file=sys.stderr)
         return False
-    msg = EmailMessage()
-    msg["Subject"] = "تأكيد الدفع — شكراً لتسوقك معنا"
-    msg["From"] = f"{EMAIL_SENDER_NAME} <{EMAIL_USER}>"
-    msg["To"] = to_email
-    msg.set_content(
-        "\n".join(
-            [
-                f"مرحباً،",
-                "",
-                "تم إكمال عملية الدفع بنجاح. نشكرك على ثقتك وتسوقك معنا.",
-                "نحن نجهّز طلبك الآن، وسنرسل لك تحديثاً فور تجهيز الشحنة.",
-                "",
-                "لو عندك أي سؤال أو تحتاج مساعدة، تقدر ترد على هذا الإيميل مباشرة.",
-                "",
-                "تحياتنا،",
-                EMAIL_SENDER_NAME,
-            ]
+    conn = get_db()
+    subject, body = payment_email_content()
+    enqueue_email(conn, to_email, subject, body)
+    conn.commit()
+    EMAIL_SENDER.wake()
+    return True
+
+
+def claim_outbox_batch(conn: sqlite3.Connection, token: str, limit: int):
+    now = time.time()
+    conn.execute(
+        """
+        UPDATE email_outbox SET status = 'sending', claimed_by = ?, claimed_at = ?
+        WHERE id IN (
+            SELECT id FROM email_outbox
+            WHERE (status = 'pending' AND next_attempt_at <= ?)
+               OR (status = 'sending' AND claimed_at < ?)
+            ORDER BY next_attempt_at
+            LIMIT ?
         )
+        """,
+        (token, now, now, now - EMAIL_CLAIM_TIMEOUT, limit),
     )
-    try:
-        with smtplib.SMTP_SSL("smtp.gmail.com", 465, timeout=10) as smtp:
+    conn.commit()
+    return conn.execute(
+        "SELECT id, to_email, subject, body, attempts FROM email_outbox WHERE status = 'sending' AND claimed_by = ? ORDER BY id",
+        (token,),
+    ).fetchall()
+
+
+class BackgroundWorker:
+    """One daemon thread per process that runs drain_once() passes.
+
+    Subclasses implement drain_once(), which does one batch of work and
+    returns its size, and set `interval`, the seconds between passes unless
+    wake() is called. A pass repeats drain_once() while _keep_draining()
+    approves its result. Each name in `counters` starts at 0 and is reported
+    by stats().
+    """
+
+    thread_name = "background-worker"
+    error_label = "WORKER ERROR: worker"
+    interval = 60.0
+    counters = ()
+
+    def __init__(self):
+        self._wake = threading.Event()
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._pid = None
+        for name in self.counters:
+            setattr(self, name, 0)
+
+    def start(self):
+        """Start this process's thread if it is not running (e.g. after a fork)."""
+        if self._pid == os.getpid() and self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._pid != os.getpid() or self._thread is None or not self._thread.is_alive():
+                self._pid = os.getpid()
+                self._on_start()
+                self._thread = threading.Thread(target=self._run, name=self.thread_name, daemon=True)
+                self._thread.start()
+                self._wake.set()
+
+    def wake(self):
+        self.start()
+        self._wake.set()
+
+    def _on_start(self):
+        pass
+
+    def _after_pass(self):
+        pass
+
+    def _keep_draining(self, count: int) -> bool:
+        return count > 0
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            try:
+                while self._keep_draining(self.drain_once()):
+                    pass
+            except Exception as exc:
+                print(f"{self.error_label}: {exc}", file=sys.stderr)
+            self._after_pass()
+
+    def drain_once(self) -> int:
+        raise NotImplementedError
+
+    def stats(self) -> Dict[str, int]:
+        stats = {"alive": bool(self._thread and self._thread.is_alive())}
+        stats.update((name, getattr(self, name)) for name in self.counters)
+        return stats
+
+
+class EmailSender(BackgroundWorker):
+    """One background sender per process draining the email_outbox table.
+
+    It keeps a single authenticated SMTP connection open while there is work,
+    sends at most EMAIL_RATE_PER_SEC messages per second and reschedules
+    failures with exponential backoff until EMAIL_MAX_ATTEMPTS.
+    """
+
+    thread_name = "email-sender"
+    error_label = "EMAIL ERROR: outbox worker"
+    interval = EMAIL_POLL_INTERVAL
+    counters = ("sent", "retried", "failed", "connects")
+
+    def __init__(self):
+        super().__init__()
+        self._smtp = None
+        self._last_send = 0.0
+
+    def _on_start(self):
+        # A forked child must not share the parent's SMTP socket.
+        self._smtp = None
+
+    def _after_pass(self):
+        self._disconnect()
+
+    def close(self):
+        self._disconnect()
+
+    def _connect(self):
+        if self._smtp is not None:
+            return self._smtp
+        if SMTP_SSL:
+            smtp = smtplib.SMTP_SSL(SMTP_HOST, SMTP_PORT, timeout=SMTP_TIMEOUT)
+        else:
+            smtp = smtplib.SMTP(SMTP_HOST, SMTP_PORT, timeout=SMTP_TIMEOUT)
+        if EMAIL_APP_PASSWORD:
             smtp.login(EMAIL_USER, EMAIL_APP_PASSWORD)
-            smtp.send_message(msg)
-        return True
-    except Exception as exc:
-        print(f"EMAIL ERROR: {exc}", file=sys.stderr)
-        return False
+        self._smtp = smtp
+        self.connects += 1
+        return smtp
+
+    def _disconnect(self):
+        smtp, self._smtp = self._smtp, None
+        if smtp is not None:
+            try:
+                smtp.quit()
+            except Exception:
+                pass
+
+    def _throttle(self):
+        if EMAIL_RATE_PER_SEC <= 0:
+            return
+        wait = self._last_send + 1.0 / EMAIL_RATE_PER_SEC - time.monotonic()
+        if wait > 0:
+            time.sleep(wait)
+        self._last_send = time.monotonic()
+
+    def _send(self, row):
+        msg = EmailMessage()
+        msg["Subject"] = row["subject"]
+        msg["From"] = f"{EMAIL_SENDER_NAME} <{EMAIL_USER}>"
+        msg["To"] = row["to_email"]
+        msg.set_content(row["body"])
+        self._throttle()
+        started = time.perf_counter()
+        outcome = "error"
+        try:
+            try:
+                self._connect().send_message(msg)
+            except smtplib.SMTPServerDisconnected:
+                self._smtp = None
+                self._connect().send_message(msg)
+            outcome = "ok"
+        finally:
+            METRICS.observe("shop_email_send_seconds", time.perf_counter() - started, outcome=outcome)
+
+    def drain_once(self) -> int:
+        with app.app_context():
+            conn = get_db()
+            batch = claim_outbox_batch(conn, f"{os.getpid()}-{threading.get_ident()}", EMAIL_BATCH_SIZE)
+            for row in batch:
+                try:
+                    self._send(row)
+                except Exception as exc:
+                    self._disconnect()
+                    attempts = row["attempts"] + 1
+                    status = "failed" if attempts >= EMAIL_MAX_ATTEMPTS else "pending"
+                    delay = min(EMAIL_RETRY_BASE * 2 ** (attempts - 1), EMAIL_RETRY_MAX)
+                    conn.execute(
+                        """
+                        UPDATE email_outbox
+                        SET status = ?, attempts = ?, next_attempt_at = ?, last_error = ?, claimed_by = NULL
+                        WHERE id = ?
+                        """,
+                        (status, attempts, time.time() + delay, str(exc)[:500], row["id"]),
+                    )
+                    if status == "failed":
+                        self.failed += 1
+                        print(f"EMAIL ERROR: giving up on outbox #{row['id']}: {exc}", file=sys.stderr)
+                    else:
+                        self.retried += 1
+                else:
+                    conn.execute(
+                        """
+                        UPDATE email_outbox
+                        SET status = 'sent', attempts = attempts + 1, sent_at = ?, last_error = NULL, claimed_by = NULL
+                        WHERE id = ?
+                        """,
+                        (datetime.utcnow().isoformat(), row["id"]),
+                    )
+                    self.sent += 1
+                conn.commit()
+            return len(batch)
+
+
+EMAIL_SENDER = EmailSender()
+
+
+def append_webhook_event(conn: sqlite3.Connection, event_id: str, event_type: str, payload: str) -> bool:
+    """Log a verified Stripe event, fsynced before we acknowledge it.
+
+    Returns False when the event id is already in the log (a redelivery).
+    """
+    previous = conn.execute("PRAGMA synchronous").fetchone()[0]
+    conn.execute("PRAGMA synchronous=FULL")
+    try:
+        cur = conn.execute(
+            """
+            INSERT OR IGNORE INTO webhook_events (id, type, payload, status, received_at)
+            VALUES (?, ?, ?, 'pending', ?)
+            """,
+            (event_id, event_type, payload, time.time()),
+        )
+        conn.commit()
+    finally:
+        conn.execute(f"PRAGMA synchronous={int(previous)}")
+    return cur.rowcount == 1
+
+
+def webhook_order_status(event_type: str, obj: Dict) -> Optional[str]:
+    status = WEBHOOK_ORDER_STATUS.get(event_type)
+    if event_type == "checkout.session.completed" and obj.get("payment_status") == "unpaid":
+        # Delayed payment methods: wait for async_payment_succeeded/failed.
+        return None
+    return status
+
+
+class WebhookConsumer(BackgroundWorker):
+    """One background consumer per process applying logged webhook events.
+
+    Each pass takes up to WEBHOOK_BATCH_SIZE pending events under BEGIN
+    IMMEDIATE, so workers in several processes never apply the same event
+    twice, and writes all order updates of the batch in one transaction.
+    A paid order is never moved back to another status. Stock holds of the
+    same checkouts are settled in that transaction too (see settle_holds),
+    and newly paid orders are added to sales_daily (see roll_up_paid_orders).
+    """
+
+    thread_name = "webhook-consumer"
+    error_label = "WEBHOOK ERROR: consumer"
+    interval = WEBHOOK_POLL_INTERVAL
+    counters = ("processed", "failed", "batches")
 
+    def drain_once(self) -> int:
+        with app.app_context():
+            conn = get_db()
+            if not conn.execute("SELECT 1 FROM webhook_events WHERE status = 'pending' LIMIT 1").fetchone():
+                return 0
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                rows = conn.execute(
+                    "SELECT id, type, payload FROM webhook_events WHERE status = 'pending' ORDER BY received_at LIMIT ?",
+                    (WEBHOOK_BATCH_SIZE,),
+                ).fetchall()
+                now = time.time()
+                updates, outcomes, done, failed = [], [], [], []
+                for row in rows:
+                    try:
+                        obj = json.loads(row["payload"])["data"]["object"]
+                        status = webhook_order_status(row["type"], obj)
+                        if status:
+                            updates.append((status, obj["id"]))
+                        if row["type"] in WEBHOOK_ORDER_STATUS:
+                            outcomes.append((status, obj["id"]))
+                        done.append((now, row["id"]))
+                    except (KeyError, TypeError, ValueError) as exc:
+                        print(f"WEBHOOK ERROR: bad event {row['id']}: {exc}", file=sys.stderr)
+                        failed.append((now, str(exc)[:500], row["id"]))
+                roll_up_paid_orders(conn, [session_id for status, session_id in updates if status == "paid"])
+                conn.executemany(
+                    "UPDATE orders SET status = ? WHERE stripe_session_id = ? AND status != 'paid'",
+                    updates,
+                )
+                settle_holds(conn, outcomes)
+                conn.executemany(
+                    "UPDATE webhook_events SET status = 'processed', processed_at = ? WHERE id = ?",
+                    done,
+                )
+                conn.executemany(
+                    "UPDATE webhook_events SET status = 'failed', processed_at = ?, last_error = ? WHERE id = ?",
+                    failed,
+                )
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            self.processed += len(done)
+            self.failed += len(failed)
+            self.batches += 1
+            return len(rows)
 
-def send_payment_email_async(to_email: str):
-    thread = threading.Thread(target=send_payment_email, args=(to_email,), daemon=True)
-    thread.start()
+
+WEBHOOK_CONSUMER = WebhookConsumer()
+
+
+class StockSweeper(BackgroundWorker):
+    """One background thread per process putting back the stock of lapsed checkout holds.
+
+    A hold lapses STOCK_SWEEP_GRACE seconds after its expiry, which is also
+    its Stripe session's expires_at, so a payment webhook that arrives late
+    still finds it. Sweeps run under BEGIN IMMEDIATE, in batches of
+    STOCK_SWEEP_BATCH, so two processes never release the same hold.
+    """
+
+    thread_name = "stock-sweeper"
+    error_label = "STOCK ERROR: sweeper"
+    interval = STOCK_SWEEP_INTERVAL
+    counters = ("released", "sweeps")
+
+    def _keep_draining(self, count: int) -> bool:
+        # A short batch means nothing else had lapsed.
+        return count >= STOCK_SWEEP_BATCH
+
+    def drain_once(self) -> int:
+        with app.app_context():
+            conn = get_db()
+            cutoff = time.time() - STOCK_SWEEP_GRACE
+            if not conn.execute("SELECT 1 FROM stock_holds WHERE expires_at < ? LIMIT 1", (cutoff,)).fetchone():
+                return 0
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                released = release_holds(
+                    conn,
+                    "rowid IN (SELECT rowid FROM stock_holds WHERE expires_at < ? LIMIT ?)",
+                    (cutoff, STOCK_SWEEP_BATCH),
+                )
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            self.released += released
+            self.sweeps += 1
+            return released
+
+
+STOCK_SWEEPER = StockSweeper()
+
+
+def compute_release_id() -> str:
+    """Fingerprint of the code and templates, so a deploy invalidates every page ETag."""
+    digest = hashlib.sha1()
+    paths = [os.path.abspath(__file__)]
+    for root, _, files in os.walk(os.path.join(app.root_path, app.template_folder)):
+        paths.extend(os.path.join(root, name) for name in files)
+    for path in sorted(paths):
+        with open(path, "rb") as fh:
+            digest.update(fh.read())
+    return digest.hexdigest()[:12]
+
+
+RELEASE_ID = compute_release_id()
+
+
+def page_etag(*parts) -> str:
+    raw = "|".join(str(part) for part in (RELEASE_ID,) + parts)
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()[:24]
+
+
+def not_modified(etag: str):
+    """Short-circuit with a 304 when the client already holds this representation."""
+    if "_flashes" in session or not request.if_none_match.contains_weak(etag):
+        return None
+    resp = app.response_class(status=304)
+    resp.set_etag(etag)
+    return resp
+
+
+def with_etag(body, etag: str):
+    resp = make_response(body)
+    resp.set_etag(etag)
+    return resp
+
+
+def compress_bytes(data: bytes, encoding: str) -> bytes:
+    level = COMPRESS_LEVELS[encoding]
+    if encoding == "br":
+        return brotli.compress(data, quality=level)
+    if encoding == "zstd":
+        return zstandard.ZstdCompressor(level=level).compress(data)
+    return gzip.compress(data, compresslevel=level, mtime=0)
+
+
+def compress_stream(chunks, encoding: str):
+    """Compress a streamed body, flushing after every chunk so the client still sees it incrementally."""
+    level = COMPRESS_LEVELS[encoding]
+    if encoding == "br":
+        compressor = brotli.Compressor(quality=level)
+        step, flush, finish = compressor.process, compressor.flush, compressor.finish
+    elif encoding == "zstd":
+        compressor = zstandard.ZstdCompressor(level=level).compressobj()
+        step, finish = compressor.compress, compressor.flush
+        flush = lambda: compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)  # noqa: E731
+    else:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+        step, finish = compressor.compress, compressor.flush
+        flush = lambda: compressor.flush(zlib.Z_SYNC_FLUSH)  # noqa: E731
+    try:
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode("utf-8")
+            out = step(chunk) + flush()
+            if out:
+                yield out
+        yield finish()
+    finally:
+        if hasattr(chunks, "close"):
+            chunks.close()
+
+
+def negotiate_encoding() -> Optional[str]:
+    accepted = request.accept_encodings
+    for encoding in COMPRESS_LEVELS:
+        if encoding == "br" and brotli is None or encoding == "zstd" and zstandard is None:
+            continue
+        if accepted[encoding]:
+            return encoding
+    return None
+
+
+@app.after_request
+def compress_response(resp):
+    """Registered first so it runs after every other after_request hook."""
+    threshold = COMPRESS_POLICY.get(resp.mimetype)
+    if (
+        not COMPRESS_ENABLED
+        or threshold is None
+        or resp.direct_passthrough
+        or request.method == "HEAD"
+        or resp.status_code < 200
+        or resp.status_code in (204, 206, 304)
+        or "Content-Encoding" in resp.headers
+        or "no-transform" in resp.headers.get("Cache-Control", "")
+    ):
+        return resp
+    resp.vary.add("Accept-Encoding")
+    encoding = negotiate_encoding()
+    if encoding is None:
+        return resp
+    if resp.is_streamed:
+        resp.response = compress_stream(resp.response, encoding)
+        resp.headers.pop("Content-Length", None)
+    else:
+        data = resp.get_data()
+        if len(data) < threshold:
+            return resp
+        if len(data) <= COMPRESS_CACHE_MAX_BODY:
+            # Keyed by content, so every repeat of a cached page reuses one compression.
+            key = ("compressed", encoding, hashlib.blake2b(data, digest_size=16).digest())
+            body = COMPRESSED_CACHE.get_or_render(key, lambda: compress_bytes(data, encoding))
+        else:
+            body = compress_bytes(data, encoding)
+        resp.set_data(body)
+    resp.headers["Content-Encoding"] = encoding
+    etag, weak = resp.get_etag()
+    if etag and not weak:
+        # Same entity, different bytes: a weak validator still matches If-None-Match.
+        resp.set_etag(etag, weak=True)
+    return resp
+
+
+@app.after_request
+def add_cache_headers(resp):
+    policy = CACHE_CONTROL.get(request.endpoint or "")
+    if policy and "Cache-Control" not in resp.headers:
+        resp.headers["Cache-Control"] = policy
+    if request.endpoint in ("index", "product", "cart"):
+        resp.vary.add("Cookie")
+    return resp
+
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+    _REQUEST_STATS.current = [0, 0.0]
+    _REQUEST_STATS.renders = []
+
+
+@app.after_request
+def record_request_metrics(resp):
+    started = g.pop("request_started", None)
+    if started is None:
+        return resp
+    route = request.url_rule.rule if request.url_rule else "<unmatched>"
+    METRICS.observe(
+        "shop_http_request_duration_seconds",
+        time.perf_counter() - started,
+        route=route,
+        method=request.method,
+        status=str(resp.status_code),
+    )
+    queries, sql_seconds = _REQUEST_STATS.current
+    _REQUEST_STATS.current = None
+    METRICS.observe("shop_http_request_sql_queries", queries, route=route)
+    METRICS.observe("shop_http_request_sql_seconds", sql_seconds, route=route)
+    return resp
+
+
+@before_render_template.connect_via(app)
+def start_render_timer(sender, template, context, **extra):
+    if not hasattr(_REQUEST_STATS, "renders"):
+        _REQUEST_STATS.renders = []
+    _REQUEST_STATS.renders.append(time.perf_counter())
+
+
+@template_rendered.connect_via(app)
+def record_render_time(sender, template, context, **extra):
+    renders = getattr(_REQUEST_STATS, "renders", None)
+    if renders:
+        METRICS.observe("shop_template_render_seconds", time.perf_counter() - renders.pop(), template=template.name or "<string>")
+
+
+class StackSampler:
+    """Samples the stacks of registered threads every PROFILE_INTERVAL seconds.
+
+    The sampling thread only runs while at least one request is registered.
+    """
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._targets: Dict[int, Dict[str, int]] = {}
+        self._thread: Optional[threading.Thread] = None
+
+    def register(self, thread_id: int) -> Dict[str, int]:
+        counts: Dict[str, int] = {}
+        with self._lock:
+            self._targets[thread_id] = counts
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+                self._thread.start()
+        return counts
+
+    def unregister(self, thread_id: int):
+        with self._lock:
+            self._targets.pop(thread_id, None)
+
+    def _run(self):
+        while True:
+            with self._lock:
+                if not self._targets:
+                    self._thread = None
+                    return
+                targets = list(self._targets.items())
+            frames = sys._current_frames()
+            for thread_id, counts in targets:
+                frame = frames.get(thread_id)
+                if frame is not None:
+                    stack = collapse_stack(frame)
+                    counts[stack] = counts.get(stack, 0) + 1
+            del frames
+            time.sleep(self.interval)
+
+
+def collapse_stack(frame) -> str:
+    """Root-first "func (file:line);..." string, one line of a collapsed-stack file."""
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+class SlowRequestProfiler:
+    """Profiles a PROFILE_SAMPLE_RATE fraction of requests to PROFILE_ENDPOINTS.
+
+    A capture is kept only when the request took at least PROFILE_SLOW_MS.
+    "sample" mode collects collapsed stacks from StackSampler, which is cheap
+    enough to leave on in production. "cprofile" mode records full pstats for
+    the request thread at a much higher cost. Kept captures go to PROFILE_DIR,
+    shared by all workers, which holds the newest PROFILE_KEEP of them.
+    """
+
+    ID_PATTERN = re.compile(r"^\d+-\d+-\d+$")
+
+    def __init__(self, directory: str, keep: int):
+        self.directory = directory
+        self.keep = max(keep, 1)
+        self.sampler = StackSampler(PROFILE_INTERVAL)
+        self._seq = 0
+        self._lock = threading.Lock()
+
+    def begin(self, endpoint: Optional[str]):
+        if PROFILE_SAMPLE_RATE <= 0 or endpoint not in PROFILE_ENDPOINTS or random.random() >= PROFILE_SAMPLE_RATE:
+            return None
+        if PROFILE_MODE == "cprofile":
+            profiler = cProfile.Profile()
+            profiler.enable()
+            return ("cprofile", profiler, time.perf_counter())
+        thread_id = threading.get_ident()
+        return ("sample", (thread_id, self.sampler.register(thread_id)), time.perf_counter())
+
+    def end(self, capture, status: Optional[int] = None):
+        mode, state, started = capture
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        if mode == "cprofile":
+            state.disable()
+        else:
+            self.sampler.unregister(state[0])
+        if status is None or elapsed_ms < PROFILE_SLOW_MS:
+            return
+        if mode == "sample" and not state[1]:
+            return
+        if mode == "cprofile":
+            state.create_stats()
+            data, ext = marshal.dumps(state.stats), "pstats"
+        else:
+            lines = [f"{stack} {count}" for stack, count in sorted(state[1].items())]
+            data, ext = ("\n".join(lines) + "\n").encode("utf-8"), "collapsed"
+        meta = {
+            "endpoint": request.endpoint,
+            "method": request.method,
+            "path": request.full_path.rstrip("?"),
+            "status": status,
+            "duration_ms": round(elapsed_ms, 1),
+            "captured_at": datetime.utcnow().isoformat(),
+            "format": ext,
+        }
+        try:
+            self._save(meta, data)
+        except OSError as exc:
+            print(f"PROFILE ERROR: could not save capture: {exc}", file=sys.stderr)
+
+    def _save(self, meta: Dict, data: bytes):
+        os.makedirs(self.directory, exist_ok=True)
+        with self._lock:
+            self._seq += 1
+            capture_id = f"{int(time.time() * 1000)}-{os.getpid()}-{self._seq}"
+        meta["id"] = capture_id
+        with open(os.path.join(self.directory, f"{capture_id}.{meta['format']}"), "wb") as fh:
+            fh.write(data)
+        with open(os.path.join(self.directory, f"{capture_id}.json"), "w", encoding="utf-8") as fh:
+            json.dump(meta, fh)
+        for old in self.list()[self.keep:]:
+            for ext in (old["format"], "json"):
+                try:
+                    os.remove(os.path.join(self.directory, f"{old['id']}.{ext}"))
+                except OSError:
+                    pass
+
+    def list(self) -> List[Dict]:
+        """Capture metadata, newest first."""
+        try:
+            names = [name for name in os.listdir(self.directory) if name.endswith(".json")]
+        except OSError:
+            return []
+        captures = []
+        for name in sorted(names, key=lambda n: [int(part) for part in n[:-5].split("-")], reverse=True):
+            try:
+                with open(os.path.join(self.directory, name), encoding="utf-8") as fh:
+                    captures.append(json.load(fh))
+            except (OSError, ValueError):
+                continue
+        return captures
+
+    def path_for(self, capture_id: str) -> Optional[str]:
+        if not self.ID_PATTERN.match(capture_id):
+            return None
+        for ext in ("collapsed", "pstats"):
+            path = os.path.join(self.directory, f"{capture_id}.{ext}")
+            if os.path.exists(path):
+                return path
+        return None
+
+
+PROFILER = SlowRequestProfiler(PROFILE_DIR, PROFILE_KEEP)
+
+
+@app.before_request
+def start_profile():
+    g.profile = PROFILER.begin(request.endpoint)
+
+
+@app.after_request
+def finish_profile(resp):
+    capture = g.pop("profile", None)
+    if capture is not None:
+        PROFILER.end(capture, resp.status_code)
+    return resp
+
+
+@app.teardown_request
+def abandon_profile(exc):
+    # Only reached with a live capture when after_request did not run.
+    capture = g.pop("profile", None)
+    if capture is not None:
+        PROFILER.end(capture)
+
+
+def require_admin():
+    if not ADMIN_TOKEN:
+        abort(404)
+    supplied = request.headers.get("Authorization", "")
+    if not hmac.compare_digest(supplied.encode("utf-8"), f"Bearer {ADMIN_TOKEN}".encode("utf-8")):
+        abort(403)
 
 
 @app.after_request
@@ -398,9 +1603,9 @@ def add_security_headers(resp):
     return resp
 
 
-def init_db():
-    conn = get_db()
-    cur = conn.cursor()
+def migrate_base_tables(cur: sqlite3.Cursor):
+    # UNIQUE gives sku its own index (sqlite_autoindex_products_1), which serves
+    # every lookup by sku: upsert conflicts, import diffs and stock updates.
     cur.execute(
         """
         CREATE TABLE IF NOT EXISTS products (
@@ -455,107 +1660,1317 @@ def init_db():
         )
         """
     )
-    conn.commit()
-
-    for item in PRODUCTS_SEED:
-        cur.execute(
-            """
-            INSERT INTO products (
-                sku, name_en, name_ar, price_cents, image,
-                category_en, category_ar, badge_en, badge_ar,
-                description_en, description_ar
-            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            ON CONFLICT(sku) DO UPDATE SET
-                name_en=excluded.name_en,
-                name_ar=excluded.name_ar,
-                price_cents=excluded.price_cents,
-                image=excluded.image,
-                category_en=excluded.category_en,
-                category_ar=excluded.category_ar,
-                badge_en=excluded.badge_en,
-                badge_ar=excluded.badge_ar,
-                description_en=excluded.description_en,
-                description_ar=excluded.description_ar
-            """,
-            (
-                item["sku"],
-                item["name_en"],
-                item["name_ar"],
-                item["price_cents"],
-                item["image"],
-                item["category_en"],
-                item["category_ar"],
-                item["badge_en"],
-                item["badge_ar"],
-                item["description_en"],
-                item["description_ar"],
-            ),
-        )
-    conn.commit()
-    conn.close()
 
 
-def ensure_db():
-    global DB_INITIALIZED
-    if DB_INITIALIZED:
-        return
-    with DB_INIT_LOCK:
-        if DB_INITIALIZED:
-            return
-        try:
-            init_db()
-        except Exception as exc:
-            print(f"DB INIT ERROR: {exc}", file=sys.stderr)
-            raise
-        DB_INITIALIZED = True
+def migrate_app_meta(cur: sqlite3.Cursor):
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS app_meta (
+            key TEXT PRIMARY KEY,
+            value INTEGER NOT NULL
+        )
+        """
+    )
 
 
-def get_lang():
-    lang = request.args.get("lang") or session.get("lang") or "ar"
-    if lang not in ("ar", "en"):
-        lang = "ar"
-    session["lang"] = lang
-    return lang
+def migrate_catalog_indexes(cur: sqlite3.Cursor):
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_products_category_price ON products (category_en, price_cents, id)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_products_price ON products (price_cents, id)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_products_badge ON products (badge_en, id)")
 
 
-def get_session_id() -> str:
-    sid = session.get("sid")
-    if not sid:
-        sid = os.urandom(8).hex()
-        session["sid"] = sid
-    return sid
+def migrate_comment_counts(cur: sqlite3.Cursor):
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS comment_counts (
+            product_id INTEGER PRIMARY KEY,
+            count INTEGER NOT NULL
+        )
+        """
+    )
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_comments_product ON comments (product_id, id DESC)")
+    cur.execute("DELETE FROM comment_counts")
+    cur.execute("INSERT INTO comment_counts (product_id, count) SELECT product_id, COUNT(*) FROM comments GROUP BY product_id")
 
 
-def fetch_products() -> List[sqlite3.Row]:
-    ensure_db()
+def migrate_email_outbox(cur: sqlite3.Cursor):
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS email_outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            to_email TEXT NOT NULL,
+            subject TEXT NOT NULL,
+            body TEXT NOT NULL,
+            status TEXT NOT NULL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at REAL NOT NULL,
+            claimed_by TEXT,
+            claimed_at REAL,
+            last_error TEXT,
+            created_at TEXT NOT NULL,
+            sent_at TEXT
+        )
+        """
+    )
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_email_outbox_due ON email_outbox (status, next_attempt_at)")
+
+
+def migrate_seed_state(cur: sqlite3.Cursor):
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS seed_state (
+            name TEXT PRIMARY KEY,
+            checksum TEXT NOT NULL,
+            applied_at TEXT NOT NULL
+        )
+        """
+    )
+
+
+def migrate_sessions(cur: sqlite3.Cursor):
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS sessions (
+            id TEXT PRIMARY KEY,
+            data TEXT NOT NULL,
+            expires_at REAL NOT NULL
+        )
+        """
+    )
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_sessions_expires ON sessions (expires_at)")
+
+
+def migrate_webhook_events(cur: sqlite3.Cursor):
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS webhook_events (
+            id TEXT PRIMARY KEY,
+            type TEXT NOT NULL,
+            payload TEXT NOT NULL,
+            status TEXT NOT NULL,
+            received_at REAL NOT NULL,
+            processed_at REAL,
+            last_error TEXT
+        )
+        """
+    )
+    cur.execute(
+        "CREATE INDEX IF NOT EXISTS idx_webhook_events_pending ON webhook_events (received_at) WHERE status = 'pending'"
+    )
+    cur.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_orders_stripe_session ON orders (stripe_session_id)")
+
+
+def migrate_inventory(cur: sqlite3.Cursor):
+    # NULL stock means the product is not tracked and never runs out.
+    cur.execute("ALTER TABLE products ADD COLUMN stock INTEGER CHECK (stock IS NULL OR stock >= 0)")
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS stock_holds (
+            hold_key TEXT NOT NULL,
+            product_id INTEGER NOT NULL,
+            quantity INTEGER NOT NULL,
+            expires_at REAL,
+            stripe_session_id TEXT,
+            PRIMARY KEY (hold_key, product_id)
+        )
+        """
+    )
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_stock_holds_expires ON stock_holds (expires_at) WHERE expires_at IS NOT NULL")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_stock_holds_session ON stock_holds (stripe_session_id)")
+    # Stock moves on every checkout; only edits to searchable text should re-index a product.
+    cur.execute("DROP TRIGGER IF EXISTS products_fts_update")
+    columns = ", ".join(SEARCH_COLUMNS)
+    cur.execute(
+        f"""
+        CREATE TRIGGER products_fts_update AFTER UPDATE OF {columns} ON products BEGIN
+            DELETE FROM products_fts WHERE rowid = old.id;
+            INSERT INTO products_fts (rowid, {columns}) VALUES (new.id, {SEARCH_VALUES.format(prefix="new.")});
+        END
+        """
+    )
+
+
+def migrate_order_reporting(cur: sqlite3.Cursor):
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_orders_created ON orders (created_at)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_orders_status_created ON orders (status, created_at)")
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_order_items_order ON order_items (order_id)")
+    # Paid sales per product per UTC day of the order; see roll_up_paid_orders().
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS sales_daily (
+            day TEXT NOT NULL,
+            product_id INTEGER NOT NULL,
+            units INTEGER NOT NULL,
+            revenue_cents INTEGER NOT NULL,
+            orders INTEGER NOT NULL,
+            PRIMARY KEY (day, product_id)
+        ) WITHOUT ROWID
+        """
+    )
+    rebuild_sales_daily(cur)
+
+
+SALES_ROLLUP = """
+    INSERT INTO sales_daily (day, product_id, units, revenue_cents, orders)
+    SELECT substr(o.created_at, 1, 10), i.product_id, SUM(i.quantity), SUM(i.quantity * i.price_cents), COUNT(DISTINCT o.id)
+    FROM orders o JOIN order_items i ON i.order_id = o.id
+    WHERE {where}
+    GROUP BY 1, 2
+    ON CONFLICT (day, product_id) DO UPDATE SET
+        units = units + excluded.units,
+        revenue_cents = revenue_cents + excluded.revenue_cents,
+        orders = orders + excluded.orders
+"""
+
+
+def rebuild_sales_daily(cur):
+    """Recompute sales_daily from every paid order; the caller commits."""
+    cur.execute("DELETE FROM sales_daily")
+    cur.execute(SALES_ROLLUP.format(where="o.status = 'paid'"))
+
+
+def migrate_related_products(cur: sqlite3.Cursor):
+    # The co-purchase self-join reads only (order_id, product_id); covering it halves the rebuild.
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_order_items_order_product ON order_items (order_id, product_id)")
+    cur.execute("DROP INDEX IF EXISTS idx_order_items_order")
+    # Paid orders containing both products, stored in both directions.
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS co_purchases (
+            product_id INTEGER NOT NULL,
+            other_id INTEGER NOT NULL,
+            orders INTEGER NOT NULL,
+            PRIMARY KEY (product_id, other_id)
+        ) WITHOUT ROWID
+        """
+    )
+    # The top RELATED_TOP_K of each product's co_purchases, packed as RELATED_ENTRY records.
+    cur.execute(
+        """
+        CREATE TABLE IF NOT EXISTS related_products (
+            product_id INTEGER PRIMARY KEY,
+            related BLOB NOT NULL
+        )
+        """
+    )
+    rebuild_related(cur)
+
+
+CO_PURCHASE_PAIRS = """
+    SELECT a.product_id, b.product_id, COUNT(*)
+    FROM orders o
+    JOIN order_items a ON a.order_id = o.id
+    JOIN order_items b ON b.order_id = o.id AND b.product_id != a.product_id
+    WHERE {where}
+    GROUP BY 1, 2
+"""
+RELATED_UPSERT = """
+    INSERT INTO related_products (product_id, related) VALUES (?, ?)
+    ON CONFLICT (product_id) DO UPDATE SET related = excluded.related
+"""
+
+
+def pack_related(entries) -> bytes:
+    """The top RELATED_TOP_K of (other_id, orders) pairs, most orders first, as one blob."""
+    top = sorted(entries, key=lambda entry: (-entry[1], entry[0]))[:RELATED_TOP_K]
+    return b"".join(RELATED_ENTRY.pack(other_id, orders) for other_id, orders in top)
+
+
+def unpack_related(blob: bytes):
+    return list(RELATED_ENTRY.iter_unpack(blob))
+
+
+def rebuild_related(cur):
+    """Recount co_purchases from every paid order and rewrite every top-K array; the caller commits.
+
+    Runs as one write transaction, so checkouts and webhooks wait for it:
+    on a large order history run it at deploy time or in a quiet hour.
+    Day to day, roll_up_paid_orders() keeps both tables exact.
+    """
+    cur.execute("DELETE FROM co_purchases")
+    cur.execute(
+        "INSERT INTO co_purchases (product_id, other_id, orders) " + CO_PURCHASE_PAIRS.format(where="o.status = 'paid'")
+    )
+    cur.execute("DELETE FROM related_products")
+    ranked = cur.connection.execute(
+        """
+        SELECT product_id, other_id, orders FROM (
+            SELECT product_id, other_id, orders,
+                   ROW_NUMBER() OVER (PARTITION BY product_id ORDER BY orders DESC, other_id) AS rank
+            FROM co_purchases
+        )
+        WHERE rank <= ?
+        ORDER BY product_id, rank
+        """,
+        (RELATED_TOP_K,),
+    )
+    cur.executemany(
+        RELATED_UPSERT,
+        (
+            (product_id, pack_related((row[1], row[2]) for row in group))
+            for product_id, group in groupby(ranked, key=lambda row: row[0])
+        ),
+    )
+
+
+SEED_COLUMNS = (
+    "sku",
+    "name_en",
+    "name_ar",
+    "price_cents",
+    "image",
+    "category_en",
+    "category_ar",
+    "badge_en",
+    "badge_ar",
+    "description_en",
+    "description_ar",
+)
+PRODUCT_UPSERT = """
+    INSERT INTO products (
+        sku, name_en, name_ar, price_cents, image,
+        category_en, category_ar, badge_en, badge_ar,
+        description_en, description_ar
+    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT(sku) DO UPDATE SET
+        name_en=excluded.name_en,
+        name_ar=excluded.name_ar,
+        price_cents=excluded.price_cents,
+        image=excluded.image,
+        category_en=excluded.category_en,
+        category_ar=excluded.category_ar,
+        badge_en=excluded.badge_en,
+        badge_ar=excluded.badge_ar,
+        description_en=excluded.description_en,
+        description_ar=excluded.description_ar
+    WHERE (
+        name_en, name_ar, price_cents, image, category_en, category_ar,
+        badge_en, badge_ar, description_en, description_ar
+    ) IS NOT (
+        excluded.name_en, excluded.name_ar, excluded.price_cents, excluded.image,
+        excluded.category_en, excluded.category_ar, excluded.badge_en, excluded.badge_ar,
+        excluded.description_en, excluded.description_ar
+    )
+"""
+
+
+def seed_checksum() -> str:
+    raw = json.dumps(PRODUCTS_SEED, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+def seed_products(conn: sqlite3.Connection) -> bool:
+    """Upsert PRODUCTS_SEED in one executemany, unless this exact seed was already applied."""
+    checksum = seed_checksum()
+    row = conn.execute("SELECT checksum FROM seed_state WHERE name = 'products'").fetchone()
+    if row and row["checksum"] == checksum:
+        return False
+    conn.executemany(PRODUCT_UPSERT, [tuple(item[col] for col in SEED_COLUMNS) for item in PRODUCTS_SEED])
+    # Opening stock only: a reseed never resets the live count of a tracked product.
+    conn.executemany(
+        "UPDATE products SET stock = ? WHERE sku = ? AND stock IS NULL",
+        [(item["stock"], item["sku"]) for item in PRODUCTS_SEED if "stock" in item],
+    )
+    conn.execute(
+        """
+        INSERT INTO seed_state (name, checksum, applied_at) VALUES ('products', ?, ?)
+        ON CONFLICT(name) DO UPDATE SET checksum = excluded.checksum, applied_at = excluded.applied_at
+        """,
+        (checksum, datetime.utcnow().isoformat()),
+    )
+    bump_version(conn, "catalog_version")
+    conn.commit()
+    return True
+
+
+def migrate_db(conn: sqlite3.Connection) -> List[int]:
+    """Apply pending MIGRATIONS in order, each in its own write-locked transaction.
+
+    Safe to call from several processes at once: the version check happens
+    under BEGIN IMMEDIATE, so a migration another process already applied is
+    skipped.
+    """
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            applied_at TEXT NOT NULL
+        )
+        """
+    )
+    conn.commit()
+    current = conn.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version").fetchone()[0]
+    applied = []
+    for version, name, migrate in MIGRATIONS:
+        if version <= current:
+            continue
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if not conn.execute("SELECT 1 FROM schema_version WHERE version = ?", (version,)).fetchone():
+                migrate(conn.cursor())
+                conn.execute(
+                    "INSERT INTO schema_version (version, name, applied_at) VALUES (?, ?, ?)",
+                    (version, name, datetime.utcnow().isoformat()),
+                )
+                applied.append(version)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    return applied
+
+
+def init_db():
+    """Bring the schema up to date and apply the product seed.
+
+    Runs once per deploy from `flask init-db`, the gunicorn on_starting hook
+    or `python app.py`; request handlers never call it.
+    """
     conn = get_db()
-    cur = conn.cursor()
-    cur.execute("SELECT * FROM products")
+    applied = migrate_db(conn)
+    seeded = seed_products(conn)
+    return applied, seeded
+
+
+SEARCH_COLUMNS = ("name_en", "name_ar", "description_en", "description_ar", "category_en", "category_ar", "sku")
+# bm25 weight per SEARCH_COLUMNS entry: names first, then sku, categories, descriptions.
+SEARCH_WEIGHTS = "10.0, 10.0, 2.0, 2.0, 4.0, 4.0, 6.0"
+SEARCH_VALUES = ", ".join(f"search_normalize({{prefix}}{col})" for col in SEARCH_COLUMNS)
+
+
+def init_search_index(cur: sqlite3.Cursor):
+    """Create the FTS5 index over products and the triggers that keep it in sync.
+
+    Indexed text is pre-normalised by search_normalize(), which every pooled
+    connection registers, so Arabic spelling variants match each other.
+    """
+    cur.execute(
+        f"""
+        CREATE VIRTUAL TABLE IF NOT EXISTS products_fts USING fts5(
+            {", ".join(SEARCH_COLUMNS)},
+            tokenize = 'unicode61 remove_diacritics 2',
+            prefix = '2 3'
+        )
+        """
+    )
+    columns = ", ".join(SEARCH_COLUMNS)
+    values = SEARCH_VALUES.format(prefix="new.")
+    cur.execute(
+        f"""
+        CREATE TRIGGER IF NOT EXISTS products_fts_insert AFTER INSERT ON products BEGIN
+            INSERT INTO products_fts (rowid, {columns}) VALUES (new.id, {values});
+        END
+        """
+    )
+    cur.execute(
+        f"""
+        CREATE TRIGGER IF NOT EXISTS products_fts_update AFTER UPDATE ON products BEGIN
+            DELETE FROM products_fts WHERE rowid = old.id;
+            INSERT INTO products_fts (rowid, {columns}) VALUES (new.id, {values});
+        END
+        """
+    )
+    cur.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS products_fts_delete AFTER DELETE ON products BEGIN
+            DELETE FROM products_fts WHERE rowid = old.id;
+        END
+        """
+    )
+    cur.execute(f"INSERT INTO products_fts (products_fts, rank) VALUES ('rank', 'bm25({SEARCH_WEIGHTS})')")
+    rebuild_search_index(cur)
+
+
+def rebuild_search_index(cur):
+    """Re-index every product from scratch; the caller commits."""
+    cur.execute("DELETE FROM products_fts")
+    cur.execute(
+        f"INSERT INTO products_fts (rowid, {', '.join(SEARCH_COLUMNS)}) "
+        f"SELECT id, {SEARCH_VALUES.format(prefix='')} FROM products"
+    )
+    cur.execute("INSERT INTO products_fts (products_fts) VALUES ('optimize')")
+
+
+MIGRATIONS = [
+    (1, "base tables", migrate_base_tables),
+    (2, "app_meta version counters", migrate_app_meta),
+    (3, "products full-text index", init_search_index),
+    (4, "catalog filter indexes", migrate_catalog_indexes),
+    (5, "comment index and counts", migrate_comment_counts),
+    (6, "email outbox", migrate_email_outbox),
+    (7, "seed state", migrate_seed_state),
+    (8, "server-side sessions", migrate_sessions),
+    (9, "webhook event log", migrate_webhook_events),
+    (10, "stock and checkout holds", migrate_inventory),
+    (11, "order reporting indexes and daily sales", migrate_order_reporting),
+    (12, "co-purchase index", migrate_related_products),
+]
+
+
+def build_search_tiers(q: str) -> List[str]:
+    """FTS queries from best to broadest: whole words in a name, prefixes in a name, prefixes anywhere."""
+    tokens = re.findall(r"\w+", normalize_search_text(q))[:8]
+    if not tokens:
+        return []
+    words = " ".join(f'"{token}"' for token in tokens)
+    prefixes = " ".join(f'"{token}"*' for token in tokens)
+    return [f"{{name_en name_ar}} : ({words})", f"{{name_en name_ar}} : ({prefixes})", prefixes]
+
+
+def search_products(q: str, lang: str, page: int, per_page: int):
+    """Ranked FTS lookup over at most SEARCH_CANDIDATES products.
+
+    Candidates are collected tier by tier (see build_search_tiers), each
+    tier in catalog order and scored by bm25 as it is read, until the cap is
+    reached. Results are ordered by tier, then score, so an exact name match
+    always leads however many descriptions mention the word, and a broad
+    prefix never scores more than the cap. Only the requested page is
+    looked up, through the catalog cache.
+    """
+    tiers = build_search_tiers(q)
+    conn = get_db()
+    candidates: Dict[int, tuple] = {}
+    for tier, match in enumerate(tiers):
+        matches = conn.execute(
+            f"SELECT rowid, bm25(products_fts, {SEARCH_WEIGHTS}) FROM products_fts WHERE products_fts MATCH ? LIMIT ?",
+            (match, SEARCH_CANDIDATES),
+        )
+        for rowid, score in matches:
+            candidates.setdefault(rowid, (tier, score))
+        if len(candidates) >= SEARCH_CANDIDATES:
+            break
+    ranked = sorted(candidates, key=candidates.get)[:SEARCH_CANDIDATES]
+    page_ids = ranked[(page - 1) * per_page : page * per_page]
+    rows = fetch_products_by_ids(page_ids)
+    results = [
+        {
+            "id": row["id"],
+            "sku": row["sku"],
+            "name": row[f"name_{lang}"],
+            "price_cents": row["price_cents"],
+            "image": row["image"],
+            "category": row[f"category_{lang}"],
+            "badge": row[f"badge_{lang}"],
+        }
+        for row in (rows.get(pid) for pid in page_ids)
+        if row is not None
+    ]
+    return results, len(ranked) > page * per_page
+
+
+def encode_cursor(values) -> str:
+    raw = json.dumps(list(values), separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(token: str, size: int) -> tuple:
+    raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+    values = json.loads(raw)
+    if not isinstance(values, list) or len(values) != size or not all(isinstance(v, int) for v in values):
+        raise ValueError("bad cursor")
+    return tuple(values)
+
+
+def parse_catalog_query(args) -> Dict[str, object]:
+    """Validate catalog filter/sort/cursor query args; raises ValueError on bad input."""
+    sort = args.get("sort") or "id"
+    if sort not in CATALOG_SORTS:
+        raise ValueError("bad sort")
+    query: Dict[str, object] = {
+        "category": (args.get("category") or "").strip() or None,
+        "badge": (args.get("badge") or "").strip() or None,
+        "min_price": None,
+        "max_price": None,
+        "sort": sort,
+        "cursor": None,
+        "limit": CATALOG_PAGE_SIZE,
+    }
+    for key in ("min_price", "max_price"):
+        if args.get(key):
+            query[key] = int(args[key])
+    if args.get("limit"):
+        query["limit"] = min(max(int(args["limit"]), 1), CATALOG_MAX_PAGE_SIZE)
+    if args.get("cursor"):
+        try:
+            query["cursor"] = decode_cursor(args["cursor"], len(CATALOG_SORTS[sort][1]))
+        except (TypeError, ValueError):
+            raise ValueError("bad cursor") from None
+    return query
+
+
+def catalog_query_key(query: Dict[str, object]) -> tuple:
+    return tuple(sorted(query.items()))
+
+
+def catalog_sql(lang: str, query: Dict[str, object]):
+    """SELECT (without LIMIT) and params for the product cards matching a catalog query."""
+    order_by, keys, op = CATALOG_SORTS[query["sort"]]
+    where, params = [], []
+    if query["category"]:
+        where.append("category_en = ?")
+        params.append(query["category"])
+    if query["badge"]:
+        where.append("badge_en = ?")
+        params.append(query["badge"])
+    if query["min_price"] is not None:
+        where.append("price_cents >= ?")
+        params.append(query["min_price"])
+    if query["max_price"] is not None:
+        where.append("price_cents <= ?")
+        params.append(query["max_price"])
+    if query["cursor"]:
+        where.append(f"({', '.join(keys)}) {op} ({', '.join('?' * len(keys))})")
+        params.extend(query["cursor"])
+    sql = f"""
+        SELECT id, sku, name_{lang}, description_{lang}, category_{lang}, badge_{lang}, price_cents, image
+        FROM products
+        {"WHERE " + " AND ".join(where) if where else ""}
+        ORDER BY {order_by}
+    """
+    return sql, params
+
+
+def query_catalog(lang: str, query: Dict[str, object]):
+    """One keyset page of product cards as plain tuples in CARD_FIELDS order."""
+    keys = CATALOG_SORTS[query["sort"]][1]
+    sql, params = catalog_sql(lang, query)
+    limit = query["limit"]
+    cur = get_db().cursor()
+    cur.row_factory = None
+    cur.execute(sql + " LIMIT ?", params + [limit + 1])
     rows = cur.fetchall()
-    conn.close()
-    return rows
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        next_cursor = encode_cursor(last[CARD_FIELDS.index(key)] for key in keys)
+    return rows, next_cursor
+
+
+def iter_catalog(lang: str, query: Dict[str, object]):
+    """Every matching product card, stepped lazily from a live cursor (no LIMIT, no fetchall)."""
+    sql, params = catalog_sql(lang, query)
+    cur = get_db().cursor()
+    cur.row_factory = None
+    try:
+        for row in cur.execute(sql, params):
+            yield ProductCard._make(row)
+    finally:
+        cur.close()
+
+
+def buffered_stream(pieces, chunk_bytes: int = STREAM_CHUNK_BYTES):
+    """Regroup template output into writes of about chunk_bytes; STREAM_FLUSH forces one early."""
+    buf, size = [], 0
+    try:
+        for piece in pieces:
+            *flushed, piece = piece.split(STREAM_FLUSH)
+            for part in flushed:
+                buf.append(part)
+                yield "".join(buf)
+                buf, size = [], 0
+            buf.append(piece)
+            size += len(piece)
+            if size >= chunk_bytes:
+                yield "".join(buf)
+                buf, size = [], 0
+        if buf:
+            yield "".join(buf)
+    finally:
+        if hasattr(pieces, "close"):
+            pieces.close()
+
+
+def get_version(conn: sqlite3.Connection, key: str) -> int:
+    row = conn.execute("SELECT value FROM app_meta WHERE key = ?", (key,)).fetchone()
+    return row["value"] if row else 0
+
+
+def bump_version(conn: sqlite3.Connection, key: str):
+    """Advance a shared version counter; callers commit it with their own write."""
+    conn.execute(
+        """
+        INSERT INTO app_meta (key, value) VALUES (?, 1)
+        ON CONFLICT(key) DO UPDATE SET value = value + 1
+        """,
+        (key,),
+    )
+
+
+class CatalogCache:
+    """Read-through, per-process cache of immutable product rows.
+
+    Rows are loaded by id on first use and kept until the catalog_version
+    counter in app_meta moves. The counter is polled at most every `ttl`
+    seconds, so every worker picks up a catalog change within that delay. At
+    most `max_items` rows are held; past that the cache starts over.
+    """
+
+    def __init__(self, ttl: float, max_items: int):
+        self.ttl = ttl
+        self.max_items = max_items
+        self._lock = threading.Lock()
+        self._version = -1
+        self._generation = 0
+        self._by_id: Dict[int, sqlite3.Row] = {}
+        self._checked_at = 0.0
+        self.hits = 0
+        self.misses = 0
+        self.version_checks = 0
+
+    def _sync(self) -> int:
+        now = time.monotonic()
+        if now - self._checked_at < self.ttl:
+            return self._generation
+        with self._lock:
+            if now - self._checked_at < self.ttl:
+                return self._generation
+            self.version_checks += 1
+            version = get_version(get_db(), "catalog_version")
+            if version != self._version:
+                self._version = version
+                self._reset()
+            self._checked_at = time.monotonic()
+            return self._generation
+
+    def _reset(self):
+        self._generation += 1
+        self._by_id = {}
+
+    def _remember(self, generation: int, rows):
+        with self._lock:
+            if generation != self._generation:
+                return
+            if len(self._by_id) + len(rows) > self.max_items:
+                self._by_id = {}
+            for row in rows:
+                self._by_id[row["id"]] = row
+
+    @property
+    def version(self) -> int:
+        self._sync()
+        return self._version
+
+    def get(self, pid: int):
+        return self.get_many([pid]).get(pid)
+
+    def get_many(self, pids: List[int]) -> Dict[int, sqlite3.Row]:
+        generation = self._sync()
+        by_id = self._by_id
+        found = {pid: by_id[pid] for pid in pids if pid in by_id}
+        missing = [pid for pid in pids if pid not in found]
+        self.hits += len(found)
+        if missing:
+            self.misses += len(missing)
+            placeholders = ",".join("?" * len(missing))
+            rows = get_db().execute(f"SELECT * FROM products WHERE id IN ({placeholders})", missing).fetchall()
+            self._remember(generation, rows)
+            found.update((row["id"], row) for row in rows)
+        return found
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "version": self._version,
+            "products": len(self._by_id),
+            "hits": self.hits,
+            "misses": self.misses,
+            "version_checks": self.version_checks,
+        }
+
+
+CATALOG_CACHE = CatalogCache(CATALOG_CACHE_TTL, CATALOG_CACHE_MAX_ITEMS)
+
+
+class FragmentCache:
+    """LRU of rendered HTML (or compressed bytes) keyed by tuples and capped by total size.
+
+    Keys must carry every version the fragment depends on (language, catalog
+    or comments version); stale entries are never looked up again and age
+    out through LRU eviction.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[tuple, tuple]" = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: tuple) -> Optional[str]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key: tuple, html: str):
+        nbytes = len(html) if isinstance(html, bytes) else len(html.encode("utf-8"))
+        if nbytes > self.max_bytes:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.size -= old[1]
+            self._entries[key] = (html, nbytes)
+            self.size += nbytes
+            while self.size > self.max_bytes:
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self.size -= evicted
+                self.evictions += 1
+
+    def get_or_render(self, key: tuple, render) -> str:
+        html = self.get(key)
+        if html is None:
+            html = render()
+            self.put(key, html)
+        return html
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self.size,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+FRAGMENT_CACHE = FragmentCache(FRAGMENT_CACHE_BYTES)
+COMPRESSED_CACHE = FragmentCache(COMPRESS_CACHE_BYTES)
+
+
+class ServerSession(CallbackDict, SessionMixin):
+    def __init__(self, initial=None, sid: Optional[str] = None, expires_at: float = 0.0):
+        def on_update(self):
+            self.modified = True
+
+        super().__init__(initial, on_update)
+        self.sid = sid
+        self.expires_at = expires_at
+        self.new = sid is None
+        self.modified = False
+
+
+class SQLiteSessionStore:
+    """Sessions table on a pool of its own, so saving a session never commits
+    writes a failed view left open on the request's connection."""
+
+    def __init__(self):
+        self.pool = ConnectionPool(DB_PATH, DB_POOL_SIZE, DB_POOL_TIMEOUT)
+
+    def _execute(self, sql: str, params: tuple) -> sqlite3.Cursor:
+        conn = self.pool.acquire()
+        try:
+            cur = conn.execute(sql, params)
+            if conn.in_transaction:
+                conn.commit()
+            return cur
+        finally:
+            self.pool.release(conn)
+
+    def load(self, sid: str):
+        conn = self.pool.acquire()
+        try:
+            row = conn.execute("SELECT data, expires_at FROM sessions WHERE id = ?", (sid,)).fetchone()
+        finally:
+            self.pool.release(conn)
+        if row is None or row["expires_at"] < time.time():
+            return None
+        return row["data"], row["expires_at"]
+
+    def save(self, sid: str, data: str, expires_at: float):
+        self._execute(
+            """
+            INSERT INTO sessions (id, data, expires_at) VALUES (?, ?, ?)
+            ON CONFLICT(id) DO UPDATE SET data = excluded.data, expires_at = excluded.expires_at
+            """,
+            (sid, data, expires_at),
+        )
+
+    def delete(self, sid: str):
+        self._execute("DELETE FROM sessions WHERE id = ?", (sid,))
+
+    def purge_expired(self, limit: int) -> int:
+        cur = self._execute(
+            "DELETE FROM sessions WHERE id IN (SELECT id FROM sessions WHERE expires_at < ? LIMIT ?)",
+            (time.time(), limit),
+        )
+        return cur.rowcount
+
+
+class MemorySessionStore:
+    """Process-local store; only for a single worker process or tests."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._data: Dict[str, tuple] = {}
+
+    def load(self, sid: str):
+        entry = self._data.get(sid)
+        if entry is None or entry[1] < time.time():
+            return None
+        return entry
+
+    def save(self, sid: str, data: str, expires_at: float):
+        with self._lock:
+            self._data[sid] = (data, expires_at)
+
+    def delete(self, sid: str):
+        with self._lock:
+            self._data.pop(sid, None)
+
+    def purge_expired(self, limit: int) -> int:
+        now = time.time()
+        with self._lock:
+            expired = [sid for sid, (_, expires_at) in self._data.items() if expires_at < now][:limit]
+            for sid in expired:
+                del self._data[sid]
+        return len(expired)
+
+
+class RedisSessionStore:
+    """Any Redis-protocol server; expiry is left to the server's own TTLs."""
+
+    def __init__(self, url: str):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("SHOP_SESSION_BACKEND=redis needs the 'redis' package") from None
+        self._redis = redis.Redis.from_url(url)
+
+    def load(self, sid: str):
+        pipe = self._redis.pipeline()
+        pipe.get(f"session:{sid}")
+        pipe.ttl(f"session:{sid}")
+        data, ttl = pipe.execute()
+        if data is None:
+            return None
+        return data.decode("utf-8"), time.time() + max(ttl, 0)
+
+    def save(self, sid: str, data: str, expires_at: float):
+        self._redis.setex(f"session:{sid}", max(int(expires_at - time.time()), 1), data)
+
+    def delete(self, sid: str):
+        self._redis.delete(f"session:{sid}")
+
+    def purge_expired(self, limit: int) -> int:
+        return 0
+
+
+class ServerSessionInterface(SessionInterface):
+    """Keeps session data in a server-side store; the cookie holds only an opaque id.
+
+    A session is written back only when it was modified, or when less than
+    half of its lifetime is left, and expired rows are purged in small
+    batches at most every SESSION_GC_INTERVAL seconds per process.
+    """
+
+    serializer = TaggedJSONSerializer()
+
+    def __init__(self, store, lifetime: int):
+        self.store = store
+        self.lifetime = lifetime
+        self._last_gc = time.monotonic()
+
+    def open_session(self, app, request):
+        sid = request.cookies.get(self.get_cookie_name(app))
+        if sid:
+            loaded = self.store.load(sid)
+            if loaded is not None:
+                data, expires_at = loaded
+                return ServerSession(self.serializer.loads(data), sid, expires_at)
+        return ServerSession()
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        if response.status_code >= 500:
+            # A failed view may still hold its write transaction; keep the stored session as it was.
+            return
+        if not session:
+            if session.sid and session.modified:
+                self.store.delete(session.sid)
+                response.delete_cookie(name, domain=domain, path=path)
+            return
+        now = time.time()
+        refresh = session.expires_at - now < self.lifetime / 2
+        if not (session.modified or refresh):
+            return
+        if session.sid is None:
+            session.sid = secrets.token_urlsafe(24)
+        session.expires_at = now + self.lifetime
+        self.store.save(session.sid, self.serializer.dumps(dict(session)), session.expires_at)
+        response.set_cookie(
+            name,
+            session.sid,
+            max_age=self.lifetime,
+            httponly=self.get_cookie_httponly(app),
+            secure=self.get_cookie_secure(app),
+            samesite=self.get_cookie_samesite(app),
+            domain=domain,
+            path=path,
+        )
+        self.maybe_purge()
+
+    def maybe_purge(self):
+        if time.monotonic() - self._last_gc < SESSION_GC_INTERVAL:
+            return
+        self._last_gc = time.monotonic()
+        try:
+            self.store.purge_expired(SESSION_GC_BATCH)
+        except Exception as exc:
+            print(f"SESSION ERROR: purge failed: {exc}", file=sys.stderr)
+
+
+def build_session_interface():
+    if SESSION_BACKEND == "cookie":
+        return None
+    if SESSION_BACKEND == "memory":
+        return ServerSessionInterface(MemorySessionStore(), SESSION_LIFETIME)
+    if SESSION_BACKEND == "redis":
+        return ServerSessionInterface(RedisSessionStore(SESSION_REDIS_URL), SESSION_LIFETIME)
+    return ServerSessionInterface(SQLiteSessionStore(), SESSION_LIFETIME)
+
+
+_session_interface = build_session_interface()
+if _session_interface is not None:
+    app.session_interface = _session_interface
+
+
+def ensure_db():
+    """Run init_db() at most once per process; for scripts and CLI commands only."""
+    global DB_INITIALIZED
+    if DB_INITIALIZED:
+        return
+    with DB_INIT_LOCK:
+        if DB_INITIALIZED:
+            return
+        try:
+            init_db()
+        except Exception as exc:
+            print(f"DB INIT ERROR: {exc}", file=sys.stderr)
+            raise
+        DB_INITIALIZED = True
+
+
+def get_lang():
+    lang = request.args.get("lang") or session.get("lang") or "ar"
+    if lang not in ("ar", "en"):
+        lang = "ar"
+    # The default is not stored: a cookieless visitor keeps an empty session.
+    if session.get("lang") != lang and (session or request.args.get("lang")):
+        session["lang"] = lang
+    return lang
+
+
+def arg_lang() -> str:
+    """Language for JSON endpoints: taken from the query string only, never stored."""
+    lang = request.args.get("lang") or "ar"
+    return lang if lang in ("ar", "en") else "ar"
+
+
+def get_session_id() -> str:
+    sid = session.get("sid")
+    if not sid:
+        sid = os.urandom(8).hex()
+        session["sid"] = sid
+    return sid
+
+
+def get_checkout_attempt() -> str:
+    """Nonce of the visitor's current checkout attempt; a new one starts after success or cancel.
+
+    Stripe keeps idempotency keys for 24 hours and sid lives for 30 days, so
+    without it buying the same cart again would replay the earlier session.
+    """
+    attempt = session.get("checkout_attempt")
+    if not attempt:
+        attempt = os.urandom(8).hex()
+        session["checkout_attempt"] = attempt
+    return attempt
+
+
+def end_checkout_attempt():
+    session.pop("checkout_attempt", None)
 
 
 def fetch_product(pid: int):
-    ensure_db()
-    conn = get_db()
-    cur = conn.cursor()
-    cur.execute("SELECT * FROM products WHERE id = ?", (pid,))
-    row = cur.fetchone()
-    conn.close()
-    return row
+    return CATALOG_CACHE.get(pid)
+
+
+def fetch_products_by_ids(pids: List[int]) -> Dict[int, sqlite3.Row]:
+    if not pids:
+        return {}
+    return CATALOG_CACHE.get_many(pids)
+
+
+def fetch_related(pid: int) -> bytes:
+    """The packed co-purchase top-K of a product: one primary-key read."""
+    row = get_db().execute("SELECT related FROM related_products WHERE product_id = ?", (pid,)).fetchone()
+    return row["related"] if row else b""
+
+
+def related_products(related: bytes, limit: int):
+    """(product row, paid orders together) for the first `limit` entries still in the catalog."""
+    entries = unpack_related(related)[:limit]
+    products = fetch_products_by_ids([other_id for other_id, _ in entries])
+    return [(products[other_id], orders) for other_id, orders in entries if other_id in products]
 
 
-def fetch_comments(pid: int):
+def read_image_source(source: str) -> bytes:
+    """Bytes of a product image: an http(s) URL, or a path under the static folder."""
+    if source.startswith(("http://", "https://")):
+        req = urllib.request.Request(source, headers={"User-Agent": "aurora-store-image-proxy"})
+        with urllib.request.urlopen(req, timeout=IMAGE_FETCH_TIMEOUT) as resp:
+            data = resp.read(IMAGE_MAX_SOURCE_BYTES + 1)
+    else:
+        path = safe_join(app.static_folder, source.removeprefix("/static/").lstrip("/"))
+        if path is None:
+            raise FileNotFoundError(source)
+        with open(path, "rb") as fh:
+            data = fh.read(IMAGE_MAX_SOURCE_BYTES + 1)
+    if len(data) > IMAGE_MAX_SOURCE_BYTES:
+        raise ValueError(f"source image larger than {IMAGE_MAX_SOURCE_BYTES} bytes")
+    return data
+
+
+def resize_image(path: str, width: int, fmt: str) -> bytes:
+    from io import BytesIO
+
+    from PIL import Image, ImageOps
+
+    with Image.open(path) as img:
+        # Let JPEG decode at a reduced scale when the target is much smaller.
+        img.draft("RGB", (width, max(1, width * img.height // img.width)))
+        img = ImageOps.exif_transpose(img)
+        if img.width > width:
+            img = img.resize((width, max(1, round(img.height * width / img.width))), Image.LANCZOS, reducing_gap=3.0)
+        has_alpha = img.mode in ("RGBA", "LA") or (img.mode == "P" and "transparency" in img.info)
+        img = img.convert("RGBA" if has_alpha and fmt != "jpeg" else "RGB")
+        out = BytesIO()
+        img.save(out, fmt.upper(), **IMAGE_FORMATS[fmt][1])
+    return out.getvalue()
+
+
+@lru_cache(maxsize=1)
+def pillow_encodes_avif() -> bool:
+    """AVIF needs Pillow 11.3+ built with libavif; older Pillows have no AVIF encoder at all."""
+    try:
+        from PIL import features
+    except ImportError:
+        return False
+    return "avif" in features.modules and features.check_module("avif")
+
+
+@lru_cache(maxsize=4096)
+def image_version(source: str) -> str:
+    return hashlib.sha256(source.encode("utf-8")).hexdigest()[:12]
+
+
+class ImageCache:
+    """Fetched originals and resized variants on disk, shared by all workers.
+
+    Files are evicted least-recently-used (by mtime, refreshed on hits at most
+    every IMAGE_TOUCH_INTERVAL seconds) once the directory grows past
+    max_bytes; eviction trims it to 90% of the budget.
+    """
+
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._key_locks: Dict[str, threading.Lock] = {}
+        self._bytes: Optional[int] = None
+        self.hits = 0
+        self.misses = 0
+        self.fetches = 0
+        self.evictions = 0
+
+    def _key_lock(self, key: str) -> threading.Lock:
+        with self._lock:
+            return self._key_locks.setdefault(key, threading.Lock())
+
+    def _cached(self, path: str) -> bool:
+        try:
+            mtime = os.stat(path).st_mtime
+        except OSError:
+            return False
+        if time.time() - mtime > IMAGE_TOUCH_INTERVAL:
+            try:
+                os.utime(path)
+            except OSError:
+                pass
+        return True
+
+    def original(self, source: str) -> str:
+        path = os.path.join(self.directory, "src", image_version(source))
+        if self._cached(path):
+            return path
+        with self._key_lock(path):
+            if not os.path.exists(path):
+                self.fetches += 1
+                self._write(path, read_image_source(source))
+        return path
+
+    def variant(self, source: str, width: int, fmt: str) -> str:
+        path = os.path.join(self.directory, "v", f"{image_version(source)}-{width}.{fmt}")
+        if self._cached(path):
+            self.hits += 1
+            return path
+        with self._key_lock(path):
+            if not os.path.exists(path):
+                self.misses += 1
+                try:
+                    data = resize_image(self.original(source), width, fmt)
+                except FileNotFoundError:
+                    # Another worker evicted the original between the two steps.
+                    data = resize_image(self.original(source), width, fmt)
+                self._write(path, data)
+        return path
+
+    def _write(self, path: str, data: bytes):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}-{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as fh:
+            fh.write(data)
+        os.replace(tmp, path)
+        with self._lock:
+            if self._bytes is not None:
+                self._bytes += len(data)
+            # The first write in a process scans the directory to learn its size.
+            over = self._bytes is None or self._bytes > self.max_bytes
+        if over:
+            self.evict(keep=path)
+
+    def evict(self, keep: Optional[str] = None):
+        files = []
+        for kind in ("src", "v"):
+            try:
+                entries = list(os.scandir(os.path.join(self.directory, kind)))
+            except OSError:
+                continue
+            for entry in entries:
+                if entry.name.endswith(".tmp") or entry.path == keep:
+                    continue
+                try:
+                    st = entry.stat()
+                except OSError:
+                    continue
+                files.append((st.st_mtime, st.st_size, entry.path))
+        total = sum(size for _, size, _ in files)
+        kept = os.path.getsize(keep) if keep and os.path.exists(keep) else 0
+        total += kept
+        if total > self.max_bytes:
+            target = self.max_bytes * 0.9
+            for _, size, path in sorted(files):
+                if total <= target:
+                    break
+                try:
+                    os.remove(path)
+                except OSError:
+                    continue
+                total -= size
+                self.evictions += 1
+        with self._lock:
+            self._bytes = total
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "bytes": self._bytes or 0,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "fetches": self.fetches,
+            "evictions": self.evictions,
+        }
+
+
+IMAGE_CACHE = ImageCache(IMAGE_CACHE_DIR, IMAGE_CACHE_BYTES)
+
+
+@app.template_global()
+def image_url(pid: int, source: str, width: int) -> str:
+    return url_for("product_image", pid=pid, width=width, v=image_version(source))
+
+
+@app.template_global()
+def image_srcset(pid: int, source: str, widths) -> str:
+    return ", ".join(f"{image_url(pid, source, width)} {width}w" for width in widths)
+
+
+def fetch_comments(pid: int, before: Optional[int] = None, limit: int = COMMENTS_PAGE_SIZE):
+    """Newest-first page of comments, plus the `before` id for the next page (or None)."""
     conn = get_db()
     cur = conn.cursor()
     cur.execute(
-        "SELECT id, product_id, session_id, author, content, created_at FROM comments WHERE product_id = ? ORDER BY id DESC",
-        (pid,),
+        """
+        SELECT id, product_id, session_id, author, content, created_at FROM comments
+        WHERE product_id = ? AND id < ?
+        ORDER BY id DESC
+        LIMIT ?
+        """,
+        (pid, before if before is not None else 2**63 - 1, limit + 1),
     )
     rows = cur.fetchall()
-    conn.close()
-    return rows
+    if len(rows) > limit:
+        return rows[:limit], rows[limit - 1]["id"]
+    return rows, None
+
+
+def fetch_comment_count(pid: int) -> int:
+    row = get_db().execute("SELECT count FROM comment_counts WHERE product_id = ?", (pid,)).fetchone()
+    return row["count"] if row else 0
+
+
+def adjust_comment_count(conn: sqlite3.Connection, pid: int, delta: int):
+    conn.execute(
+        """
+        INSERT INTO comment_counts (product_id, count) VALUES (?, MAX(?, 0))
+        ON CONFLICT(product_id) DO UPDATE SET count = MAX(count + ?, 0)
+        """,
+        (pid, delta, delta),
+    )
+
+
+def comments_version_key(pid: int) -> str:
+    return f"comments_version:{pid}"
+
+
+def stitch_comment_edits(html: str, pid: int, sid: Optional[str], lang: str, product) -> str:
+    """Fill the cached comment list's edit slots for comments owned by this session."""
+    ids = [int(cid) for cid in COMMENT_EDIT_SLOT.findall(html)]
+    if not ids or sid is None:
+        return COMMENT_EDIT_SLOT.sub("", html)
+    placeholders = ",".join("?" * len(ids))
+    owned = {
+        row["id"]: row
+        for row in get_db().execute(
+            f"SELECT id, content FROM comments WHERE id IN ({placeholders}) AND session_id = ?",
+            ids + [sid],
+        )
+    }
+
+    def fill(match):
+        c = owned.get(int(match.group(1)))
+        if c is None:
+            return ""
+        return render_template("partials/comment_edit.html", lang=lang, t=TEXT[lang], product=product, c=c)
+
+    return COMMENT_EDIT_SLOT.sub(fill, html)
 
 
 def get_cart() -> Dict[str, int]:
@@ -568,12 +2983,12 @@ def set_cart(cart: Dict[str, int]):
 
 
 def cart_items():
-    ensure_db()
     cart = get_cart()
     items = []
     total_cents = 0
+    products = fetch_products_by_ids([int(pid) for pid in cart])
     for pid, qty in cart.items():
-        product = fetch_product(int(pid))
+        product = products.get(int(pid))
         if not product:
             continue
         line_total = product["price_cents"] * qty
@@ -588,44 +3003,121 @@ def cart_items():
 
 @app.route("/")
 def index():
-    ensure_db()
     lang = get_lang()
-    products = fetch_products()
-    return render_template(
+    try:
+        query = parse_catalog_query(request.args)
+    except ValueError:
+        query = parse_catalog_query({})
+    cart_count = sum(get_cart().values())
+    if request.args.get("view") == "all":
+        return stream_index(lang, query, cart_count)
+    query_key = catalog_query_key(query)
+    catalog_version = CATALOG_CACHE.version
+    etag = page_etag("index", lang, catalog_version, query_key, cart_count)
+    cached = not_modified(etag)
+    if cached:
+        return cached
+
+    def render():
+        rows, next_cursor = query_catalog(lang, query)
+        filters = {k: v for k, v in query.items() if v is not None and k in ("category", "badge", "min_price", "max_price")}
+        if query["sort"] != "id":
+            filters["sort"] = query["sort"]
+        return render_template(
+            "index.html",
+            lang=lang,
+            t=TEXT[lang],
+            products=[ProductCard._make(row) for row in rows],
+            query=query,
+            categories=CATEGORIES,
+            next_url=url_for("index", lang=lang, cursor=next_cursor, **filters) if next_cursor else None,
+            view_all_url=url_for("index", lang=lang, view="all", **filters),
+            cart_count=CART_COUNT_SLOT,
+        )
+
+    html = FRAGMENT_CACHE.get_or_render(("index", lang, catalog_version, query_key), render)
+    return with_etag(html.replace(CART_COUNT_SLOT, str(cart_count), 1), etag)
+
+
+def stream_index(lang: str, query: Dict[str, object], cart_count: int):
+    """The whole filtered catalog as one page, streamed straight from the cursor.
+
+    The head and hero go out as soon as they render (STREAM_FLUSH before the
+    grid), then cards follow in STREAM_CHUNK_BYTES writes, so memory stays
+    flat however many products match. Nothing here is cached.
+    """
+    pieces = stream_template(
         "index.html",
         lang=lang,
         t=TEXT[lang],
-        products=products,
-        cart_count=sum(get_cart().values()),
+        products=iter_catalog(lang, query),
+        query=query,
+        categories=CATEGORIES,
+        next_url=None,
+        view_all_url=None,
+        cart_count=cart_count,
+        stream_flush=STREAM_FLUSH,
     )
+    return app.response_class(buffered_stream(pieces), mimetype="text/html")
 
 
 @app.route("/product/<int:pid>")
 def product(pid: int):
-    ensure_db()
     lang = get_lang()
-    sid = get_session_id()
+    # Read without minting: a plain view must not create a session row.
+    sid = session.get("sid")
     item = fetch_product(pid)
     if not item:
         abort(404)
-    comments = fetch_comments(pid)
-    return render_template(
+    cart_count = sum(get_cart().values())
+    comments_version = get_version(get_db(), comments_version_key(pid))
+    related = fetch_related(pid)
+    etag = page_etag("product", pid, lang, CATALOG_CACHE.version, comments_version, related.hex(), sid, cart_count)
+    cached = not_modified(etag)
+    if cached:
+        return cached
+    detail_html = FRAGMENT_CACHE.get_or_render(
+        ("product", pid, lang, CATALOG_CACHE.version),
+        lambda: render_template("partials/product_detail.html", lang=lang, t=TEXT[lang], product=item),
+    )
+    comments_html = FRAGMENT_CACHE.get_or_render(
+        ("comments", pid, lang, comments_version),
+        lambda: render_template(
+            "partials/comment_list.html", lang=lang, t=TEXT[lang], product=item, page=fetch_comments(pid)
+        ),
+    )
+    related_html = ""
+    if related:
+        related_html = FRAGMENT_CACHE.get_or_render(
+            ("related", pid, lang, CATALOG_CACHE.version, related),
+            lambda: render_template(
+                "partials/related_products.html", lang=lang, t=TEXT[lang], related=related_products(related, RELATED_ON_PAGE)
+            ),
+        )
+    html = render_template(
         "product.html",
         lang=lang,
         t=TEXT[lang],
         product=item,
-        comments=comments,
-        can_edit_sid=sid,
-        cart_count=sum(get_cart().values()),
+        detail_html=Markup(detail_html),
+        related_html=Markup(related_html),
+        comments_html=Markup(stitch_comment_edits(comments_html, pid, sid, lang, item)),
+        comment_count=fetch_comment_count(pid),
+        cart_count=cart_count,
     )
+    return with_etag(html, etag)
 
 
 @app.route("/cart")
 def cart():
-    ensure_db()
     lang = get_lang()
+    cart_state = sorted(get_cart().items())
+    etag = page_etag("cart", lang, CATALOG_CACHE.version, cart_state)
+    cached = not_modified(etag)
+    if cached:
+        return cached
     items, total_cents = cart_items()
-    return render_template(
+    html = render_template(
         "cart.html",
         lang=lang,
         t=TEXT[lang],
@@ -634,11 +3126,11 @@ def cart():
         currency=CURRENCY,
         cart_count=sum(get_cart().values()),
     )
+    return with_etag(html, etag)
 
 
 @app.route("/checkout")
 def checkout():
-    ensure_db()
     lang = get_lang()
     items, total_cents = cart_items()
     return render_template(
@@ -654,111 +3146,417 @@ def checkout():
     )
 
 
-@app.post("/api/cart/add")
-def api_cart_add():
-    ensure_db()
-    data = request.get_json(silent=True) or {}
-    pid = str(data.get("product_id"))
-    qty = int(data.get("qty", 1))
-    if not pid.isdigit():
-        return jsonify({"ok": False}), 400
+@app.post("/api/cart/add")
+def api_cart_add():
+    data = request.get_json(silent=True) or {}
+    pid = str(data.get("product_id"))
+    qty = int(data.get("qty", 1))
+    if not pid.isdigit():
+        return jsonify({"ok": False}), 400
+
+    cart = get_cart()
+    wanted = cart.get(pid, 0) + max(qty, 1)
+    row = get_db().execute("SELECT stock FROM products WHERE id = ?", (int(pid),)).fetchone()
+    if row is not None and row["stock"] is not None and wanted > row["stock"]:
+        # Only a hint for the shopper; the stock is actually held at checkout.
+        lang = session.get("lang", "ar")
+        return jsonify({"ok": False, "error": "out_of_stock", "available": row["stock"], "message": TEXT[lang]["sold_out"]}), 409
+    cart[pid] = wanted
+    set_cart(cart)
+    return jsonify({"ok": True, "count": sum(cart.values())})
+
+
+@app.post("/api/cart/remove")
+def api_cart_remove():
+    data = request.get_json(silent=True) or {}
+    pid = str(data.get("product_id"))
+    cart = get_cart()
+    if pid in cart:
+        cart.pop(pid)
+        set_cart(cart)
+    return jsonify({"ok": True, "count": sum(cart.values())})
+
+
+@app.post("/api/cart/clear")
+def api_cart_clear():
+    set_cart({})
+    return jsonify({"ok": True, "count": 0})
+
+
+_STRIPE_CLIENT = None
+_STRIPE_CLIENT_PID = None
+_STRIPE_CLIENT_LOCK = threading.Lock()
+_ASYNC_STRIPE_CLIENT = None
+_ASYNC_STRIPE_CLIENT_PID = None
+
+CheckoutRequest = namedtuple("CheckoutRequest", "lang email items total_cents params idempotency_key hold_created")
+
+
+def get_stripe_client():
+    """Process-wide Stripe client over one pooled, keep-alive HTTP session."""
+    global _STRIPE_CLIENT, _STRIPE_CLIENT_PID
+    with _STRIPE_CLIENT_LOCK:
+        if _STRIPE_CLIENT is None or _STRIPE_CLIENT_PID != os.getpid():
+            import requests
+            from requests.adapters import HTTPAdapter
+
+            http = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=STRIPE_POOL_SIZE)
+            http.mount("https://", adapter)
+            http.mount("http://", adapter)
+            options = {
+                "http_client": stripe.RequestsClient(
+                    timeout=(STRIPE_CONNECT_TIMEOUT, STRIPE_READ_TIMEOUT), session=http
+                ),
+                "max_network_retries": STRIPE_MAX_RETRIES,
+            }
+            if STRIPE_API_BASE:
+                options["base_addresses"] = {"api": STRIPE_API_BASE}
+            _STRIPE_CLIENT = stripe.StripeClient(STRIPE_SECRET_KEY, **options)
+            _STRIPE_CLIENT_PID = os.getpid()
+        return _STRIPE_CLIENT
+
+
+def get_async_stripe_client():
+    """Process-wide Stripe client over httpx, for the *_async methods used under asgi.py.
+
+    Only ever touched from the event loop, so it needs no lock; like the
+    sync client it is rebuilt after a fork.
+    """
+    global _ASYNC_STRIPE_CLIENT, _ASYNC_STRIPE_CLIENT_PID
+    if _ASYNC_STRIPE_CLIENT is None or _ASYNC_STRIPE_CLIENT_PID != os.getpid():
+        import httpx
+
+        options = {
+            "http_client": stripe.HTTPXClient(timeout=httpx.Timeout(STRIPE_READ_TIMEOUT, connect=STRIPE_CONNECT_TIMEOUT)),
+            "max_network_retries": STRIPE_MAX_RETRIES,
+        }
+        if STRIPE_API_BASE:
+            options["base_addresses"] = {"api": STRIPE_API_BASE}
+        _ASYNC_STRIPE_CLIENT = stripe.StripeClient(STRIPE_SECRET_KEY, **options)
+        _ASYNC_STRIPE_CLIENT_PID = os.getpid()
+    return _ASYNC_STRIPE_CLIENT
+
+
+def checkout_idempotency_key(sid: str, attempt: str, email: str, items: List[Dict]) -> str:
+    """Same visitor, attempt, email and cart -> same key, so a double submit reuses one Stripe session."""
+    lines = sorted((entry["product"]["id"], entry["qty"], entry["product"]["price_cents"]) for entry in items)
+    raw = json.dumps([sid, attempt, email, CURRENCY, lines], separators=(",", ":"))
+    return "checkout-" + hashlib.sha256(raw.encode("utf-8")).hexdigest()[:48]
+
+
+def stripe_checkout_params(email: str, items: List[Dict], lang: str) -> Dict:
+    line_items = [
+        {
+            "price_data": {
+                "currency": CURRENCY.lower(),
+                "product_data": {"name": entry["product"]["name_en"]},
+                "unit_amount": entry["product"]["price_cents"],
+            },
+            "quantity": entry["qty"],
+        }
+        for entry in items
+    ]
+    return {
+        "mode": "payment",
+        "line_items": line_items,
+        "customer_email": email,
+        "success_url": url_for("checkout_success", _external=True) + "?session_id={CHECKOUT_SESSION_ID}&lang=" + lang,
+        "cancel_url": url_for("checkout_cancel", _external=True) + "?lang=" + lang,
+    }
+
+
+def observe_stripe_call(started: float, outcome: str):
+    METRICS.observe(
+        "shop_stripe_request_seconds",
+        time.perf_counter() - started,
+        operation="checkout.sessions.create",
+        outcome=outcome,
+    )
+
+
+def create_stripe_checkout(checkout: CheckoutRequest):
+    client = get_stripe_client()
+    sessions = getattr(client, "v1", client).checkout.sessions
+    started = time.perf_counter()
+    outcome = "error"
+    try:
+        session_obj = sessions.create(params=checkout.params, options={"idempotency_key": checkout.idempotency_key})
+        outcome = "ok"
+        return session_obj
+    finally:
+        observe_stripe_call(started, outcome)
+
+
+async def create_stripe_checkout_async(checkout: CheckoutRequest):
+    """create_stripe_checkout() over httpx; the event loop stays free while Stripe answers."""
+    client = get_async_stripe_client()
+    sessions = getattr(client, "v1", client).checkout.sessions
+    started = time.perf_counter()
+    outcome = "error"
+    try:
+        session_obj = await sessions.create_async(
+            params=checkout.params, options={"idempotency_key": checkout.idempotency_key}
+        )
+        outcome = "ok"
+        return session_obj
+    finally:
+        observe_stripe_call(started, outcome)
+
+
+class OutOfStock(Exception):
+    def __init__(self, product_id: int):
+        super().__init__(f"product {product_id} is out of stock")
+        self.product_id = product_id
+
+
+def reserve_stock(conn: sqlite3.Connection, hold_key: str, items: List[Dict]) -> Tuple[Optional[float], bool]:
+    """Hold stock for every tracked cart line in one short write transaction.
+
+    Whether a line is tracked is read from products inside the transaction,
+    never from the catalog cache, which may predate its opening stock. Each
+    line is a conditional decrement, so concurrent checkouts can never take
+    a count below zero. If any line falls short nothing is held and
+    OutOfStock names the product.
+
+    Returns (expiry, created). expiry is None when no line is tracked. A
+    repeated hold_key (a double submit) gets the existing hold back with
+    created False instead of taking the stock twice.
+    """
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        row = conn.execute("SELECT expires_at FROM stock_holds WHERE hold_key = ? LIMIT 1", (hold_key,)).fetchone()
+        if row:
+            conn.commit()
+            return row["expires_at"], False
+        tracked = []
+        for entry in items:
+            pid, qty = entry["product"]["id"], entry["qty"]
+            held = conn.execute(
+                "UPDATE products SET stock = stock - ? WHERE id = ? AND stock >= ? RETURNING id", (qty, pid, qty)
+            ).fetchone()
+            if held:
+                tracked.append((pid, qty))
+                continue
+            product = conn.execute("SELECT stock FROM products WHERE id = ?", (pid,)).fetchone()
+            if product is None or product["stock"] is not None:
+                raise OutOfStock(pid)
+        if not tracked:
+            conn.commit()
+            return None, False
+        expires_at = time.time() + STOCK_HOLD_TTL
+        conn.executemany(
+            "INSERT INTO stock_holds (hold_key, product_id, quantity, expires_at) VALUES (?, ?, ?, ?)",
+            [(hold_key, pid, qty, expires_at) for pid, qty in tracked],
+        )
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return expires_at, True
+
+
+def release_holds(conn: sqlite3.Connection, where: str, params: tuple) -> int:
+    """Put the stock of the matching holds back and drop them; the caller holds a write transaction."""
+    rows = conn.execute(f"SELECT hold_key, product_id, quantity FROM stock_holds WHERE {where}", params).fetchall()
+    conn.executemany(
+        "UPDATE products SET stock = stock + ? WHERE id = ? AND stock IS NOT NULL",
+        [(row["quantity"], row["product_id"]) for row in rows],
+    )
+    conn.executemany(
+        "DELETE FROM stock_holds WHERE hold_key = ? AND product_id = ?",
+        [(row["hold_key"], row["product_id"]) for row in rows],
+    )
+    return len(rows)
+
+
+def release_hold(conn: sqlite3.Connection, hold_key: str) -> int:
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        released = release_holds(conn, "hold_key = ?", (hold_key,))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return released
+
+
+def settle_holds(conn: sqlite3.Connection, outcomes: List[tuple]):
+    """Apply (order status, stripe session id) outcomes to stock holds in the caller's transaction.
 
-    cart = get_cart()
-    cart[pid] = cart.get(pid, 0) + max(qty, 1)
-    set_cart(cart)
-    return jsonify({"ok": True, "count": sum(cart.values())})
+    paid makes the sale final, failed and expired put the stock back, and
+    None (completed, but waiting on a delayed payment method) keeps the hold
+    with no expiry until the final event arrives.
+    """
+    for status, session_id in outcomes:
+        if status == "paid":
+            conn.execute("DELETE FROM stock_holds WHERE stripe_session_id = ?", (session_id,))
+        elif status is None:
+            conn.execute("UPDATE stock_holds SET expires_at = NULL WHERE stripe_session_id = ?", (session_id,))
+        else:
+            release_holds(conn, "stripe_session_id = ?", (session_id,))
 
 
-@app.post("/api/cart/remove")
-def api_cart_remove():
-    ensure_db()
-    data = request.get_json(silent=True) or {}
-    pid = str(data.get("product_id"))
-    cart = get_cart()
-    if pid in cart:
-        cart.pop(pid)
-        set_cart(cart)
-    return jsonify({"ok": True, "count": sum(cart.values())})
+def roll_up_paid_orders(conn, session_ids: List[str]):
+    """Add the orders of these sessions that are not paid yet to sales_daily and co_purchases.
 
+    Call it before marking them paid, in the same transaction: an order is
+    counted exactly once, when its status first becomes paid.
+    """
+    if not session_ids:
+        return
+    where = "o.stripe_session_id IN (SELECT value FROM json_each(?)) AND o.status != 'paid'"
+    params = (json.dumps(session_ids),)
+    conn.execute(SALES_ROLLUP.format(where=where), params)
+    raised = conn.execute(
+        "INSERT INTO co_purchases (product_id, other_id, orders) "
+        + CO_PURCHASE_PAIRS.format(where=where)
+        + """
+        ON CONFLICT (product_id, other_id) DO UPDATE SET orders = orders + excluded.orders
+        RETURNING product_id, other_id, orders
+        """,
+        params,
+    ).fetchall()
+    merge_related(conn, raised)
 
-@app.post("/api/cart/clear")
-def api_cart_clear():
-    ensure_db()
-    set_cart({})
-    return jsonify({"ok": True, "count": 0})
 
+def merge_related(conn, raised):
+    """Fold raised (product_id, other_id, orders) counts into the stored top-K arrays.
 
-@app.post("/create-checkout-session")
-def create_checkout_session():
-    ensure_db()
-    try:
-        print("CHECKOUT: start", file=sys.stderr)
-        if not (STRIPE_SECRET_KEY and STRIPE_PUBLISHABLE_KEY):
-            # Simulated payment flow: send email confirmation and go to success page
-            lang = get_lang()
-            email = request.form.get("email")
-            if email:
-                send_payment_email_async(email)
-            print("CHECKOUT: simulated -> success", file=sys.stderr)
-            return redirect(url_for("checkout_success", lang=lang))
-        stripe.api_key = STRIPE_SECRET_KEY
-        lang = get_lang()
-        email = request.form.get("email")
-        items, total_cents = cart_items()
-
-        if not items:
-            return redirect(url_for("cart", lang=lang))
-
-        line_items = []
-        for entry in items:
-            product = entry["product"]
-            line_items.append(
-                {
-                    "price_data": {
-                        "currency": CURRENCY.lower(),
-                        "product_data": {
-                            "name": product["name_en"],
-                        },
-                        "unit_amount": product["price_cents"],
-                    },
-                    "quantity": entry["qty"],
-                }
-            )
+    Counts only ever grow, so a product's new top K is always among its old
+    top K and the pairs that just rose: nothing else has to be read.
+    """
+    candidates: Dict[int, Dict[int, int]] = {}
+    for product_id, other_id, orders in raised:
+        candidates.setdefault(product_id, {})[other_id] = orders
+    if not candidates:
+        return
+    stored = conn.execute(
+        "SELECT product_id, related FROM related_products WHERE product_id IN (SELECT value FROM json_each(?))",
+        (json.dumps(list(candidates)),),
+    )
+    current = {row["product_id"]: row["related"] for row in stored}
+    rows = []
+    for product_id, rising in candidates.items():
+        entries = dict(unpack_related(current.get(product_id, b"")))
+        entries.update(rising)
+        rows.append((product_id, pack_related(entries.items())))
+    conn.executemany(RELATED_UPSERT, rows)
 
-        session_obj = stripe.checkout.Session.create(
-            mode="payment",
-            line_items=line_items,
-            customer_email=email,
-            success_url=url_for("checkout_success", _external=True) + "?session_id={CHECKOUT_SESSION_ID}&lang=" + lang,
-            cancel_url=url_for("checkout_cancel", _external=True) + "?lang=" + lang,
-        )
 
-        conn = get_db()
-        cur = conn.cursor()
-        cur.execute(
+def record_order(
+    conn, email: str, items: List[Dict], total_cents: int, stripe_session_id: str, hold_key: Optional[str] = None
+) -> int:
+    """Write the order and its line items in one transaction; replays of the same session are no-ops.
+
+    The checkout's stock hold, if any, is tied to the Stripe session in the
+    same transaction so its webhook can settle it.
+    """
+    with conn:
+        if hold_key:
+            conn.execute("UPDATE stock_holds SET stripe_session_id = ? WHERE hold_key = ?", (stripe_session_id, hold_key))
+        cur = conn.execute(
             """
             INSERT INTO orders (email, total_cents, currency, status, stripe_session_id, created_at)
             VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT (stripe_session_id) DO NOTHING
             """,
-            (email, total_cents, CURRENCY, "pending", session_obj.id, datetime.utcnow().isoformat()),
+            (email, total_cents, CURRENCY, "pending", stripe_session_id, datetime.utcnow().isoformat()),
         )
+        if not cur.rowcount:
+            return conn.execute("SELECT id FROM orders WHERE stripe_session_id = ?", (stripe_session_id,)).fetchone()["id"]
         order_id = cur.lastrowid
-        for entry in items:
-            cur.execute(
-                """
-                INSERT INTO order_items (order_id, product_id, quantity, price_cents)
-                VALUES (?, ?, ?, ?)
-                """,
-                (order_id, entry["product"]["id"], entry["qty"], entry["product"]["price_cents"]),
-            )
-        conn.commit()
-        conn.close()
+        conn.executemany(
+            """
+            INSERT INTO order_items (order_id, product_id, quantity, price_cents)
+            VALUES (?, ?, ?, ?)
+            """,
+            [(order_id, entry["product"]["id"], entry["qty"], entry["product"]["price_cents"]) for entry in items],
+        )
+    return order_id
+
+
+def begin_checkout():
+    """Everything before the Stripe call: a CheckoutRequest, or the response to send instead."""
+    lang = get_lang()
+    email = request.form.get("email")
+    if not (STRIPE_SECRET_KEY and STRIPE_PUBLISHABLE_KEY):
+        # Simulated payment flow: send email confirmation and go to success page
+        if email:
+            queue_payment_email(email)
+        print("CHECKOUT: simulated -> success", file=sys.stderr)
+        return redirect(url_for("checkout_success", lang=lang))
+
+    items, total_cents = cart_items()
+    if not items:
+        return redirect(url_for("cart", lang=lang))
+
+    key = checkout_idempotency_key(get_session_id(), get_checkout_attempt(), email or "", items)
+    try:
+        hold_expires, hold_created = reserve_stock(get_db(), key, items)
+    except OutOfStock as exc:
+        name = next(entry["product"][f"name_{lang}"] for entry in items if entry["product"]["id"] == exc.product_id)
+        flash(f"نفدت كمية {name}، يرجى تعديل السلة." if lang == "ar" else f"{name} just sold out. Please update your cart.", "error")
+        return redirect(url_for("checkout", lang=lang))
+    except sqlite3.Error as exc:
+        print(f"CHECKOUT ERROR: stock hold failed: {exc}", file=sys.stderr)
+        flash("حدث خطأ أثناء حفظ الطلب، حاول مرة أخرى." if lang == "ar" else "We couldn't save your order. Please try again.", "error")
+        return redirect(url_for("checkout", lang=lang))
+    params = stripe_checkout_params(email, items, lang)
+    if hold_expires:
+        # Stripe will not take a payment after the hold lapses.
+        params["expires_at"] = int(hold_expires)
+    return CheckoutRequest(lang, email, items, total_cents, params, key, hold_created)
+
+
+# Failures after which a session for the idempotency key may exist or still be created.
+UNSETTLED_STRIPE_ERRORS = (stripe.APIConnectionError, stripe.APIError, stripe.RateLimitError, stripe.IdempotencyError)
+
+
+def checkout_failed(checkout: CheckoutRequest, exc: stripe.StripeError):
+    print(f"CHECKOUT ERROR: stripe {type(exc).__name__}: {exc.user_message or exc}", file=sys.stderr)
+    if isinstance(exc, stripe.IdempotencyError):
+        # The key is in use by a concurrent submit, or stale; the next submit starts afresh.
+        end_checkout_attempt()
+    if checkout.hold_created and not isinstance(exc, UNSETTLED_STRIPE_ERRORS):
+        # Stripe refused these exact params, so neither this request nor a double
+        # submit sharing the hold has a session that could still be paid. Otherwise
+        # one may exist or still be created, and the hold waits for the sweeper.
+        try:
+            release_hold(get_db(), checkout.idempotency_key)
+        except sqlite3.Error as db_exc:
+            print(f"CHECKOUT ERROR: stock release failed: {db_exc}", file=sys.stderr)
+    lang = checkout.lang
+    flash("تعذر بدء الدفع، حاول مرة أخرى." if lang == "ar" else "We couldn't start the payment. Please try again.", "error")
+    return redirect(url_for("checkout", lang=lang))
+
+
+def finish_checkout(checkout: CheckoutRequest, session_obj):
+    """Record the order for a created Stripe session and send the shopper there."""
+    try:
+        record_order(
+            get_db(), checkout.email, checkout.items, checkout.total_cents, session_obj.id, checkout.idempotency_key
+        )
+    except sqlite3.Error as exc:
+        print(f"CHECKOUT ERROR: order write failed: {exc}", file=sys.stderr)
+        lang = checkout.lang
+        flash("حدث خطأ أثناء حفظ الطلب، حاول مرة أخرى." if lang == "ar" else "We couldn't save your order. Please try again.", "error")
+        return redirect(url_for("checkout", lang=lang))
+
+    print("CHECKOUT: stripe -> redirect", file=sys.stderr)
+    return redirect(session_obj.url)
+
 
-        print("CHECKOUT: stripe -> redirect", file=sys.stderr)
-        return redirect(session_obj.url)
-    except Exception as exc:
-        print(f"CHECKOUT ERROR: {exc}", file=sys.stderr)
-        return redirect(url_for("checkout_success", lang=get_lang()))
+@app.post("/create-checkout-session")
+def create_checkout_session():
+    checkout = begin_checkout()
+    if not isinstance(checkout, CheckoutRequest):
+        return checkout
+    try:
+        session_obj = create_stripe_checkout(checkout)
+    except stripe.StripeError as exc:
+        return checkout_failed(checkout, exc)
+    return finish_checkout(checkout, session_obj)
 
 
 @app.post("/product/<int:pid>/comments")
@@ -780,11 +3578,51 @@ def add_comment(pid: int):
         """,
         (pid, sid, author[:60], content[:800], datetime.utcnow().isoformat()),
     )
+    adjust_comment_count(conn, pid, 1)
+    bump_version(conn, comments_version_key(pid))
     conn.commit()
-    conn.close()
     return redirect(url_for("product", pid=pid, lang=lang))
 
 
+@app.get("/api/product/<int:pid>/comments")
+def api_product_comments(pid: int):
+    before = request.args.get("before", type=int)
+    limit = min(max(request.args.get("limit", COMMENTS_PAGE_SIZE, type=int) or COMMENTS_PAGE_SIZE, 1), 100)
+    sid = session.get("sid")
+    rows, next_before = fetch_comments(pid, before, limit)
+    comments = [
+        {
+            "id": row["id"],
+            "author": row["author"],
+            "content": row["content"],
+            "created_at": row["created_at"],
+            "can_edit": bool(sid) and row["session_id"] == sid,
+        }
+        for row in rows
+    ]
+    return jsonify({"ok": True, "comments": comments, "next_before": next_before})
+
+
+@app.get("/api/product/<int:pid>/related")
+def api_product_related(pid: int):
+    lang = arg_lang()
+    if not fetch_product(pid):
+        return jsonify({"ok": False}), 404
+    limit = min(max(request.args.get("limit", RELATED_TOP_K, type=int) or RELATED_TOP_K, 1), RELATED_TOP_K)
+    related = [
+        {
+            "id": row["id"],
+            "sku": row["sku"],
+            "name": row[f"name_{lang}"],
+            "price_cents": row["price_cents"],
+            "image": row["image"],
+            "orders": orders,
+        }
+        for row, orders in related_products(fetch_related(pid), limit)
+    ]
+    return jsonify({"ok": True, "related": related})
+
+
 @app.post("/comment/<int:cid>/edit")
 def edit_comment(cid: int):
     lang = get_lang()
@@ -796,12 +3634,14 @@ def edit_comment(cid: int):
 
     conn = get_db()
     cur = conn.cursor()
+    owner = cur.execute("SELECT product_id FROM comments WHERE id = ? AND session_id = ?", (cid, sid)).fetchone()
     cur.execute(
         "UPDATE comments SET content = ? WHERE id = ? AND session_id = ?",
         (content[:800], cid, sid),
     )
+    if owner:
+        bump_version(conn, comments_version_key(owner["product_id"]))
     conn.commit()
-    conn.close()
     return redirect(url_for("product", pid=pid, lang=lang))
 
 
@@ -812,30 +3652,32 @@ def delete_comment(cid: int):
     pid = int(request.form.get("product_id") or 0)
     conn = get_db()
     cur = conn.cursor()
+    owner = cur.execute("SELECT product_id FROM comments WHERE id = ? AND session_id = ?", (cid, sid)).fetchone()
     cur.execute("DELETE FROM comments WHERE id = ? AND session_id = ?", (cid, sid))
+    if owner:
+        adjust_comment_count(conn, owner["product_id"], -1)
+        bump_version(conn, comments_version_key(owner["product_id"]))
     conn.commit()
-    conn.close()
     return redirect(url_for("product", pid=pid, lang=lang))
 
 
 @app.route("/success")
 def checkout_success():
-    ensure_db()
     lang = get_lang()
     set_cart({})
+    end_checkout_attempt()
     return render_template("success.html", lang=lang, t=TEXT[lang])
 
 
 @app.route("/cancel")
 def checkout_cancel():
-    ensure_db()
     lang = get_lang()
+    end_checkout_attempt()
     return render_template("cancel.html", lang=lang, t=TEXT[lang])
 
 
 @app.post("/webhook")
 def stripe_webhook():
-    ensure_db()
     if not STRIPE_WEBHOOK_SECRET:
         return "", 400
 
@@ -847,21 +3689,915 @@ def stripe_webhook():
     except Exception:
         return "", 400
 
-    if event["type"] == "checkout.session.completed":
-        session_obj = event["data"]["object"]
-        conn = get_db()
-        cur = conn.cursor()
-        cur.execute(
-            "UPDATE orders SET status = ? WHERE stripe_session_id = ?",
-            ("paid", session_obj["id"]),
+    # Acknowledge as soon as the event is logged; WEBHOOK_CONSUMER applies it.
+    if append_webhook_event(get_db(), event["id"], event["type"], payload.decode("utf-8")):
+        WEBHOOK_CONSUMER.wake()
+    return "", 200
+
+
+@app.get("/api/search")
+def api_search():
+    q = (request.args.get("q") or "").strip()[:100]
+    lang = arg_lang()
+    page = max(request.args.get("page", 1, type=int) or 1, 1)
+    per_page = min(max(request.args.get("per_page", SEARCH_PAGE_SIZE, type=int) or SEARCH_PAGE_SIZE, 1), SEARCH_MAX_PAGE_SIZE)
+    results, has_more = search_products(q, lang, page, per_page)
+    return jsonify({"ok": True, "q": q, "page": page, "results": results, "has_more": has_more})
+
+
+@app.get("/api/products")
+def api_products():
+    lang = arg_lang()
+    try:
+        query = parse_catalog_query(request.args)
+    except ValueError:
+        return jsonify({"ok": False}), 400
+    rows, next_cursor = query_catalog(lang, query)
+    return jsonify({"ok": True, "columns": CARD_FIELDS, "rows": rows, "next_cursor": next_cursor})
+
+
+@app.before_request
+def start_background_workers():
+    EMAIL_SENDER.start()
+    WEBHOOK_CONSUMER.start()
+    STOCK_SWEEPER.start()
+    METRICS.start()
+
+
+def minify_css(text: str) -> str:
+    text = re.sub(r"/\*.*?\*/", "", text, flags=re.S)
+    text = re.sub(r"\s+", " ", text)
+    text = re.sub(r"\s*([{};,>])\s*", r"\1", text)
+    text = re.sub(r":\s+", ":", text)
+    return text.replace(";}", "}").strip()
+
+
+JS_PUNCTUATORS = sorted(
+    """>>>= ... === !== **= <<= >>= >>> &&= ||= ??= => == != <= >= && || ?? ?. ++ -- += -= *= /= %= &= |= ^= << >> **""".split(),
+    key=len,
+    reverse=True,
+)
+JS_REGEX_AFTER = {"return", "typeof", "instanceof", "in", "of", "new", "delete", "void", "throw", "case", "do", "else", "yield", "await"}
+JS_IDENTIFIER = re.compile(r"(?:[\w$\u0080-\uffff]|\\u[0-9a-fA-F]{4}|\\u\{[0-9a-fA-F]+\})+")
+JS_NUMBER = re.compile(r"\d[\w.]*")
+JS_LINE_BREAKS = "\n\r\u2028\u2029"
+
+
+def _js_word(ch: str) -> bool:
+    return ch.isalnum() or ch in "_$\\" or ord(ch) > 127
+
+
+def _js_string_end(text: str, pos: int) -> int:
+    quote, i = text[pos], pos + 1
+    while i < len(text):
+        if text[i] == "\\":
+            i += 2
+        elif text[i] == quote:
+            return i + 1
+        elif text[i] in "\r\n":
+            break
+        else:
+            i += 1
+    raise ValueError(f"unterminated string at offset {pos}")
+
+
+def _js_template_end(text: str, pos: int) -> int:
+    i = pos + 1
+    while i < len(text):
+        if text[i] == "\\":
+            i += 2
+        elif text[i] == "`":
+            return i + 1
+        elif text.startswith("${", i):
+            _, i = js_tokens(text, i + 2, in_template=True)
+            i += 1
+        else:
+            i += 1
+    raise ValueError(f"unterminated template literal at offset {pos}")
+
+
+def _js_regex_end(text: str, pos: int) -> int:
+    i, in_class = pos + 1, False
+    while i < len(text) and text[i] not in JS_LINE_BREAKS:
+        ch = text[i]
+        if ch == "\\":
+            i += 2
+            continue
+        if ch == "[":
+            in_class = True
+        elif ch == "]":
+            in_class = False
+        elif ch == "/" and not in_class:
+            i += 1
+            while i < len(text) and _js_word(text[i]):
+                i += 1
+            return i
+        i += 1
+    raise ValueError(f"unterminated regular expression at offset {pos}")
+
+
+def _js_regex_allowed(tokens: List[tuple]) -> bool:
+    if not tokens:
+        return True
+    prev = tokens[-1][0]
+    if prev in (")", "]", "}"):
+        return False
+    if _js_word(prev[0]):
+        return prev in JS_REGEX_AFTER
+    # A string, template or regex literal ends an expression; any other punctuator starts one.
+    return prev[0] not in "'\"`" and not (prev[0] == "/" and len(prev) > 1 and prev not in JS_PUNCTUATORS)
+
+
+def js_tokens(text: str, pos: int = 0, in_template: bool = False):
+    """Split JS into (token, newline_before) pairs, dropping whitespace and comments.
+
+    Strings, template literals (kept verbatim, ${} included) and regex
+    literals are single tokens. With in_template it stops at the "}" closing
+    a ${...} and returns that offset along with the tokens.
+    """
+    tokens: List[tuple] = []
+    depth, newline = 0, False
+    while pos < len(text):
+        ch = text[pos]
+        if ch.isspace() or ch == "\ufeff":
+            newline = newline or ch in JS_LINE_BREAKS
+            pos += 1
+            continue
+        if text.startswith("//", pos):
+            end = text.find("\n", pos)
+            pos = len(text) if end < 0 else end
+            continue
+        if text.startswith("/*", pos):
+            end = text.find("*/", pos + 2)
+            if end < 0:
+                raise ValueError(f"unterminated comment at offset {pos}")
+            newline = newline or any(c in JS_LINE_BREAKS for c in text[pos:end])
+            pos = end + 2
+            continue
+        if ch in "'\"":
+            end = _js_string_end(text, pos)
+        elif ch == "`":
+            end = _js_template_end(text, pos)
+        elif ch == "/" and _js_regex_allowed(tokens):
+            end = _js_regex_end(text, pos)
+        elif ch.isdigit():
+            end = JS_NUMBER.match(text, pos).end()
+        elif _js_word(ch):
+            end = JS_IDENTIFIER.match(text, pos).end()
+        else:
+            end = pos + next((len(p) for p in JS_PUNCTUATORS if text.startswith(p, pos)), 1)
+            if in_template and ch == "{":
+                depth += 1
+            elif in_template and ch == "}":
+                if depth == 0:
+                    return tokens, pos
+                depth -= 1
+        tokens.append((text[pos:end], newline))
+        newline = False
+        pos = end
+    if in_template:
+        raise ValueError("unterminated template literal")
+    return tokens, pos
+
+
+def _js_needs_space(prev: str, tok: str) -> bool:
+    """Whether writing prev and tok back to back would lex differently."""
+    if _js_word(prev[-1]) and (_js_word(tok[0]) or tok[0] == "`"):
+        return True
+    if prev[-1] in "+-" and tok[0] == prev[-1]:
+        return True
+    if prev[-1] == "/" and tok[0] in "/*":
+        return True
+    return prev.isdigit() and tok[0] == "."
+
+
+def minify_js(text: str) -> str:
+    """Drops whitespace and comments outside literals.
+
+    A line break is kept wherever the source had one between two tokens,
+    unless it sits after { ( [ , ; or before } ) , ; where automatic
+    semicolon insertion cannot apply, so the parse is unchanged.
+    """
+    out: List[str] = []
+    prev = None
+    for tok, newline in js_tokens(text)[0]:
+        if prev is not None:
+            if newline and prev not in ("{", "(", "[", ",", ";") and tok not in ("}", ")", ",", ";"):
+                out.append("\n")
+            elif _js_needs_space(prev, tok):
+                out.append(" ")
+        out.append(tok)
+        prev = tok
+    return "".join(out) + "\n"
+
+
+def check_minified_js(source: str, minified: str) -> Optional[str]:
+    """Return why minified is not equivalent to source, or None.
+
+    The token streams must match, with a line break wherever the source
+    has one that can end a statement; node --check then parses the output
+    when node is on PATH.
+    """
+    before = js_tokens(source)[0]
+    try:
+        after = js_tokens(minified)[0]
+    except ValueError as exc:
+        return str(exc)
+    if [t for t, _ in before] != [t for t, _ in after]:
+        for i, (a, b) in enumerate(zip(before, after)):
+            if a[0] != b[0]:
+                return f"token {i} changed: {a[0]!r} -> {b[0]!r}"
+        return f"token count changed: {len(before)} -> {len(after)}"
+    for i in range(1, len(before)):
+        prev, (tok, newline) = before[i - 1][0], before[i]
+        if newline and not after[i][1] and prev not in ("{", "(", "[", ",", ";") and tok not in ("}", ")", ",", ";"):
+            return f"line break before token {i} ({tok!r}) dropped"
+    node = shutil.which("node")
+    if node is None:
+        return None
+    with tempfile.NamedTemporaryFile("w", suffix=".js", encoding="utf-8", delete=False) as fh:
+        fh.write(minified)
+    try:
+        result = subprocess.run([node, "--check", fh.name], capture_output=True, text=True)
+    finally:
+        os.unlink(fh.name)
+    if result.returncode:
+        return result.stderr.strip() or "node --check failed"
+    return None
+
+
+def build_assets(out_dir: str = ASSET_DIR) -> Dict[str, str]:
+    """Minify static CSS/JS into content-hashed files with .gz/.br siblings.
+
+    Writes manifest.json (source path -> hashed path) last, so a server that
+    reads it never sees a half-built set. Older hashed files are left in
+    place for pages that still reference them.
+    """
+    if brotli is None:
+        print("ASSETS: brotli is not installed; skipping .br files", file=sys.stderr)
+    manifest = {}
+    for root, _, files in os.walk(app.static_folder):
+        for name in sorted(files):
+            if not name.endswith(ASSET_EXTENSIONS):
+                continue
+            source = os.path.join(root, name)
+            rel = os.path.relpath(source, app.static_folder).replace(os.sep, "/")
+            with open(source, encoding="utf-8-sig") as fh:
+                text = fh.read()
+            if name.endswith(".css"):
+                data = minify_css(text).encode("utf-8")
+            else:
+                try:
+                    data = minify_js(text).encode("utf-8")
+                except ValueError as exc:
+                    print(f"ASSETS: {rel}: {exc}; shipping it unminified", file=sys.stderr)
+                    data = text.encode("utf-8")
+            stem, ext = os.path.splitext(rel)
+            hashed = f"{stem}.{hashlib.sha256(data).hexdigest()[:12]}{ext}"
+            target = os.path.join(out_dir, hashed)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            variants = {"": data, ".gz": gzip.compress(data, compresslevel=9, mtime=0)}
+            if brotli is not None:
+                variants[".br"] = brotli.compress(data, quality=11)
+            for suffix, payload in variants.items():
+                # Per-process temp names: every uvicorn worker builds at startup.
+                tmp = f"{target}{suffix}.{os.getpid()}.tmp"
+                with open(tmp, "wb") as fh:
+                    fh.write(payload)
+                os.replace(tmp, target + suffix)
+            manifest[rel] = hashed
+    os.makedirs(out_dir, exist_ok=True)
+    tmp = os.path.join(out_dir, f"manifest.json.{os.getpid()}.tmp")
+    with open(tmp, "w", encoding="utf-8") as fh:
+        json.dump(manifest, fh, indent=2, sort_keys=True)
+    os.replace(tmp, os.path.join(out_dir, "manifest.json"))
+    _ASSET_MANIFEST.clear()
+    return manifest
+
+
+_ASSET_MANIFEST: Dict[str, Dict[str, str]] = {}
+
+
+def asset_manifest() -> Dict[str, str]:
+    if "files" not in _ASSET_MANIFEST:
+        try:
+            with open(os.path.join(ASSET_DIR, "manifest.json"), encoding="utf-8") as fh:
+                _ASSET_MANIFEST["files"] = json.load(fh)
+        except (OSError, ValueError):
+            _ASSET_MANIFEST["files"] = {}
+    return _ASSET_MANIFEST["files"]
+
+
+@app.template_global()
+def asset_url(filename: str, **values) -> str:
+    """url_for("static", filename=...) that points at the built, hashed file when there is one."""
+    hashed = asset_manifest().get(filename)
+    if hashed is None:
+        return url_for("static", filename=filename, **values)
+    return url_for("asset", filename=hashed, **values)
+
+
+@app.get("/assets/<path:filename>")
+def asset(filename: str):
+    path = safe_join(ASSET_DIR, filename)
+    if path is None or not filename.endswith(ASSET_EXTENSIONS) or not os.path.isfile(path):
+        abort(404)
+    encoding = None
+    for candidate, suffix in (("br", ".br"), ("gzip", ".gz")):
+        if request.accept_encodings[candidate] and os.path.isfile(path + suffix):
+            encoding, path = candidate, path + suffix
+            break
+    resp = send_file(path, mimetype=mimetypes.guess_type(filename)[0], conditional=True, max_age=ASSET_MAX_AGE)
+    if encoding:
+        resp.headers["Content-Encoding"] = encoding
+    resp.vary.add("Accept-Encoding")
+    resp.headers["Cache-Control"] = f"public, max-age={ASSET_MAX_AGE}, immutable"
+    return resp
+
+
+@app.cli.command("build-assets")
+@click.option("--check", is_flag=True, help="Verify each minified JS file against its source (uses node when present).")
+def build_assets_command(check: bool):
+    """Minify, fingerprint and precompress static CSS/JS into the asset directory."""
+    manifest = build_assets()
+    failed = False
+    for source, hashed in sorted(manifest.items()):
+        print(f"{source} -> {hashed}")
+        if check and source.endswith(".js"):
+            with open(os.path.join(app.static_folder, source), encoding="utf-8-sig") as fh:
+                text = fh.read()
+            with open(os.path.join(ASSET_DIR, hashed), encoding="utf-8") as fh:
+                problem = check_minified_js(text, fh.read())
+            if problem:
+                print(f"ASSETS: {source}: {problem}", file=sys.stderr)
+                failed = True
+    if check and shutil.which("node") is None:
+        print("ASSETS: node is not on PATH; checked token streams only", file=sys.stderr)
+    if failed:
+        sys.exit(1)
+
+
+@app.cli.command("init-db")
+def init_db_command():
+    """Apply pending schema migrations and the product seed."""
+    applied, seeded = init_db()
+    print(f"migrations applied: {applied or 'none'}; product seed {'applied' if seeded else 'unchanged'}")
+
+
+@app.cli.command("send-outbox")
+def send_outbox_command():
+    """Drain due messages from the email outbox once and exit."""
+    ensure_db()
+    total = 0
+    while True:
+        sent = EMAIL_SENDER.drain_once()
+        if not sent:
+            break
+        total += sent
+    EMAIL_SENDER.close()
+    print(f"processed {total} outbox messages")
+
+
+@app.cli.command("process-webhooks")
+def process_webhooks_command():
+    """Apply pending events from the webhook log once and exit."""
+    ensure_db()
+    total = 0
+    while True:
+        applied = WEBHOOK_CONSUMER.drain_once()
+        if not applied:
+            break
+        total += applied
+    print(f"processed {total} webhook events")
+
+
+@app.cli.command("sweep-stock")
+def sweep_stock_command():
+    """Release lapsed checkout holds once and exit."""
+    ensure_db()
+    total = 0
+    while True:
+        released = STOCK_SWEEPER.drain_once()
+        if not released:
+            break
+        total += released
+    print(f"released {total} stock holds")
+
+
+@app.cli.command("rebuild-sales")
+def rebuild_sales_command():
+    """Recompute the sales_daily rollup from every paid order."""
+    ensure_db()
+    conn = get_db()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        rebuild_sales_daily(conn)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    print(f"sales_daily rebuilt: {conn.execute('SELECT COUNT(*) FROM sales_daily').fetchone()[0]} rows")
+
+
+@app.cli.command("build-related")
+def build_related_command():
+    """Rebuild the co-purchase counts and every product's related top-K from all paid orders."""
+    ensure_db()
+    conn = get_db()
+    started = time.perf_counter()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        rebuild_related(conn.cursor())
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    pairs = conn.execute("SELECT COUNT(*) FROM co_purchases").fetchone()[0]
+    products = conn.execute("SELECT COUNT(*) FROM related_products").fetchone()[0]
+    print(f"{pairs} co-purchase pairs, {products} products with related items in {time.perf_counter() - started:.1f}s")
+
+
+CATALOG_IMPORT_CHUNK = int(os.environ.get("SHOP_CATALOG_IMPORT_CHUNK", "5000"))
+CATALOG_COLUMNS = SEED_COLUMNS + ("stock",)
+CATALOG_REQUIRED = ("sku", "name_en", "name_ar", "price_cents", "image")
+
+
+def catalog_format(path: str, fmt: Optional[str]) -> str:
+    if fmt:
+        return fmt
+    return "jsonl" if path.lower().endswith((".jsonl", ".ndjson")) else "csv"
+
+
+def read_catalog_records(stream, fmt: str):
+    """Yield (line number, record) pairs one at a time; a JSONL line that fails to parse yields its error."""
+    if fmt == "csv":
+        reader = csv.DictReader(stream)
+        for record in reader:
+            yield reader.line_num, record
+        return
+    for number, line in enumerate(stream, 1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError as exc:
+            record = exc
+        yield number, record
+
+
+def catalog_row(record):
+    """An import record as (SEED_COLUMNS values, opening stock); raises ValueError if it is unusable."""
+    if isinstance(record, Exception):
+        raise ValueError(f"invalid JSON: {record}")
+    if not isinstance(record, dict):
+        raise ValueError("expected an object")
+    values = {}
+    for col in SEED_COLUMNS:
+        value = record.get(col)
+        values[col] = None if value is None else str(value).strip() or None
+    missing = [col for col in CATALOG_REQUIRED if not values[col]]
+    if missing:
+        raise ValueError(f"missing {', '.join(missing)}")
+    stock = record.get("stock")
+    try:
+        values["price_cents"] = int(values["price_cents"])
+        stock = None if stock is None or stock == "" else int(stock)
+    except ValueError:
+        raise ValueError("price_cents and stock must be whole numbers") from None
+    if values["price_cents"] < 0 or (stock is not None and stock < 0):
+        raise ValueError("price_cents and stock must not be negative")
+    return tuple(values[col] for col in SEED_COLUMNS), stock
+
+
+def diff_catalog_chunk(conn: sqlite3.Connection, rows, stocks):
+    """Yield ("+", sku, None) for new products and ("~", sku, {column: (old, new)}) for changed ones.
+
+    Opening stock counts as a change only for a product that has none yet,
+    as that is the only case the import writes it.
+    """
+    existing = {
+        row["sku"]: row
+        for row in conn.execute(
+            f"SELECT {', '.join(SEED_COLUMNS)}, stock FROM products WHERE sku IN (SELECT value FROM json_each(?))",
+            (json.dumps([values[0] for values in rows]),),
         )
+    }
+    opening = {sku: stock for stock, sku in stocks}
+    for values in rows:
+        old = existing.get(values[0])
+        if old is None:
+            yield "+", values[0], None
+            continue
+        changes = {col: (old[col], new) for col, new in zip(SEED_COLUMNS, values) if old[col] != new}
+        if old["stock"] is None and values[0] in opening:
+            changes["stock"] = (None, opening[values[0]])
+        if changes:
+            yield "~", values[0], changes
+
+
+SEARCH_SYNC_TRIGGERS = ("products_fts_insert", "products_fts_update")
+
+
+def drop_search_triggers(conn: sqlite3.Connection):
+    """Drop the FTS insert/update triggers inside the caller's transaction; returns them for recreating."""
+    triggers = conn.execute(
+        "SELECT name, sql FROM sqlite_master WHERE type = 'trigger' AND name IN (SELECT value FROM json_each(?))",
+        (json.dumps(SEARCH_SYNC_TRIGGERS),),
+    ).fetchall()
+    for trigger in triggers:
+        conn.execute(f"DROP TRIGGER {trigger['name']}")
+    return triggers
+
+
+def write_catalog_chunk(conn: sqlite3.Connection, rows, stocks):
+    """Write the new and changed rows of one chunk in one transaction; returns its diff.
+
+    The diff is taken under the write lock, so it is exact. The per-row FTS
+    triggers cost several times more than indexing the chunk with a single
+    INSERT ... SELECT, so they are dropped and recreated from their stored
+    SQL inside the same transaction: no other connection ever sees the
+    catalog without them, and a failure, Ctrl-C included, rolls the DDL
+    back too. The catalog version is bumped in the same transaction.
+    """
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        diff = {sku: (kind, changes) for kind, sku, changes in diff_catalog_chunk(conn, rows, stocks)}
+        stale = [sku for sku, (kind, changes) in diff.items() if kind == "~" and not changes.keys().isdisjoint(SEARCH_COLUMNS)]
+        reindex = [sku for sku, (kind, changes) in diff.items() if kind == "+"] + stale
+        writes = [values for values in rows if values[0] in diff]
+        triggers = drop_search_triggers(conn) if writes else []
+        conn.executemany(PRODUCT_UPSERT, writes)
+        conn.executemany("UPDATE products SET stock = ? WHERE sku = ? AND stock IS NULL", stocks)
+        chunk_ids = "SELECT id FROM products WHERE sku IN (SELECT value FROM json_each(?))"
+        if stale:
+            conn.execute(f"DELETE FROM products_fts WHERE rowid IN ({chunk_ids})", (json.dumps(stale),))
+        if reindex:
+            conn.execute(
+                f"INSERT INTO products_fts (rowid, {', '.join(SEARCH_COLUMNS)}) "
+                f"SELECT id, {SEARCH_VALUES.format(prefix='')} FROM products WHERE id IN ({chunk_ids})",
+                (json.dumps(reindex),),
+            )
+        for trigger in triggers:
+            conn.execute(trigger["sql"])
+        if diff:
+            bump_version(conn, "catalog_version")
         conn.commit()
-        conn.close()
+    except BaseException:
+        conn.rollback()
+        raise
+    return diff
 
-    return "", 200
+
+def bulk_load_catalog(conn: sqlite3.Connection, chunks):
+    """Write every chunk in one transaction; yields each chunk's diff.
+
+    For a new catalog, indexing chunk by chunk only grows FTS segments that
+    have to be merged again, so the triggers stay dropped for the whole load
+    and the index is rebuilt once at the end. Other writers wait for the
+    whole load, and an interrupted load leaves the catalog as it was.
+    """
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        triggers = drop_search_triggers(conn)
+        changed = False
+        for rows, stocks in chunks:
+            diff = {sku: (kind, changes) for kind, sku, changes in diff_catalog_chunk(conn, rows, stocks)}
+            conn.executemany(PRODUCT_UPSERT, [values for values in rows if values[0] in diff])
+            conn.executemany("UPDATE products SET stock = ? WHERE sku = ? AND stock IS NULL", stocks)
+            changed = changed or bool(diff)
+            yield diff
+        if changed:
+            rebuild_search_index(conn.cursor())
+            bump_version(conn, "catalog_version")
+        for trigger in triggers:
+            conn.execute(trigger["sql"])
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+
+
+def catalog_chunks(records, chunk_size: int, stats, report):
+    """Group (line number, record) pairs into (rows, opening stocks) chunks, reporting rejected lines."""
+    records = iter(records)
+    while True:
+        chunk = [record for _, record in zip(range(chunk_size), records)]
+        if not chunk:
+            return
+        rows, stocks = [], []
+        for number, record in chunk:
+            try:
+                values, stock = catalog_row(record)
+            except (ValueError, TypeError) as exc:
+                stats["rejected"] += 1
+                report("!", f"line {number}", str(exc))
+                continue
+            rows.append(values)
+            if stock is not None:
+                stocks.append((stock, values[0]))
+        stats["rows"] += len(rows)
+        yield rows, stocks
+
+
+def import_catalog(conn: sqlite3.Connection, records, chunk_size: int = CATALOG_IMPORT_CHUNK, dry_run: bool = False, report=None):
+    """Upsert (line number, record) pairs chunk by chunk; returns counters.
+
+    Each chunk is diffed against the stored rows by sku, and only new or
+    changed products are written, in one transaction per chunk, so memory
+    stays at one chunk and other writers wait for a chunk at most. Each
+    chunk that writes bumps the catalog version in its own transaction, so
+    a failed or interrupted import leaves the chunks before it committed
+    and visible, and nothing of the rest. Into a catalog of less than one
+    chunk, such as a freshly seeded one, the whole import is one
+    transaction instead (bulk_load_catalog). A stock value
+    is opening stock, as in PRODUCTS_SEED. report(kind, sku, detail) is
+    called for each rejected line (kind "!") and, in a dry run, which
+    writes nothing, for each product that would be added ("+") or changed
+    ("~").
+    """
+    stats = {"rows": 0, "added": 0, "changed": 0, "unchanged": 0, "rejected": 0}
+    report = report or (lambda kind, key, detail: None)
+    chunks = catalog_chunks(records, chunk_size, stats, report)
+    if dry_run:
+        for rows, stocks in chunks:
+            for kind, sku, changes in diff_catalog_chunk(conn, rows, stocks):
+                stats["added" if kind == "+" else "changed"] += 1
+                report(kind, sku, changes)
+    else:
+        stored = conn.execute("SELECT COUNT(*) FROM (SELECT 1 FROM products LIMIT ?)", (chunk_size,)).fetchone()[0]
+        if stored < chunk_size:
+            diffs = bulk_load_catalog(conn, chunks)
+        else:
+            diffs = (write_catalog_chunk(conn, rows, stocks) for rows, stocks in chunks)
+        for diff in diffs:
+            for kind, changes in diff.values():
+                stats["added" if kind == "+" else "changed"] += 1
+    stats["unchanged"] = stats["rows"] - stats["added"] - stats["changed"]
+    return stats
+
+
+def export_catalog(conn: sqlite3.Connection, stream, fmt: str) -> int:
+    """Write every product to stream straight off the cursor; returns the row count."""
+    cur = conn.cursor()
+    cur.row_factory = None
+    cur.execute(f"SELECT {', '.join(CATALOG_COLUMNS)} FROM products ORDER BY id")
+    count = 0
+    if fmt == "csv":
+        writer = csv.writer(stream)
+        writer.writerow(CATALOG_COLUMNS)
+        for row in cur:
+            writer.writerow(row)
+            count += 1
+    else:
+        for row in cur:
+            stream.write(json.dumps(dict(zip(CATALOG_COLUMNS, row)), ensure_ascii=False) + "\n")
+            count += 1
+    return count
+
+
+catalog_cli = AppGroup("catalog", help="Bulk catalog import and export as CSV or JSONL.")
+app.cli.add_command(catalog_cli)
+
+
+@catalog_cli.command("import")
+@click.argument("path")
+@click.option("--format", "fmt", type=click.Choice(["csv", "jsonl"]), help="Defaults to the file extension.")
+@click.option("--chunk-size", type=int, default=CATALOG_IMPORT_CHUNK, show_default=True)
+@click.option("--dry-run", is_flag=True, help="Report what would be added or changed without writing.")
+@click.option("--show", type=int, default=50, show_default=True, help="Diff lines and errors to print.")
+def catalog_import_command(path, fmt, chunk_size, dry_run, show):
+    """Upsert products by sku from PATH ("-" for stdin).
+
+    Columns are those of PRODUCTS_SEED plus an optional opening stock.
+    Loading a million rows into a new catalog takes about a minute on one
+    core, most of it building the search index.
+    """
+    ensure_db()
+    shown = [0]
+
+    def report(kind, key, detail):
+        if shown[0] >= show:
+            return
+        shown[0] += 1
+        if kind == "!":
+            print(f"! {key}: {detail}", file=sys.stderr)
+        elif detail is None:
+            print(f"+ {key}")
+        else:
+            print(f"~ {key}: " + "; ".join(f"{col} {old!r} -> {new!r}" for col, (old, new) in detail.items()))
+
+    stream = sys.stdin if path == "-" else open(path, encoding="utf-8-sig", newline="")
+    started = time.perf_counter()
+    try:
+        records = read_catalog_records(stream, catalog_format(path, fmt))
+        stats = import_catalog(get_db(), records, chunk_size=chunk_size, dry_run=dry_run, report=report)
+    finally:
+        if stream is not sys.stdin:
+            stream.close()
+    elapsed = time.perf_counter() - started
+    seen = stats["rows"] + stats["rejected"]
+    rate = f"{seen / elapsed:,.0f} rows/s" if elapsed else "n/a"
+    summary = f"{stats['added']} added, {stats['changed']} changed, {stats['unchanged']} unchanged"
+    if dry_run:
+        summary = "dry run, " + summary
+    print(f"{seen} rows in {elapsed:.2f}s ({rate}): {summary}, {stats['rejected']} rejected", file=sys.stderr)
+    if stats["rejected"]:
+        sys.exit(1)
+
+
+@catalog_cli.command("export")
+@click.argument("path")
+@click.option("--format", "fmt", type=click.Choice(["csv", "jsonl"]), help="Defaults to the file extension.")
+def catalog_export_command(path, fmt):
+    """Write every product to PATH ("-" for stdout).
+
+    The output reads back with `flask catalog import`.
+    """
+    ensure_db()
+    stream = sys.stdout if path == "-" else open(path, "w", encoding="utf-8", newline="")
+    started = time.perf_counter()
+    try:
+        count = export_catalog(get_db(), stream, catalog_format(path, fmt))
+    finally:
+        if stream is not sys.stdout:
+            stream.close()
+    elapsed = time.perf_counter() - started
+    rate = f"{count / elapsed:,.0f} rows/s" if elapsed else "n/a"
+    print(f"exported {count} products in {elapsed:.2f}s ({rate})", file=sys.stderr)
+
+
+@app.route("/healthz")
+def healthz():
+    return jsonify(
+        {
+            "ok": True,
+            "db_pool": DB_POOL.stats(),
+            "catalog_cache": CATALOG_CACHE.stats(),
+            "fragment_cache": FRAGMENT_CACHE.stats(),
+            "compressed_cache": COMPRESSED_CACHE.stats(),
+            "email_sender": EMAIL_SENDER.stats(),
+            "webhook_consumer": WEBHOOK_CONSUMER.stats(),
+            "stock_sweeper": STOCK_SWEEPER.stats(),
+            "image_cache": IMAGE_CACHE.stats(),
+        }
+    )
+
+
+@app.route("/metrics")
+def metrics():
+    return app.response_class(METRICS.render(), content_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+@app.get("/img/<int:pid>/<int:width>")
+def product_image(pid: int, width: int):
+    if width not in IMAGE_WIDTHS:
+        abort(404)
+    product = fetch_product(pid)
+    if product is None:
+        abort(404)
+    source = product["image"]
+    accept = request.headers.get("Accept", "")
+    if "image/avif" in accept and pillow_encodes_avif():
+        fmt = "avif"
+    else:
+        fmt = "webp" if "image/webp" in accept else "jpeg"
+    try:
+        path = IMAGE_CACHE.variant(source, width, fmt)
+    except ImportError:
+        print("IMAGE ERROR: Pillow is not installed; serving the original", file=sys.stderr)
+        return redirect(source if "://" in source else url_for("static", filename=source.removeprefix("/static/")))
+    except FileNotFoundError:
+        abort(404)
+    except (OSError, ValueError) as exc:
+        print(f"IMAGE ERROR: product {pid} ({source}): {exc}", file=sys.stderr)
+        abort(502)
+    resp = send_file(path, mimetype=IMAGE_FORMATS[fmt][0], conditional=True)
+    resp.vary.add("Accept")
+    if request.args.get("v") == image_version(source):
+        resp.headers["Cache-Control"] = f"public, max-age={IMAGE_MAX_AGE}, immutable"
+    else:
+        resp.headers["Cache-Control"] = "public, max-age=300"
+    return resp
+
+
+ORDER_EXPORT_COLUMNS = (
+    "order_id",
+    "created_at",
+    "status",
+    "email",
+    "currency",
+    "total_cents",
+    "stripe_session_id",
+    "product_id",
+    "sku",
+    "quantity",
+    "price_cents",
+)
+
+
+CSV_FORMULA_PREFIXES = ("=", "+", "-", "@", "\t", "\r")
+
+
+def csv_safe(value):
+    """Quote text a spreadsheet would run as a formula (e.g. a customer email "=HYPERLINK(...)")."""
+    if isinstance(value, str) and value.startswith(CSV_FORMULA_PREFIXES):
+        return "'" + value
+    return value
+
+
+class EchoWriter:
+    """A write() that hands the text back, so csv.writer rows can be yielded one by one."""
+
+    def write(self, text: str) -> str:
+        return text
+
+
+def report_range(default_days: Optional[int] = None):
+    """The from/to query args (YYYY-MM-DD, UTC, both inclusive) as [start, end) strings."""
+    try:
+        start, end = (request.args.get(name) for name in ("from", "to"))
+        start = datetime.strptime(start, "%Y-%m-%d").date() if start else None
+        end = datetime.strptime(end, "%Y-%m-%d").date() if end else None
+    except ValueError:
+        abort(400)
+    if start is None and default_days:
+        start = (end or datetime.utcnow().date()) - timedelta(days=default_days - 1)
+    return start.isoformat() if start else "", (end + timedelta(days=1)).isoformat() if end else "9999"
+
+
+def iter_order_export(start: str, end: str, status: Optional[str]):
+    """CSV lines, one per order line item, stepped from a live cursor in created_at order."""
+    sql = """
+        SELECT o.id, o.created_at, o.status, o.email, o.currency, o.total_cents, o.stripe_session_id,
+               i.product_id, p.sku, i.quantity, i.price_cents
+        FROM orders o
+        LEFT JOIN order_items i ON i.order_id = o.id
+        LEFT JOIN products p ON p.id = i.product_id
+        WHERE o.created_at >= ? AND o.created_at < ?
+    """
+    params = [start, end]
+    if status:
+        sql += " AND o.status = ?"
+        params.append(status)
+    # Both created_at indexes already yield (created_at, id) order, so this never sorts.
+    sql += " ORDER BY o.created_at, o.id"
+    writer = csv.writer(EchoWriter())
+    cur = get_db().cursor()
+    cur.row_factory = None
+    try:
+        yield writer.writerow(ORDER_EXPORT_COLUMNS)
+        for row in cur.execute(sql, params):
+            yield writer.writerow([csv_safe(value) for value in row])
+    finally:
+        cur.close()
+
+
+@app.get("/admin/orders.csv")
+def admin_orders_csv():
+    """Order lines in a date range (?from=&to=, optional ?status=), streamed with constant memory."""
+    require_admin()
+    start, end = report_range()
+    rows = iter_order_export(start, end, request.args.get("status"))
+    resp = app.response_class(stream_with_context(buffered_stream(rows)), mimetype="text/csv")
+    resp.headers["Content-Disposition"] = "attachment; filename=orders.csv"
+    return resp
+
+
+@app.get("/admin/sales")
+def admin_sales():
+    """Paid units and revenue per product per day from the sales_daily rollup (default: last SALES_REPORT_DAYS)."""
+    require_admin()
+    start, end = report_range(default_days=SALES_REPORT_DAYS)
+    rows = get_db().execute(
+        """
+        SELECT s.day, s.product_id, p.sku, s.units, s.revenue_cents, s.orders
+        FROM sales_daily s LEFT JOIN products p ON p.id = s.product_id
+        WHERE s.day >= ? AND s.day < ?
+        ORDER BY s.day, s.product_id
+        """,
+        (start, end),
+    ).fetchall()
+    return jsonify({"ok": True, "currency": CURRENCY, "rows": [dict(row) for row in rows]})
+
+
+@app.get("/admin/profiles")
+def admin_profiles():
+    require_admin()
+    return jsonify({"ok": True, "captures": PROFILER.list()})
+
+
+@app.get("/admin/profiles/<capture_id>")
+def admin_profile(capture_id: str):
+    require_admin()
+    path = PROFILER.path_for(capture_id)
+    if path is None:
+        abort(404)
+    return send_file(path, mimetype="application/octet-stream", as_attachment=True, download_name=os.path.basename(path))
 
 
 if __name__ == "__main__":
     os.makedirs(BASE_DIR, exist_ok=True)
-    init_db()
+    with app.app_context():
+        init_db()
+    build_assets()
     app.run(debug=False)
@@ -0,0 +1,278 @@
+"""ASGI entry point for the storefront.
+
+    uvicorn asgi:application --workers 2
+    GUNICORN_WORKER_CLASS=uvicorn_worker.UvicornWorker gunicorn -c gunicorn.conf.py asgi:application
+
+The Flask app is reused unchanged: routing, hooks, sessions and templates all
+behave as under gunicorn's gthread workers. What changes is where requests
+wait. Socket reads and writes happen on the event loop. Flask and SQLite
+work runs on an executor of SHOP_ASYNC_THREADS threads, one hop per phase.
+Views listed in ASYNC_VIEWS are coroutines that give their thread back
+while waiting on the network. Checkout is one of them, so a slow Stripe API
+no longer pins a worker thread per shopper.
+
+The hot read endpoints (/, /product/<id>, /api/search, /api/products) are
+deliberately not in ASYNC_VIEWS. They wait only on SQLite, which blocks a
+thread however it is called, so an async variant would be the same single
+executor hop with more bookkeeping. bench/async_bench.py's catalog scenario
+drives all four in both modes.
+
+Every phase of a request runs in the same contextvars.Context, so the
+request context, g, and the per-request SQL stats follow it from thread to
+thread. The slow-request profiler samples a single thread, so it skips the
+async views. A streamed page (/?view=all) keeps its pooled connection between
+chunks, so SHOP_DB_POOL_SIZE should cover SHOP_ASYNC_THREADS plus the number
+of such streams expected at once.
+
+Lifespan startup migrates and seeds the database and builds the static
+assets, as gunicorn's on_starting hook does for app:app, so plain uvicorn
+serves a ready database too. Each worker process runs it; both steps are
+safe to run at once from several processes and cheap once done.
+"""
+import asyncio
+import contextvars
+import io
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+import stripe
+from flask import has_app_context, request_started
+from werkzeug.exceptions import HTTPException
+from werkzeug.routing import RequestRedirect
+
+import app as shop
+from app import app
+
+ASYNC_THREADS = int(os.environ.get("SHOP_ASYNC_THREADS", str(shop.DB_POOL_SIZE)))
+ASYNC_MAX_BODY = int(os.environ.get("SHOP_ASYNC_MAX_BODY", str(1024 * 1024)))
+
+EXECUTOR = ThreadPoolExecutor(ASYNC_THREADS, thread_name_prefix="shop-async")
+
+
+async def create_checkout_session(run):
+    checkout = await run(shop.begin_checkout)
+    if not isinstance(checkout, shop.CheckoutRequest):
+        return checkout
+    try:
+        session_obj = await shop.create_stripe_checkout_async(checkout)
+    except stripe.StripeError as exc:
+        return await run(shop.checkout_failed, checkout, exc)
+    return await run(shop.finish_checkout, checkout, session_obj)
+
+
+# endpoint -> coroutine taking run(fn, *args), which calls fn on the executor
+ASYNC_VIEWS = {
+    "create_checkout_session": create_checkout_session,
+}
+shop.PROFILE_ENDPOINTS = shop.PROFILE_ENDPOINTS - ASYNC_VIEWS.keys()
+
+
+def build_environ(scope, body: bytes):
+    server = scope.get("server") or ("localhost", 80)
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", "").encode("utf-8").decode("latin-1"),
+        "PATH_INFO": scope["path"].encode("utf-8").decode("latin-1"),
+        "QUERY_STRING": scope["query_string"].decode("latin-1"),
+        "SERVER_NAME": server[0],
+        "SERVER_PORT": str(server[1] or 80),
+        "SERVER_PROTOCOL": f"HTTP/{scope.get('http_version', '1.1')}",
+        "REMOTE_ADDR": scope["client"][0] if scope.get("client") else "",
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": io.BytesIO(body),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": True,
+        "wsgi.run_once": False,
+    }
+    for raw_name, raw_value in scope["headers"]:
+        name = raw_name.decode("latin-1").upper().replace("-", "_")
+        if name not in ("CONTENT_TYPE", "CONTENT_LENGTH"):
+            name = "HTTP_" + name
+        value = raw_value.decode("latin-1")
+        if name in environ:
+            value = environ[name] + ("; " if name == "HTTP_COOKIE" else ",") + value
+        environ[name] = value
+    return environ
+
+
+class BodyTooLarge(Exception):
+    pass
+
+
+async def read_body(receive):
+    """The whole request body, or None if the client went away first."""
+    chunks, size = [], 0
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            return None
+        chunk = message.get("body", b"")
+        size += len(chunk)
+        if size > ASYNC_MAX_BODY:
+            raise BodyTooLarge()
+        chunks.append(chunk)
+        if not message.get("more_body"):
+            return b"".join(chunks)
+
+
+def match_endpoint(environ):
+    try:
+        endpoint, _ = app.url_map.bind_to_environ(environ, server_name=app.config["SERVER_NAME"]).match()
+    except (HTTPException, RequestRedirect):
+        return None
+    return endpoint
+
+
+def sync_request(environ):
+    """A whole request in one executor call, exactly as Flask.wsgi_app runs it."""
+    ctx = app.request_context(environ)
+    error = None
+    try:
+        try:
+            ctx.push()
+            response = app.full_dispatch_request()
+        except Exception as exc:
+            error = exc
+            response = app.handle_exception(exc)
+        return response.get_wsgi_response(environ)
+    finally:
+        ctx.pop(error)
+
+
+def hop(fn, *args):
+    """One executor hop of an async view.
+
+    The pooled connection goes back before the hop ends: holding it while
+    queued behind hops that wait for a connection would deadlock the pool.
+    """
+    try:
+        return fn(*args)
+    finally:
+        if has_app_context():
+            shop.release_db(None)
+
+
+def open_request(ctx):
+    ctx.push()
+    request_started.send(app, _async_wrapper=app.ensure_sync)
+    return app.preprocess_request()
+
+
+def close_request(ctx, environ, rv):
+    """Finish what open_request() began; rv is the view's return value or its exception."""
+    error = None
+    try:
+        try:
+            if isinstance(rv, Exception):
+                # Raised again so Flask's handlers see an active exception on this thread.
+                try:
+                    raise rv
+                except Exception as exc:
+                    rv = app.handle_user_exception(exc)
+            response = app.finalize_request(rv)
+        except Exception as exc:
+            error = exc
+            response = app.handle_exception(exc)
+        return response.get_wsgi_response(environ)
+    finally:
+        ctx.pop(error)
+
+
+async def async_request(environ, view, run):
+    """Flask.wsgi_app split into hops, with the view awaited in the middle."""
+    ctx = app.request_context(environ)
+    try:
+        rv = await run(open_request, ctx)
+        if rv is None:
+            rv = await view(run)
+    except Exception as exc:
+        rv = exc
+    return await run(close_request, ctx, environ, rv)
+
+
+async def send_response(send, run, app_iter, status: str, headers):
+    await send(
+        {
+            "type": "http.response.start",
+            "status": int(status.split(" ", 1)[0]),
+            "headers": [(name.lower().encode("latin-1"), value.encode("latin-1")) for name, value in headers],
+        }
+    )
+    try:
+        if isinstance(app_iter, (list, tuple)):
+            for chunk in app_iter:
+                await send({"type": "http.response.body", "body": chunk, "more_body": True})
+        else:
+            # Generators (streamed pages, compress_stream) may touch SQLite or
+            # templates, so each chunk is produced on the executor.
+            chunks = iter(app_iter)
+            done = object()
+            while True:
+                chunk = await run(next, chunks, done)
+                if chunk is done:
+                    break
+                if chunk:
+                    await send({"type": "http.response.body", "body": chunk, "more_body": True})
+        await send({"type": "http.response.body", "body": b""})
+    finally:
+        if hasattr(app_iter, "close"):
+            await run(app_iter.close)
+
+
+def prepare():
+    with app.app_context():
+        applied, seeded = shop.init_db()
+    shop.build_assets()
+    print(
+        f"database ready: migrations {applied or 'none'}, seed {'applied' if seeded else 'unchanged'}",
+        file=sys.stderr,
+    )
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            try:
+                await asyncio.get_running_loop().run_in_executor(EXECUTOR, prepare)
+            except Exception as exc:
+                await send({"type": "lifespan.startup.failed", "message": f"{type(exc).__name__}: {exc}"})
+                return
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            EXECUTOR.shutdown(wait=False)
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def application(scope, receive, send):
+    if scope["type"] == "lifespan":
+        return await lifespan(receive, send)
+    if scope["type"] != "http":
+        return
+    try:
+        body = await read_body(receive)
+    except BodyTooLarge:
+        headers = [("Content-Type", "text/plain; charset=utf-8"), ("Content-Length", "0")]
+        return await send_response(send, None, [], "413 Request Entity Too Large", headers)
+    if body is None:
+        return
+    environ = build_environ(scope, body)
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+
+    def run(fn, *args):
+        return loop.run_in_executor(EXECUTOR, context.run, fn, *args)
+
+    def run_hop(fn, *args):
+        return run(hop, fn, *args)
+
+    view = ASYNC_VIEWS.get(match_endpoint(environ))
+    if view is None:
+        app_iter, status, headers = await run(sync_request, environ)
+    else:
+        app_iter, status, headers = await async_request(environ, view, run_hop)
+    await send_response(send, run, app_iter, status, headers)
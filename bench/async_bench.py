@@ -0,0 +1,192 @@
+"""Concurrency limits of the sync (gthread) and async (asgi.py) serving modes.
+
+    python bench/async_bench.py [--workers 2] [--threads 8] [--concurrency 8,32,128]
+                                [--requests 400] [--stripe-latency 0.25]
+
+Starts gunicorn twice on the same hardware and settings: once with gthread
+workers serving app:app, and once with uvicorn workers serving
+asgi:application, where SHOP_ASYNC_THREADS equals --threads. Stripe is
+replaced by a local stub that answers after --stripe-latency seconds. For
+each concurrency level the script drives a checkout scenario, where Stripe
+latency dominates, and a catalog read scenario, which is pure SQLite: the
+home page, a product page, /api/search and /api/products in turn. Each
+virtual user is an httpx client with its own session cookie. Runs against a
+throwaway database, so it never touches shop.db.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import httpx
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MODES = {
+    "sync": {"GUNICORN_WORKER_CLASS": "gthread", "app": "app:app"},
+    "async": {"GUNICORN_WORKER_CLASS": "uvicorn_worker.UvicornWorker", "app": "asgi:application"},
+}
+
+
+class StripeStub(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    latency = 0.25
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        time.sleep(self.latency)
+        session_id = uuid.uuid4().hex
+        body = json.dumps(
+            {"id": f"cs_bench_{session_id}", "object": "checkout.session", "url": f"https://pay.example/{session_id}"}
+        ).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def start_stripe_stub(latency: float) -> str:
+    StripeStub.latency = latency
+    ThreadingHTTPServer.daemon_threads = True
+    ThreadingHTTPServer.request_queue_size = 1024
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StripeStub)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_port}"
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(mode: str, args, stripe_url: str):
+    port = free_port()
+    env = dict(
+        os.environ,
+        GUNICORN_BIND=f"127.0.0.1:{port}",
+        GUNICORN_WORKERS=str(args.workers),
+        GUNICORN_THREADS=str(args.threads),
+        GUNICORN_WORKER_CLASS=MODES[mode]["GUNICORN_WORKER_CLASS"],
+        SHOP_ASYNC_THREADS=str(args.threads),
+        SHOP_DB_PATH=os.path.join(tempfile.mkdtemp(), "bench.db"),
+        STRIPE_API_BASE=stripe_url,
+        STRIPE_SECRET_KEY="sk_test_bench",
+        STRIPE_PUBLISHABLE_KEY="pk_test_bench",
+        STRIPE_MAX_RETRIES="0",
+    )
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "--backlog", "2048", MODES[mode]["app"]],
+        cwd=ROOT_DIR,
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    base_url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            if httpx.get(base_url + "/healthz", timeout=1).status_code == 200:
+                return proc, base_url
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    proc.terminate()
+    raise SystemExit(f"{mode} server did not come up within 30s")
+
+
+async def checkout_user(client: httpx.AsyncClient):
+    await client.post("/api/cart/add", json={"product_id": 1, "qty": 1})
+    return lambda: client.post("/create-checkout-session?lang=en", data={"email": "bench@example.com"}), 302
+
+
+CATALOG_PATHS = ("/?lang=en", "/product/1?lang=en", "/api/search?q=ca&lang=en", "/api/products?lang=en&limit=60")
+
+
+async def catalog_user(client: httpx.AsyncClient):
+    paths = itertools.cycle(CATALOG_PATHS)
+    return lambda: client.get(next(paths)), 200
+
+
+SCENARIOS = {"checkout": checkout_user, "catalog": catalog_user}
+
+
+async def run_level(base_url: str, scenario: str, concurrency: int, requests: int):
+    limits = httpx.Limits(max_connections=1, max_keepalive_connections=1)
+    clients = [httpx.AsyncClient(base_url=base_url, timeout=60, limits=limits) for _ in range(concurrency)]
+    samples, errors = [], 0
+    remaining = [requests]
+
+    async def user(client):
+        nonlocal errors
+        send, expected = await SCENARIOS[scenario](client)
+        while remaining[0] > 0:
+            remaining[0] -= 1
+            begin = time.perf_counter()
+            try:
+                status = (await send()).status_code
+            except httpx.HTTPError:
+                status = None
+            samples.append((time.perf_counter() - begin) * 1000)
+            errors += status != expected
+
+    try:
+        started = time.perf_counter()
+        await asyncio.gather(*(user(client) for client in clients))
+        elapsed = time.perf_counter() - started
+    finally:
+        await asyncio.gather(*(client.aclose() for client in clients))
+    samples.sort()
+    return {
+        "rps": len(samples) / elapsed,
+        "p50": statistics.median(samples),
+        "p95": samples[int(len(samples) * 0.95) - 1],
+        "errors": errors,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--concurrency", default="8,32,128")
+    parser.add_argument("--requests", type=int, default=400, help="requests per scenario and level")
+    parser.add_argument("--stripe-latency", type=float, default=0.25)
+    parser.add_argument("--scenarios", default="checkout,catalog")
+    args = parser.parse_args()
+
+    levels = [int(n) for n in args.concurrency.split(",")]
+    stripe_url = start_stripe_stub(args.stripe_latency)
+    ceiling = args.workers * args.threads / args.stripe_latency
+    print(f"{args.workers} workers x {args.threads} threads; sync checkout ceiling ~{ceiling:.0f} req/s")
+    print(f"{'mode':<6} {'scenario':<9} {'conc':>5} {'req/s':>8} {'p50 ms':>9} {'p95 ms':>9} {'errors':>7}")
+    for mode in MODES:
+        proc, base_url = start_server(mode, args, stripe_url)
+        try:
+            for scenario in args.scenarios.split(","):
+                for concurrency in levels:
+                    result = asyncio.run(run_level(base_url, scenario, concurrency, args.requests))
+                    print(
+                        f"{mode:<6} {scenario:<9} {concurrency:>5} {result['rps']:>8.0f} "
+                        f"{result['p50']:>9.1f} {result['p95']:>9.1f} {result['errors']:>7}",
+                        flush=True,
+                    )
+        finally:
+            proc.terminate()
+            proc.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""Cart pricing and render latency as the number of cart lines grows.
+
+    python bench/cart_bench.py [--lines 1,5,20,50,100] [--requests 200]
+
+Runs against a throwaway database, so it never touches shop.db.
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+os.environ.setdefault("SHOP_DB_PATH", os.path.join(tempfile.mkdtemp(), "bench.db"))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+import app as shop  # noqa: E402
+
+
+def seed_products(count: int):
+    with shop.app.app_context():
+        shop.ensure_db()
+        conn = shop.get_db()
+        rows = []
+        for i in range(count):
+            rows.append(
+                (
+                    f"BENCH-CART-{i:05d}",
+                    f"Bench Item {i}",
+                    f"منتج {i}",
+                    shop.BASE_PRICES[i % len(shop.BASE_PRICES)],
+                    shop.PRODUCT_IMAGES[i % len(shop.PRODUCT_IMAGES)],
+                )
+            )
+        conn.executemany(
+            """
+            INSERT OR IGNORE INTO products (sku, name_en, name_ar, price_cents, image)
+            VALUES (?, ?, ?, ?, ?)
+            """,
+            rows,
+        )
+        shop.bump_version(conn, "catalog_version")
+        conn.commit()
+        return [row["id"] for row in conn.execute("SELECT id FROM products ORDER BY id")]
+
+
+def measure(client, requests: int):
+    samples = []
+    for _ in range(requests):
+        started = time.perf_counter()
+        resp = client.get("/cart?lang=en")
+        samples.append((time.perf_counter() - started) * 1000)
+        assert resp.status_code == 200
+    samples.sort()
+    return {
+        "p50": statistics.median(samples),
+        "p95": samples[int(len(samples) * 0.95) - 1],
+        "mean": statistics.fmean(samples),
+    }
+
+
+def measure_pricing(cart, requests: int):
+    samples = []
+    with shop.app.test_request_context("/cart"):
+        shop.session["cart"] = cart
+        for _ in range(requests):
+            started = time.perf_counter()
+            shop.cart_items()
+            samples.append((time.perf_counter() - started) * 1000)
+    return statistics.median(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--lines", default="1,5,20,50,100")
+    parser.add_argument("--requests", type=int, default=200)
+    args = parser.parse_args()
+
+    sizes = [int(n) for n in args.lines.split(",")]
+    product_ids = seed_products(max(sizes))
+    client = shop.app.test_client()
+    client.get("/cart")
+
+    print(f"{'lines':>6} {'pricing ms':>11} {'p50 ms':>9} {'p95 ms':>9} {'mean ms':>9}")
+    for size in sizes:
+        cart = {str(pid): 1 for pid in product_ids[:size]}
+        with client.session_transaction() as sess:
+            sess["cart"] = cart
+        pricing = measure_pricing(cart, args.requests)
+        result = measure(client, args.requests)
+        print(
+            f"{size:>6} {pricing:>11.3f} {result['p50']:>9.3f} {result['p95']:>9.3f} {result['mean']:>9.3f}"
+        )
+    print("db pool:", shop.DB_POOL.stats())
+
+
+if __name__ == "__main__":
+    main()
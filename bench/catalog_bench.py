@@ -0,0 +1,126 @@
+"""Keyset-paginated /api/products latency over a large synthetic catalog.
+
+    python bench/catalog_bench.py [--products 1000000] [--requests 300]
+
+Runs against a throwaway database, so it never touches shop.db. The FTS
+sync triggers are dropped on that database before seeding: this benchmark
+is about the catalog indexes, and re-tokenising 1M rows would dominate the
+setup time.
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+os.environ.setdefault("SHOP_DB_PATH", os.path.join(tempfile.mkdtemp(), "bench.db"))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+import app as shop  # noqa: E402
+
+CHUNK = 50_000
+SCENARIOS = [
+    ("first page", {}),
+    ("deep page", None),
+    ("category", {"category": "Audio"}),
+    ("category by price", {"category": "Gaming", "sort": "price_asc"}),
+    ("price range", {"min_price": 5000, "max_price": 9000, "sort": "price_desc"}),
+    ("badge", {"badge": "Limited", "sort": "newest"}),
+]
+
+
+def iter_synthetic_products(count: int, start_index: int = 1):
+    """Same shape as build_extra_products(), but lazy and unbounded."""
+    names = shop.EXTRA_PRODUCT_NAMES
+    for i in range(start_index, start_index + count):
+        name_en, name_ar = names[(i - 1) % len(names)]
+        category_en, category_ar = shop.CATEGORIES[(i - 1) % len(shop.CATEGORIES)]
+        badge_en, badge_ar = shop.BADGES[(i * 7) % len(shop.BADGES)]
+        desc_en, desc_ar = shop.DESCRIPTIONS[(i - 1) % len(shop.DESCRIPTIONS)]
+        yield (
+            f"BENCH-CAT-{i:07d}",
+            f"{name_en} {i}",
+            f"{name_ar} {i}",
+            shop.BASE_PRICES[(i * 13) % len(shop.BASE_PRICES)] + i % 100,
+            shop.PRODUCT_IMAGES[(i - 1) % len(shop.PRODUCT_IMAGES)],
+            category_en,
+            category_ar,
+            badge_en,
+            badge_ar,
+            desc_en,
+            desc_ar,
+        )
+
+
+def seed_products(count: int):
+    with shop.app.app_context():
+        shop.ensure_db()
+        conn = shop.get_db()
+        for trigger in ("products_fts_insert", "products_fts_update", "products_fts_delete"):
+            conn.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+        rows = iter_synthetic_products(count)
+        while True:
+            chunk = [row for _, row in zip(range(CHUNK), rows)]
+            if not chunk:
+                break
+            conn.executemany(
+                """
+                INSERT OR IGNORE INTO products (
+                    sku, name_en, name_ar, price_cents, image,
+                    category_en, category_ar, badge_en, badge_ar,
+                    description_en, description_ar
+                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                """,
+                chunk,
+            )
+            conn.commit()
+        shop.bump_version(conn, "catalog_version")
+        conn.commit()
+        conn.execute("ANALYZE")
+
+
+def deep_cursor(client) -> str:
+    cursor = None
+    for _ in range(50):
+        params = {"limit": 200}
+        if cursor:
+            params["cursor"] = cursor
+        cursor = client.get("/api/products", query_string=params).json["next_cursor"]
+    return cursor
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--products", type=int, default=1_000_000)
+    parser.add_argument("--requests", type=int, default=300)
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    seed_products(args.products)
+    elapsed = time.perf_counter() - started
+    print(f"seeded {args.products} products in {elapsed:.1f}s ({args.products / elapsed:,.0f} rows/s)")
+
+    client = shop.app.test_client()
+    rng = random.Random(11)
+    deep = {"cursor": deep_cursor(client)}
+    print(f"{'scenario':<20} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    for name, params in SCENARIOS:
+        params = dict(deep if params is None else params, lang=rng.choice(("ar", "en")))
+        samples = []
+        for _ in range(args.requests):
+            begin = time.perf_counter()
+            resp = client.get("/api/products", query_string=params)
+            samples.append((time.perf_counter() - begin) * 1000)
+            assert resp.status_code == 200 and resp.json["rows"]
+        samples.sort()
+        print(
+            f"{name:<20} {statistics.median(samples):>8.3f} "
+            f"{samples[int(len(samples) * 0.95) - 1]:>8.3f} {samples[int(len(samples) * 0.99) - 1]:>8.3f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
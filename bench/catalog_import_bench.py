@@ -0,0 +1,152 @@
+"""Throughput of `flask catalog import/export` on a large synthetic catalog.
+
+    python bench/catalog_import_bench.py [--products 1000000] [--format csv|jsonl]
+
+Writes a catalog file with the same rows as catalog_bench.py and imports it
+into a throwaway database, so it never touches shop.db. The import runs three
+times: into an empty catalog, again unchanged, and once as a dry run after
+one row in a hundred has had its price changed. Then the catalog is exported
+again. The process's peak RSS is printed after each step to show that
+memory does not grow with the file size.
+
+Two imports are also interrupted with KeyboardInterrupt, as Ctrl-C would: the
+first load halfway through the file, and the repriced file inside its second
+chunk's transaction, right after the FTS triggers were dropped. Each must
+leave all three FTS triggers in place and no transaction open, or the script
+exits with status 1.
+"""
+import argparse
+import csv
+import json
+import os
+import sys
+import resource
+import tempfile
+import time
+from typing import Optional
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+os.environ.setdefault("SHOP_DB_PATH", os.path.join(tempfile.mkdtemp(), "bench.db"))
+sys.path.insert(0, BENCH_DIR)
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+import app as shop  # noqa: E402
+from catalog_bench import iter_synthetic_products  # noqa: E402
+
+
+def write_catalog(path: str, fmt: str, count: int, reprice_every: int = 0):
+    with open(path, "w", encoding="utf-8", newline="") as stream:
+        writer = csv.writer(stream)
+        if fmt == "csv":
+            writer.writerow(shop.SEED_COLUMNS)
+        for i, row in enumerate(iter_synthetic_products(count), 1):
+            if reprice_every and i % reprice_every == 0:
+                row = row[:3] + (row[3] + 1,) + row[4:]
+            if fmt == "csv":
+                writer.writerow(row)
+            else:
+                stream.write(json.dumps(dict(zip(shop.SEED_COLUMNS, row)), ensure_ascii=False) + "\n")
+
+
+def timed(label: str, rows: int, fn):
+    started = time.perf_counter()
+    result = fn()
+    elapsed = time.perf_counter() - started
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(f"{label:<22} {elapsed:>8.2f}s {rows / elapsed:>12,.0f} rows/s {peak:>8.0f} MB  {result}", flush=True)
+
+
+def run_import(path: str, fmt: str, dry_run: bool = False):
+    with open(path, encoding="utf-8-sig", newline="") as stream:
+        stats = shop.import_catalog(shop.get_db(), shop.read_catalog_records(stream, fmt), dry_run=dry_run)
+    return {key: value for key, value in stats.items() if value}
+
+
+SEARCH_TRIGGERS = ("products_fts_insert", "products_fts_update", "products_fts_delete")
+
+
+def check_interrupted(conn, before: int) -> str:
+    names = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'trigger'")}
+    missing = [name for name in SEARCH_TRIGGERS if name not in names]
+    if missing or conn.in_transaction:
+        print(f"FAIL: interrupted import left open={conn.in_transaction} missing triggers={missing}", file=sys.stderr)
+        sys.exit(1)
+    return f"{count_products(conn) - before:+d} products, triggers intact"
+
+
+def count_products(conn) -> int:
+    return conn.execute("SELECT COUNT(*) FROM products").fetchone()[0]
+
+
+def run_interrupted_load(path: str, fmt: str, after: Optional[int] = None):
+    """Import path, raising KeyboardInterrupt once `after` records have been read."""
+    conn = shop.get_db()
+    before = count_products(conn)
+
+    def records(stream):
+        for number, record in enumerate(shop.read_catalog_records(stream, fmt)):
+            if number == after:
+                raise KeyboardInterrupt
+            yield record
+
+    with open(path, encoding="utf-8-sig", newline="") as stream:
+        try:
+            shop.import_catalog(conn, records(stream))
+        except KeyboardInterrupt:
+            return check_interrupted(conn, before)
+    print("FAIL: the import finished before it was interrupted", file=sys.stderr)
+    sys.exit(1)
+
+
+def run_interrupted_chunk(path: str, fmt: str):
+    """Import path, raising KeyboardInterrupt in the second written chunk once its FTS triggers are gone."""
+    drop_search_triggers = shop.drop_search_triggers
+    dropped = []
+
+    def drop_then_interrupt(conn):
+        triggers = drop_search_triggers(conn)
+        dropped.append(triggers)
+        if len(dropped) == 2:
+            raise KeyboardInterrupt
+        return triggers
+
+    shop.drop_search_triggers = drop_then_interrupt
+    try:
+        return run_interrupted_load(path, fmt)
+    finally:
+        shop.drop_search_triggers = drop_search_triggers
+
+
+def run_export(path: str, fmt: str):
+    with open(path, "w", encoding="utf-8", newline="") as stream:
+        return f"{shop.export_catalog(shop.get_db(), stream, fmt)} rows"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--products", type=int, default=1_000_000)
+    parser.add_argument("--format", choices=("csv", "jsonl"), default="csv")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp()
+    source = os.path.join(workdir, f"catalog.{args.format}")
+    repriced = os.path.join(workdir, f"repriced.{args.format}")
+    write_catalog(source, args.format, args.products)
+    write_catalog(repriced, args.format, args.products, reprice_every=100)
+    print(f"{args.products} products, {os.path.getsize(source) / 1e6:.0f} MB of {args.format}")
+    print(f"{'step':<22} {'time':>9} {'throughput':>17} {'peak rss':>11}")
+
+    with shop.app.app_context():
+        shop.ensure_db()
+        half = args.products // 2
+        timed("interrupted load", half, lambda: run_interrupted_load(source, args.format, after=half))
+        timed("import (empty db)", args.products, lambda: run_import(source, args.format))
+        timed("import (unchanged)", args.products, lambda: run_import(source, args.format))
+        timed("dry run (1% repriced)", args.products, lambda: run_import(repriced, args.format, dry_run=True))
+        chunk = 2 * shop.CATALOG_IMPORT_CHUNK
+        timed("interrupted chunk", chunk, lambda: run_interrupted_chunk(repriced, args.format))
+        timed("export", args.products, lambda: run_export(os.path.join(workdir, f"out.{args.format}"), args.format))
+
+
+if __name__ == "__main__":
+    main()
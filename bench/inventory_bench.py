@@ -0,0 +1,144 @@
+"""Checkout contention on one limited SKU: throughput and zero oversell.
+
+    python bench/inventory_bench.py [--stock 100] [--shoppers 600] [--processes 4] [--threads 50]
+
+Every shopper is a separate session that adds the same product to its cart
+and checks out. --processes x --threads checkouts race at once, from several
+processes, so the stock holds contend for SQLite's write lock just as
+gunicorn workers would. Stripe is a local stub that answers after
+--stripe-latency seconds. At the end the script checks that exactly
+min(stock, shoppers) checkouts got a hold, and that stock plus held
+quantity still adds up to the opening stock. It then lets every hold lapse
+and checks that the sweeper puts all of it back. Runs against a throwaway
+database, so it never touches shop.db.
+"""
+import argparse
+import multiprocessing
+import os
+import statistics
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+sys.path.insert(0, BENCH_DIR)
+
+from async_bench import StripeStub, start_stripe_stub  # noqa: E402
+
+os.environ.setdefault("SHOP_DB_PATH", os.path.join(tempfile.mkdtemp(), "bench.db"))
+os.environ.setdefault("SHOP_DB_POOL_SIZE", "64")
+os.environ.setdefault("SHOP_DB_POOL_TIMEOUT", "30")
+os.environ.update(
+    STRIPE_API_BASE=start_stripe_stub(0.05),
+    STRIPE_SECRET_KEY="sk_test_bench",
+    STRIPE_PUBLISHABLE_KEY="pk_test_bench",
+    STRIPE_MAX_RETRIES="0",
+)
+
+import app as shop  # noqa: E402
+
+SKU = "BENCH-LIMITED-001"
+
+
+def seed_product(stock: int) -> int:
+    with shop.app.app_context():
+        shop.ensure_db()
+        conn = shop.get_db()
+        conn.execute(
+            """
+            INSERT INTO products (sku, name_en, name_ar, price_cents, image, badge_en, badge_ar, stock)
+            VALUES (?, 'Bench Limited', 'منتج محدود', 9900, ?, 'Limited', 'محدود', ?)
+            ON CONFLICT(sku) DO UPDATE SET stock = excluded.stock
+            """,
+            (SKU, shop.PRODUCT_IMAGES[0], stock),
+        )
+        conn.execute("DELETE FROM stock_holds")
+        shop.bump_version(conn, "catalog_version")
+        conn.commit()
+        return conn.execute("SELECT id FROM products WHERE sku = ?", (SKU,)).fetchone()["id"]
+
+
+def shopper(args):
+    pid, n = args
+    client = shop.app.test_client()
+    begin = time.perf_counter()
+    added = client.post("/api/cart/add", json={"product_id": pid, "qty": 1})
+    if added.status_code != 200:
+        return "refused at cart", (time.perf_counter() - begin) * 1000
+    resp = client.post("/create-checkout-session?lang=en", data={"email": f"shopper{os.getpid()}-{n}@example.com"})
+    elapsed = (time.perf_counter() - begin) * 1000
+    if resp.status_code == 302 and resp.location.startswith("https://pay.example/"):
+        return "held", elapsed
+    return "refused at checkout", elapsed
+
+
+def run_batch(args):
+    pid, count, threads = args
+    with ThreadPoolExecutor(threads) as pool:
+        return list(pool.map(shopper, [(pid, n) for n in range(count)]))
+
+
+def stock_state(pid: int):
+    with shop.app.app_context():
+        conn = shop.get_db()
+        stock = conn.execute("SELECT stock FROM products WHERE id = ?", (pid,)).fetchone()["stock"]
+        held = conn.execute("SELECT COALESCE(SUM(quantity), 0) FROM stock_holds WHERE product_id = ?", (pid,)).fetchone()[0]
+    return stock, held
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--stock", type=int, default=100)
+    parser.add_argument("--shoppers", type=int, default=600)
+    parser.add_argument("--processes", type=int, default=4)
+    parser.add_argument("--threads", type=int, default=50, help="concurrent shoppers per process")
+    parser.add_argument("--stripe-latency", type=float, default=0.05)
+    args = parser.parse_args()
+
+    StripeStub.latency = args.stripe_latency
+    pid = seed_product(args.stock)
+    shop.DB_POOL.close_all()
+    per_process = -(-args.shoppers // args.processes)
+    started = time.perf_counter()
+    with multiprocessing.get_context("fork").Pool(args.processes) as pool:
+        batches = pool.map(run_batch, [(pid, per_process, args.threads)] * args.processes)
+    elapsed = time.perf_counter() - started
+
+    results = [result for batch in batches for result in batch]
+    samples = sorted(ms for _, ms in results)
+    outcomes = {}
+    for outcome, _ in results:
+        outcomes[outcome] = outcomes.get(outcome, 0) + 1
+    stock, held = stock_state(pid)
+    print(
+        f"{len(results)} checkouts ({args.processes} processes x {args.threads} threads) in {elapsed:.2f}s: "
+        f"{len(results) / elapsed:,.0f} checkouts/s, p50 {statistics.median(samples):.1f} ms, "
+        f"p95 {samples[int(len(samples) * 0.95) - 1]:.1f} ms"
+    )
+    print("outcomes:", ", ".join(f"{name} {count}" for name, count in sorted(outcomes.items())))
+    print(f"opening stock {args.stock}, left {stock}, held {held}")
+    expected = min(args.stock, len(results))
+    assert stock >= 0 and stock + held == args.stock, "stock does not add up"
+    assert outcomes.get("held", 0) == held == expected, f"oversold or undersold: {outcomes.get('held', 0)} holds for {expected} units"
+    print("oversold: 0")
+
+    with shop.app.app_context():
+        conn = shop.get_db()
+        conn.execute("UPDATE stock_holds SET expires_at = 0")
+        conn.commit()
+    started = time.perf_counter()
+    released = 0
+    while True:
+        swept = shop.STOCK_SWEEPER.drain_once()
+        if not swept:
+            break
+        released += swept
+    stock, held = stock_state(pid)
+    print(f"sweeper released {released} lapsed holds in {(time.perf_counter() - started) * 1000:.1f} ms; stock back to {stock}")
+    assert stock == args.stock and held == 0
+
+
+if __name__ == "__main__":
+    main()
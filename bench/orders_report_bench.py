@@ -0,0 +1,127 @@
+"""Order reporting: streamed /admin/orders.csv and the sales_daily rollup.
+
+    python bench/orders_report_bench.py [--orders 1000000] [--days 365] [--requests 50]
+
+Seeds a throwaway database (never shop.db) with synthetic orders spread over
+--days days, about four in five of them paid. It then streams the full CSV
+export through the test client, reporting throughput and the peak traced
+Python memory of the request. Finally it times a 30-day per-product sales
+report two ways: aggregated live from orders and order_items, and read from
+sales_daily.
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+os.environ.setdefault("SHOP_DB_PATH", os.path.join(tempfile.mkdtemp(), "bench.db"))
+os.environ.setdefault("SHOP_ADMIN_TOKEN", "bench")
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+import app as shop  # noqa: E402
+
+CHUNK = 50_000
+LIVE_REPORT = """
+    SELECT substr(o.created_at, 1, 10) AS day, i.product_id, SUM(i.quantity), SUM(i.quantity * i.price_cents)
+    FROM orders o JOIN order_items i ON i.order_id = o.id
+    WHERE o.status = 'paid' AND o.created_at >= ? AND o.created_at < ?
+    GROUP BY 1, 2
+"""
+ROLLUP_REPORT = "SELECT day, product_id, units, revenue_cents FROM sales_daily WHERE day >= ? AND day < ?"
+
+
+def seed_orders(count: int, days: int):
+    rng = random.Random(7)
+    start = datetime.utcnow() - timedelta(days=days)
+    with shop.app.app_context():
+        shop.ensure_db()
+        conn = shop.get_db()
+        products = [tuple(row) for row in conn.execute("SELECT id, price_cents FROM products")]
+        next_id = 1
+        while next_id <= count:
+            orders, items = [], []
+            for order_id in range(next_id, min(next_id + CHUNK, count + 1)):
+                created = start + timedelta(seconds=days * 86400 * order_id / count)
+                lines = rng.sample(products, rng.randint(1, 4))
+                quantities = [rng.randint(1, 3) for _ in lines]
+                total = sum(qty * price for qty, (_, price) in zip(quantities, lines))
+                status = "paid" if rng.random() < 0.8 else rng.choice(("pending", "expired", "failed"))
+                orders.append(
+                    (order_id, f"u{order_id}@example.com", total, shop.CURRENCY, status, f"cs_bench_{order_id}", created.isoformat())
+                )
+                items.extend((order_id, pid, qty, price) for qty, (pid, price) in zip(quantities, lines))
+            conn.executemany(
+                "INSERT INTO orders (id, email, total_cents, currency, status, stripe_session_id, created_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                orders,
+            )
+            conn.executemany("INSERT INTO order_items (order_id, product_id, quantity, price_cents) VALUES (?, ?, ?, ?)", items)
+            conn.commit()
+            next_id += CHUNK
+        started = time.perf_counter()
+        shop.rebuild_sales_daily(conn)
+        conn.commit()
+        conn.execute("ANALYZE")
+        return time.perf_counter() - started
+
+
+def stream_export(client) -> tuple:
+    tracemalloc.start()
+    started = time.perf_counter()
+    resp = client.get("/admin/orders.csv", headers={"Authorization": "Bearer bench"}, buffered=False)
+    size = lines = 0
+    for chunk in resp.response:
+        size += len(chunk)
+        lines += chunk.count(b"\n")
+    resp.close()
+    elapsed = time.perf_counter() - started
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return elapsed, size, lines - 1, peak
+
+
+def time_query(sql: str, params, requests: int):
+    samples = []
+    with shop.app.app_context():
+        conn = shop.get_db()
+        for _ in range(requests):
+            begin = time.perf_counter()
+            rows = conn.execute(sql, params).fetchall()
+            samples.append((time.perf_counter() - begin) * 1000)
+    samples.sort()
+    return len(rows), statistics.median(samples), samples[int(len(samples) * 0.95) - 1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--orders", type=int, default=1_000_000)
+    parser.add_argument("--days", type=int, default=365)
+    parser.add_argument("--requests", type=int, default=50)
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    rebuild = seed_orders(args.orders, args.days)
+    print(f"seeded {args.orders} orders in {time.perf_counter() - started:.1f}s; sales_daily rebuild took {rebuild:.2f}s")
+
+    elapsed, size, lines, peak = stream_export(shop.app.test_client())
+    print(
+        f"orders.csv: {lines} lines, {size / 1e6:.0f} MB in {elapsed:.1f}s "
+        f"({lines / elapsed:,.0f} lines/s), peak traced memory {peak / 1e6:.1f} MB"
+    )
+
+    end = datetime.utcnow().date() + timedelta(days=1)
+    start = end - timedelta(days=30)
+    params = (start.isoformat(), end.isoformat())
+    print(f"{'30-day sales report':<22} {'rows':>6} {'p50 ms':>9} {'p95 ms':>9}")
+    for label, sql in (("live aggregate", LIVE_REPORT), ("sales_daily", ROLLUP_REPORT)):
+        rows, p50, p95 = time_query(sql, params, args.requests)
+        print(f"{label:<22} {rows:>6} {p50:>9.2f} {p95:>9.2f}")
+
+
+if __name__ == "__main__":
+    main()
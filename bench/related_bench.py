@@ -0,0 +1,182 @@
+"""Rebuild and upkeep of the co-purchase index behind /api/product/<pid>/related.
+
+    python bench/related_bench.py [--lines 10000000] [--products 5000] [--verify]
+
+Seeds a throwaway database (never shop.db) with a synthetic catalog and
+about --lines paid order lines. Baskets hold one to five products that sit
+near each other in the catalog, so related items are real rather than noise.
+It then times:
+
+- a full `flask build-related` rebuild;
+- incremental upkeep: batches of new orders marked paid the way the
+  webhook consumer does it;
+- related-items lookups, against computing the same list live from
+  order_items.
+
+--verify runs a second full rebuild and checks that the incrementally
+maintained index matches it exactly.
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+os.environ.setdefault("SHOP_DB_PATH", os.path.join(tempfile.mkdtemp(), "bench.db"))
+sys.path.insert(0, BENCH_DIR)
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+import app as shop  # noqa: E402
+from catalog_bench import seed_products  # noqa: E402
+
+CHUNK = 200_000
+LIVE_RELATED = """
+    SELECT b.product_id, COUNT(*) AS orders
+    FROM order_items a
+    JOIN orders o ON o.id = a.order_id AND o.status = 'paid'
+    JOIN order_items b ON b.order_id = a.order_id AND b.product_id != a.product_id
+    WHERE a.product_id = ?
+    GROUP BY b.product_id
+    ORDER BY orders DESC, b.product_id
+    LIMIT ?
+"""
+
+
+def baskets(rng: random.Random, product_ids):
+    while True:
+        size = rng.choice((1, 1, 2, 2, 3, 4, 5))
+        base = rng.randrange(len(product_ids))
+        basket = set()
+        while len(basket) < size:
+            if rng.random() < 0.8:
+                basket.add(product_ids[(base + int(rng.expovariate(0.3))) % len(product_ids)])
+            else:
+                basket.add(rng.choice(product_ids))
+        yield basket
+
+
+def insert_orders(conn, first_id: int, lines: int, status: str, rng, product_ids, prices) -> int:
+    """Insert orders totalling about `lines` lines; returns the next free order id."""
+    order_id, written = first_id, 0
+    orders, items = [], []
+    created = shop.datetime.utcnow().isoformat()
+    for basket in baskets(rng, product_ids):
+        if written >= lines:
+            break
+        orders.append((order_id, "bench@example.com", 0, shop.CURRENCY, status, f"cs_bench_{order_id}", created))
+        items.extend((order_id, pid, 1, prices[pid]) for pid in basket)
+        written += len(basket)
+        order_id += 1
+        if len(items) >= CHUNK:
+            flush_orders(conn, orders, items)
+            orders, items = [], []
+    flush_orders(conn, orders, items)
+    return order_id
+
+
+def flush_orders(conn, orders, items):
+    conn.executemany(
+        "INSERT INTO orders (id, email, total_cents, currency, status, stripe_session_id, created_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+        orders,
+    )
+    conn.executemany("INSERT INTO order_items (order_id, product_id, quantity, price_cents) VALUES (?, ?, ?, ?)", items)
+    conn.commit()
+
+
+def rebuild(conn) -> float:
+    started = time.perf_counter()
+    conn.execute("BEGIN IMMEDIATE")
+    shop.rebuild_related(conn.cursor())
+    conn.commit()
+    return time.perf_counter() - started
+
+
+def mark_paid(conn, session_ids):
+    """What WebhookConsumer.drain_once() does to orders for a batch of paid events."""
+    conn.execute("BEGIN IMMEDIATE")
+    shop.roll_up_paid_orders(conn, session_ids)
+    conn.executemany("UPDATE orders SET status = 'paid' WHERE stripe_session_id = ? AND status != 'paid'", [(s,) for s in session_ids])
+    conn.commit()
+
+
+def percentiles(samples):
+    samples = sorted(samples)
+    return statistics.median(samples), samples[int(len(samples) * 0.95) - 1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--lines", type=int, default=10_000_000)
+    parser.add_argument("--products", type=int, default=5000)
+    parser.add_argument("--batches", type=int, default=50, help="incremental batches of WEBHOOK_BATCH_SIZE orders")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--verify", action="store_true")
+    args = parser.parse_args()
+
+    seed_products(args.products)
+    rng = random.Random(3)
+    with shop.app.app_context():
+        conn = shop.get_db()
+        prices = {row["id"]: row["price_cents"] for row in conn.execute("SELECT id, price_cents FROM products")}
+        product_ids = sorted(prices)
+        started = time.perf_counter()
+        next_id = insert_orders(conn, 1, args.lines, "paid", rng, product_ids, prices)
+        print(f"seeded {next_id - 1:,} paid orders, {args.lines:,} lines in {time.perf_counter() - started:.0f}s", flush=True)
+
+        elapsed = rebuild(conn)
+        pairs = conn.execute("SELECT COUNT(*) FROM co_purchases").fetchone()[0]
+        products, size = conn.execute("SELECT COUNT(*), SUM(length(related)) FROM related_products").fetchone()
+        print(f"full rebuild: {elapsed:.1f}s, {pairs:,} pairs, {products:,} top-{shop.RELATED_TOP_K} arrays ({size / 1e6:.2f} MB)", flush=True)
+
+        batch = shop.WEBHOOK_BATCH_SIZE
+        first = next_id
+        insert_orders(conn, first, args.batches * batch * 3, "pending", rng, product_ids, prices)
+        samples = []
+        for n in range(args.batches):
+            sessions = [f"cs_bench_{order_id}" for order_id in range(first + n * batch, first + (n + 1) * batch)]
+            begin = time.perf_counter()
+            mark_paid(conn, sessions)
+            samples.append((time.perf_counter() - begin) * 1000)
+        p50, p95 = percentiles(samples)
+        print(f"incremental: {args.batches} batches of {batch} orders, p50 {p50:.1f} ms, p95 {p95:.1f} ms per batch")
+
+        popular = conn.execute(
+            "SELECT product_id FROM order_items GROUP BY product_id ORDER BY COUNT(*) DESC LIMIT 1"
+        ).fetchone()[0]
+        lookups = [rng.choice(product_ids) for _ in range(args.requests)]
+        print(f"{'related lookup':<28} {'p50 ms':>9} {'p95 ms':>9}")
+        for label, lookup in (
+            ("related_products (random)", lambda pid: shop.unpack_related(shop.fetch_related(pid))),
+            ("live self-join (random)", lambda pid: conn.execute(LIVE_RELATED, (pid, shop.RELATED_TOP_K)).fetchall()),
+            ("live self-join (popular)", lambda pid: conn.execute(LIVE_RELATED, (popular, shop.RELATED_TOP_K)).fetchall()),
+        ):
+            samples = []
+            for pid in lookups[: args.requests if "random" in label else 20]:
+                begin = time.perf_counter()
+                lookup(pid)
+                samples.append((time.perf_counter() - begin) * 1000)
+            p50, p95 = percentiles(samples)
+            print(f"{label:<28} {p50:>9.3f} {p95:>9.3f}")
+
+        client = shop.app.test_client()
+        samples = []
+        for pid in lookups:
+            begin = time.perf_counter()
+            assert client.get(f"/api/product/{pid}/related?lang=en").status_code == 200
+            samples.append((time.perf_counter() - begin) * 1000)
+        p50, p95 = percentiles(samples)
+        print(f"{'GET /api/product/<pid>/related':<28} {p50:>9.3f} {p95:>9.3f}")
+
+        if args.verify:
+            incremental = conn.execute("SELECT product_id, related FROM related_products ORDER BY product_id").fetchall()
+            rebuild(conn)
+            rebuilt = conn.execute("SELECT product_id, related FROM related_products ORDER BY product_id").fetchall()
+            assert [tuple(row) for row in incremental] == [tuple(row) for row in rebuilt], "incremental index drifted"
+            print("verify: incremental index matches a full rebuild")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,355 @@
+"""Throughput and p50/p95/p99 latency for every storefront route.
+
+    python bench/routes_bench.py [--mode micro|macro|both] [--requests 200]
+    python bench/routes_bench.py --catalog 1000,10000 --cart 1,10,50 --comments 0,100,1000
+    python bench/routes_bench.py --save-baseline      # record bench/baseline.json
+    python bench/routes_bench.py --tolerance 0.25     # compare against it
+
+micro drives app.test_client() in-process, one request at a time. macro
+starts a real gunicorn (gunicorn.conf.py) on the same throwaway database and
+drives it over HTTP with --concurrency client threads, each with its own
+session cookie and cart.
+
+Three sweeps run in order, against one database that only grows:
+catalog size (every route), cart lines (cart, checkout and cart API) and
+comment count (product page and comment posting). /webhook gets signed
+checkout.session.completed payloads with fresh event ids.
+
+Every scenario is compared with the matching entry in the baseline file.
+A scenario regresses when its p95 is more than --tolerance slower (and by
+at least --min-delta ms) or its throughput drops by more than --tolerance.
+Regressions exit with status 1. Baselines are machine-specific: record one
+on the machine that runs the comparison.
+"""
+import argparse
+import itertools
+import json
+import os
+import platform
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCH_DIR)
+os.environ.setdefault("SHOP_DB_PATH", os.path.join(tempfile.mkdtemp(), "bench.db"))
+os.environ.setdefault("STRIPE_WEBHOOK_SECRET", "whsec_bench")
+os.environ.pop("STRIPE_SECRET_KEY", None)
+os.environ.pop("STRIPE_PUBLISHABLE_KEY", None)
+sys.path.insert(0, ROOT_DIR)
+
+import app as shop  # noqa: E402
+from catalog_bench import iter_synthetic_products  # noqa: E402
+from webhook_replay import sign  # noqa: E402
+
+DEFAULT_BASELINE = os.path.join(BENCH_DIR, "baseline.json")
+DEFAULT_CART = 5
+DEFAULT_COMMENTS = 50
+PRODUCT_ID = 1
+COMMENT_PRODUCT_BASE = 10
+EVENT_IDS = itertools.count()
+
+
+class MicroClient:
+    def __init__(self):
+        self._client = shop.app.test_client()
+
+    def get(self, path: str) -> int:
+        return self._client.get(path).status_code
+
+    def post(self, path: str, **kwargs) -> int:
+        return self._client.post(path, **kwargs).status_code
+
+
+class MacroClient:
+    def __init__(self, base_url: str):
+        import requests
+
+        self._base_url = base_url
+        self._http = requests.Session()
+
+    def get(self, path: str) -> int:
+        return self._http.get(self._base_url + path, allow_redirects=False, timeout=30).status_code
+
+    def post(self, path: str, data=None, json=None, headers=None, content_type=None) -> int:
+        headers = dict(headers or {})
+        if content_type:
+            headers["Content-Type"] = content_type
+        resp = self._http.post(
+            self._base_url + path, data=data, json=json, headers=headers, allow_redirects=False, timeout=30
+        )
+        return resp.status_code
+
+
+def fill_cart(client, lines: int):
+    client.post("/api/cart/clear")
+    for pid in range(1, lines + 1):
+        client.post("/api/cart/add", json={"product_id": pid, "qty": 1})
+
+
+def webhook_request(client, pid: int):
+    payload = json.dumps(
+        {
+            "id": f"evt_routes_{os.getpid()}_{next(EVENT_IDS)}",
+            "object": "event",
+            "type": "checkout.session.completed",
+            "data": {"object": {"id": "cs_routes_missing", "payment_status": "paid"}},
+        }
+    )
+    headers = {"Stripe-Signature": sign(payload, os.environ["STRIPE_WEBHOOK_SECRET"])}
+    return lambda: client.post("/webhook", data=payload, headers=headers, content_type="application/json")
+
+
+def cart_remove_request(client, pid: int):
+    client.post("/api/cart/add", json={"product_id": pid, "qty": 1})
+    return lambda: client.post("/api/cart/remove", json={"product_id": pid})
+
+
+def cart_clear_request(client, pid: int):
+    fill_cart(client, DEFAULT_CART)
+    return lambda: client.post("/api/cart/clear")
+
+
+# name -> (expected status, prepare(client, pid) -> measured request)
+ROUTES = {
+    "GET /": (200, lambda c, pid: lambda: c.get("/?lang=en")),
+    "GET /product/<pid>": (200, lambda c, pid: lambda: c.get(f"/product/{pid}?lang=en")),
+    "GET /cart": (200, lambda c, pid: lambda: c.get("/cart?lang=en")),
+    "GET /checkout": (200, lambda c, pid: lambda: c.get("/checkout?lang=en")),
+    "POST /api/cart/add": (200, lambda c, pid: lambda: c.post("/api/cart/add", json={"product_id": pid, "qty": 1})),
+    "POST /api/cart/remove": (200, cart_remove_request),
+    "POST /api/cart/clear": (200, cart_clear_request),
+    "POST /product/<pid>/comments": (
+        302,
+        lambda c, pid: lambda: c.post(
+            f"/product/{pid}/comments?lang=en", data={"author": "Bench", "content": "Benchmark comment"}
+        ),
+    ),
+    "POST /webhook": (200, webhook_request),
+}
+CART_ROUTES = ["GET /cart", "GET /checkout", "POST /api/cart/add", "POST /api/cart/remove"]
+COMMENT_ROUTES = ["GET /product/<pid>", "POST /product/<pid>/comments"]
+
+
+def seed_catalog(total: int):
+    with shop.app.app_context():
+        conn = shop.get_db()
+        current = conn.execute("SELECT COUNT(*) FROM products").fetchone()[0]
+        if total <= current:
+            return current
+        rows = iter_synthetic_products(total - current, start_index=current + 1)
+        while True:
+            chunk = [row for _, row in zip(range(5000), rows)]
+            if not chunk:
+                break
+            conn.executemany(shop.PRODUCT_UPSERT, chunk)
+        shop.bump_version(conn, "catalog_version")
+        conn.commit()
+        return total
+
+
+def seed_comments(pid: int, total: int):
+    with shop.app.app_context():
+        conn = shop.get_db()
+        missing = total - shop.fetch_comment_count(pid)
+        if missing <= 0:
+            return
+        now = shop.datetime.utcnow().isoformat()
+        conn.executemany(
+            "INSERT INTO comments (product_id, session_id, author, content, created_at) VALUES (?, ?, ?, ?, ?)",
+            [(pid, "bench", "Bench", f"Seeded comment {i}", now) for i in range(missing)],
+        )
+        shop.adjust_comment_count(conn, pid, missing)
+        shop.bump_version(conn, shop.comments_version_key(pid))
+        conn.commit()
+
+
+def run_scenario(new_client, route: str, pid: int, cart_lines: int, requests: int, concurrency: int):
+    expected, prepare = ROUTES[route]
+    clients = []
+    for _ in range(concurrency):
+        client = new_client()
+        fill_cart(client, cart_lines)
+        for _ in range(3):
+            prepare(client, pid)()
+        clients.append(client)
+
+    samples = []
+    failures = []
+    lock = threading.Lock()
+
+    def worker(client, count: int):
+        local = []
+        for _ in range(count):
+            request = prepare(client, pid)
+            begin = time.perf_counter()
+            status = request()
+            local.append((time.perf_counter() - begin) * 1000)
+            if status != expected:
+                failures.append(status)
+        with lock:
+            samples.extend(local)
+
+    per_client = max(requests // concurrency, 1)
+    with ThreadPoolExecutor(concurrency) as pool:
+        list(pool.map(worker, clients, [per_client] * concurrency))
+    busy = sum(samples) / 1000
+    samples.sort()
+    if failures:
+        print(f"  ! {route}: {len(failures)} unexpected statuses, e.g. {failures[0]}", file=sys.stderr)
+    return {
+        # Based on time spent in measured requests, so untimed setup does not count.
+        "rps": len(samples) * concurrency / busy if busy else 0.0,
+        "p50": statistics.median(samples),
+        "p95": samples[int(len(samples) * 0.95) - 1],
+        "p99": samples[int(len(samples) * 0.99) - 1],
+        "errors": len(failures),
+    }
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_gunicorn(workers: int, threads: int):
+    import requests
+
+    port = free_port()
+    env = dict(os.environ, GUNICORN_BIND=f"127.0.0.1:{port}", GUNICORN_WORKERS=str(workers), GUNICORN_THREADS=str(threads))
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "app:app"],
+        cwd=ROOT_DIR,
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    base_url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            if requests.get(base_url + "/healthz", timeout=1).status_code == 200:
+                return proc, base_url
+        except requests.RequestException:
+            time.sleep(0.2)
+    proc.terminate()
+    raise SystemExit("gunicorn did not come up within 30s")
+
+
+def sweep(mode: str, new_client, args, results: dict):
+    concurrency = 1 if mode == "micro" else args.concurrency
+    settle = 0 if mode == "micro" else shop.CATALOG_CACHE_TTL
+
+    def record(route: str, label: str, pid: int, cart_lines: int):
+        key = f"{mode} {route} {label}"
+        results[key] = run_scenario(new_client, route, pid, cart_lines, args.requests, concurrency)
+        report(key, results[key], args)
+
+    seed_comments(PRODUCT_ID, DEFAULT_COMMENTS)
+    for size in args.catalog:
+        seed_catalog(size)
+        time.sleep(settle)
+        for route in ROUTES:
+            record(route, f"catalog={size}", PRODUCT_ID, DEFAULT_CART)
+    for lines in args.cart:
+        for route in CART_ROUTES:
+            record(route, f"cart={lines}", PRODUCT_ID, lines)
+    # Each comment count gets its own product; the sweep's own posts land on top of it.
+    for pid, count in enumerate(args.comments, start=COMMENT_PRODUCT_BASE + (mode == "macro") * 100):
+        seed_comments(pid, count)
+        for route in COMMENT_ROUTES:
+            record(route, f"comments={count}", pid, DEFAULT_CART)
+
+
+BASELINE = {}
+REGRESSIONS = []
+
+
+def report(key: str, result: dict, args):
+    line = (
+        f"{key:<58} {result['rps']:>9.0f} {result['p50']:>8.3f} {result['p95']:>8.3f} {result['p99']:>8.3f}"
+    )
+    base = BASELINE.get(key)
+    if base:
+        slower = result["p95"] > base["p95"] * (1 + args.tolerance) and result["p95"] - base["p95"] >= args.min_delta
+        fewer = result["rps"] < base["rps"] * (1 - args.tolerance)
+        change = (result["p95"] / base["p95"] - 1) * 100 if base["p95"] else 0.0
+        line += f" {change:>+7.1f}%"
+        if slower or fewer:
+            line += "  REGRESSION"
+            REGRESSIONS.append(key)
+    print(line, flush=True)
+
+
+def int_list(value: str):
+    return [int(part) for part in value.split(",") if part]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--mode", choices=("micro", "macro", "both"), default="micro")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--catalog", type=int_list, default=[1000, 10000], help="total product counts")
+    parser.add_argument("--cart", type=int_list, default=[1, 10, 50], help="cart line counts")
+    parser.add_argument("--comments", type=int_list, default=[0, 100, 1000], help="comments on the measured product")
+    parser.add_argument("--concurrency", type=int, default=8, help="client threads in macro mode")
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    parser.add_argument("--min-delta", type=float, default=0.5, help="ignore p95 changes below this many ms")
+    args = parser.parse_args()
+
+    if not args.save_baseline and os.path.exists(args.baseline):
+        with open(args.baseline, encoding="utf-8") as fh:
+            BASELINE.update(json.load(fh)["results"])
+
+    with shop.app.app_context():
+        shop.init_db()
+    shop.DB_POOL.close_all()
+
+    results = {}
+    print(f"{'scenario':<58} {'req/s':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}", flush=True)
+    if args.mode in ("micro", "both"):
+        sweep("micro", MicroClient, args, results)
+    if args.mode in ("macro", "both"):
+        proc, base_url = start_gunicorn(args.workers, args.threads)
+        try:
+            sweep("macro", lambda: MacroClient(base_url), args, results)
+        finally:
+            proc.terminate()
+            proc.wait(10)
+
+    if args.save_baseline:
+        baseline = {
+            "meta": {
+                "python": platform.python_version(),
+                "machine": platform.machine(),
+                "cpus": os.cpu_count(),
+                "requests": args.requests,
+                "recorded_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            },
+            "results": results,
+        }
+        with open(args.baseline, "w", encoding="utf-8") as fh:
+            json.dump(baseline, fh, indent=2, sort_keys=True)
+            fh.write("\n")
+        print(f"baseline written to {args.baseline}")
+    elif BASELINE:
+        if REGRESSIONS:
+            print(f"{len(REGRESSIONS)} regression(s) against {args.baseline}:")
+            for key in REGRESSIONS:
+                print(f"  {key}")
+            sys.exit(1)
+        print(f"no regressions against {args.baseline}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""/api/search latency over a large synthetic catalog.
+
+    python bench/search_bench.py [--products 100000] [--requests 500]
+
+Runs against a throwaway database, so it never touches shop.db.
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+os.environ.setdefault("SHOP_DB_PATH", os.path.join(tempfile.mkdtemp(), "bench.db"))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+import app as shop  # noqa: E402
+
+QUERIES = [
+    ("en", "nova"),
+    ("en", "orb"),
+    ("en", "pulse cha"),
+    ("en", "audio"),
+    ("en", "light bar"),
+    ("ar", "نوفا"),
+    ("ar", "سماعه"),
+    ("ar", "حقيبة"),
+    ("ar", "اوربت"),
+    ("en", "zzz"),
+]
+
+
+def seed_products(count: int):
+    with shop.app.app_context():
+        shop.ensure_db()
+        conn = shop.get_db()
+        names = shop.EXTRA_PRODUCT_NAMES
+        rows = []
+        for i in range(count):
+            name_en, name_ar = names[i % len(names)]
+            category_en, category_ar = shop.CATEGORIES[i % len(shop.CATEGORIES)]
+            desc_en, desc_ar = shop.DESCRIPTIONS[i % len(shop.DESCRIPTIONS)]
+            rows.append(
+                (
+                    f"BENCH-SRCH-{i:07d}",
+                    f"{name_en} {i}",
+                    f"{name_ar} {i}",
+                    shop.BASE_PRICES[i % len(shop.BASE_PRICES)],
+                    shop.PRODUCT_IMAGES[i % len(shop.PRODUCT_IMAGES)],
+                    category_en,
+                    category_ar,
+                    desc_en,
+                    desc_ar,
+                )
+            )
+        conn.executemany(
+            """
+            INSERT OR IGNORE INTO products (
+                sku, name_en, name_ar, price_cents, image,
+                category_en, category_ar, description_en, description_ar
+            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """,
+            rows,
+        )
+        shop.bump_version(conn, "catalog_version")
+        conn.commit()
+        conn.execute("INSERT INTO products_fts (products_fts) VALUES ('optimize')")
+        conn.commit()
+
+
+def percentiles(samples):
+    samples = sorted(samples)
+    return (
+        f"p50 {statistics.median(samples):.3f} ms  "
+        f"p95 {samples[int(len(samples) * 0.95) - 1]:.3f} ms  "
+        f"p99 {samples[int(len(samples) * 0.99) - 1]:.3f} ms"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--products", type=int, default=100_000)
+    parser.add_argument("--requests", type=int, default=500)
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    seed_products(args.products)
+    print(f"seeded {args.products} products in {time.perf_counter() - started:.1f}s")
+
+    rng = random.Random(7)
+    queries = [rng.choice(QUERIES) for _ in range(args.requests)]
+
+    query_samples = []
+    with shop.app.app_context():
+        for lang, q in queries:
+            begin = time.perf_counter()
+            shop.search_products(q, lang, 1, shop.SEARCH_PAGE_SIZE)
+            query_samples.append((time.perf_counter() - begin) * 1000)
+    print("query   ", percentiles(query_samples))
+
+    client = shop.app.test_client()
+    request_samples = []
+    for lang, q in queries:
+        begin = time.perf_counter()
+        resp = client.get("/api/search", query_string={"q": q, "lang": lang})
+        request_samples.append((time.perf_counter() - begin) * 1000)
+        assert resp.status_code == 200
+    print("request ", percentiles(request_samples))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""Time-to-first-byte and peak memory of the streamed full catalog (/?view=all).
+
+    python bench/stream_bench.py [--catalog 1000,10000,50000] [--requests 5]
+
+Runs against a throwaway database, so it never touches shop.db. Peak memory
+is what tracemalloc sees while one response is consumed chunk by chunk; with
+streaming it should not grow with the catalog, only the total time should.
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+os.environ.setdefault("SHOP_DB_PATH", os.path.join(tempfile.mkdtemp(), "bench.db"))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+sys.path.insert(0, BENCH_DIR)
+
+import app as shop  # noqa: E402
+from catalog_bench import iter_synthetic_products  # noqa: E402
+
+
+def seed_catalog(total: int):
+    with shop.app.app_context():
+        shop.ensure_db()
+        conn = shop.get_db()
+        current = conn.execute("SELECT COUNT(*) FROM products").fetchone()[0]
+        rows = iter_synthetic_products(max(total - current, 0), start_index=current + 1)
+        while True:
+            chunk = [row for _, row in zip(range(5000), rows)]
+            if not chunk:
+                break
+            conn.executemany(shop.PRODUCT_UPSERT, chunk)
+        shop.bump_version(conn, "catalog_version")
+        conn.commit()
+
+
+def measure(client, url: str):
+    tracemalloc.start()
+    begin = time.perf_counter()
+    resp = client.get(url, buffered=False, headers={"Accept-Encoding": "identity"})
+    chunks = iter(resp.response)
+    size = len(next(chunks))
+    ttfb = time.perf_counter() - begin
+    for chunk in chunks:
+        size += len(chunk)
+    total = time.perf_counter() - begin
+    resp.close()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return ttfb * 1000, total * 1000, peak / 2**20, size
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--catalog", default="1000,10000,50000", help="total product counts")
+    parser.add_argument("--requests", type=int, default=5)
+    args = parser.parse_args()
+
+    client = shop.app.test_client()
+    print(f"{'products':>9} {'ttfb ms':>9} {'total ms':>10} {'peak MiB':>9} {'body MiB':>9}")
+    for total in (int(n) for n in args.catalog.split(",")):
+        seed_catalog(total)
+        runs = [measure(client, "/?lang=en&view=all") for _ in range(args.requests)]
+        ttfb, elapsed, peak, size = (statistics.median(column) for column in zip(*runs))
+        print(f"{total:>9} {ttfb:>9.2f} {elapsed:>10.1f} {peak:>9.2f} {size / 2**20:>9.1f}", flush=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,174 @@
+"""Replay signed Stripe webhook events against /webhook.
+
+    python bench/webhook_replay.py [--events 5000] [--duplicates 0.3] [--concurrency 8]
+    python bench/webhook_replay.py --url http://127.0.0.1:8000/webhook --secret whsec_...
+    python bench/webhook_replay.py --log shop.db --url ... --secret ...
+
+Without --url the events go through the test client against a throwaway
+database seeded with matching pending orders, and the run ends by draining
+the webhook consumer and checking that every order was marked paid exactly
+once. With --url they are POSTed to a running server, which must share the
+signing secret. --log replays the payloads stored in another database's
+webhook_events table instead of synthetic ones.
+"""
+import argparse
+import hashlib
+import hmac
+import json
+import os
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+os.environ.setdefault("SHOP_DB_PATH", os.path.join(tempfile.mkdtemp(), "bench.db"))
+os.environ.setdefault("STRIPE_WEBHOOK_SECRET", "whsec_bench")
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+
+import app as shop  # noqa: E402
+
+
+def synthetic_events(count: int):
+    for i in range(count):
+        session_obj = {"id": f"cs_bench_{i:07d}", "object": "checkout.session", "payment_status": "paid"}
+        event = {
+            "id": f"evt_bench_{i:07d}",
+            "object": "event",
+            "type": "checkout.session.completed",
+            "data": {"object": session_obj},
+        }
+        yield json.dumps(event)
+
+
+def logged_events(path: str):
+    conn = sqlite3.connect(path)
+    try:
+        for (payload,) in conn.execute("SELECT payload FROM webhook_events ORDER BY received_at"):
+            yield payload
+    finally:
+        conn.close()
+
+
+def sign(payload: str, secret: str) -> str:
+    timestamp = int(time.time())
+    signature = hmac.new(secret.encode(), f"{timestamp}.{payload}".encode(), hashlib.sha256).hexdigest()
+    return f"t={timestamp},v1={signature}"
+
+
+def seed_orders(count: int):
+    with shop.app.app_context():
+        shop.ensure_db()
+        conn = shop.get_db()
+        now = shop.datetime.utcnow().isoformat()
+        conn.executemany(
+            """
+            INSERT OR IGNORE INTO orders (email, total_cents, currency, status, stripe_session_id, created_at)
+            VALUES (?, ?, ?, 'pending', ?, ?)
+            """,
+            [("bench@example.com", 1000, shop.CURRENCY, f"cs_bench_{i:07d}", now) for i in range(count)],
+        )
+        conn.commit()
+
+
+def make_poster(url: str):
+    if url:
+        import requests
+
+        local = threading.local()
+
+        def post(payload: str, signature: str) -> int:
+            if not hasattr(local, "http"):
+                local.http = requests.Session()
+            resp = local.http.post(
+                url,
+                data=payload.encode("utf-8"),
+                headers={"Stripe-Signature": signature, "Content-Type": "application/json"},
+                timeout=10,
+            )
+            return resp.status_code
+
+    else:
+        local = threading.local()
+
+        def post(payload: str, signature: str) -> int:
+            if not hasattr(local, "client"):
+                local.client = shop.app.test_client()
+            resp = local.client.post(
+                "/webhook",
+                data=payload,
+                headers={"Stripe-Signature": signature},
+                content_type="application/json",
+            )
+            return resp.status_code
+
+    return post
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--events", type=int, default=5000)
+    parser.add_argument("--duplicates", type=float, default=0.3, help="fraction of extra redeliveries")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--url", default="")
+    parser.add_argument("--secret", default=os.environ["STRIPE_WEBHOOK_SECRET"])
+    parser.add_argument("--log", default="", help="database whose webhook_events to replay")
+    args = parser.parse_args()
+
+    payloads = list(logged_events(args.log) if args.log else synthetic_events(args.events))
+    rng = random.Random(13)
+    deliveries = payloads + [rng.choice(payloads) for _ in range(int(len(payloads) * args.duplicates))]
+    rng.shuffle(deliveries)
+    if not args.url and not args.log:
+        seed_orders(len(payloads))
+
+    # Keep the in-process consumer idle during the burst so it measures ingestion alone.
+    shop.WEBHOOK_CONSUMER.start = lambda: None
+    post = make_poster(args.url)
+    samples = []
+
+    def deliver(payload: str):
+        begin = time.perf_counter()
+        status = post(payload, sign(payload, args.secret))
+        samples.append((time.perf_counter() - begin) * 1000)
+        return status
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(args.concurrency) as pool:
+        statuses = list(pool.map(deliver, deliveries))
+    elapsed = time.perf_counter() - started
+    samples.sort()
+    bad = sum(1 for status in statuses if status != 200)
+    print(f"delivered {len(deliveries)} events ({len(payloads)} unique) in {elapsed:.2f}s: {len(deliveries) / elapsed:,.0f} req/s, {bad} non-200")
+    print(
+        f"latency p50 {statistics.median(samples):.3f} ms  "
+        f"p95 {samples[int(len(samples) * 0.95) - 1]:.3f} ms  "
+        f"p99 {samples[int(len(samples) * 0.99) - 1]:.3f} ms"
+    )
+    if args.url:
+        return
+
+    started = time.perf_counter()
+    applied = 0
+    while True:
+        batch = shop.WEBHOOK_CONSUMER.drain_once()
+        if not batch:
+            break
+        applied += batch
+    elapsed = time.perf_counter() - started
+    print(f"applied {applied} events in {elapsed:.2f}s ({shop.WEBHOOK_CONSUMER.batches} batches)")
+    with shop.app.app_context():
+        conn = shop.get_db()
+        logged = conn.execute("SELECT COUNT(*) FROM webhook_events").fetchone()[0]
+        paid = conn.execute("SELECT COUNT(*) FROM orders WHERE status = 'paid'").fetchone()[0]
+    print(f"webhook_events rows: {logged}, paid orders: {paid}")
+    if not args.log:
+        assert logged == len(payloads) and paid == len(payloads), "replays were not idempotent"
+
+
+if __name__ == "__main__":
+    main()
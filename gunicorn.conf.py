@@ -0,0 +1,40 @@
+"""gunicorn settings for the storefront.
+
+Sync (gthread) workers, the default:
+    gunicorn -c gunicorn.conf.py app:app
+Async workers, serving asgi.py on an event loop per process:
+    GUNICORN_WORKER_CLASS=uvicorn_worker.UvicornWorker gunicorn -c gunicorn.conf.py asgi:application
+
+A gthread worker serves at most GUNICORN_THREADS requests at a time, however
+long each one waits on Stripe or a slow client. An async worker holds sockets
+on its event loop and only needs one of its SHOP_ASYNC_THREADS executor
+threads while Flask or SQLite is actually running. GUNICORN_THREADS is
+ignored there, and SHOP_DB_POOL_SIZE should be at least SHOP_ASYNC_THREADS.
+"""
+import glob
+import os
+import tempfile
+
+bind = os.environ.get("GUNICORN_BIND", "0.0.0.0:8000")
+workers = int(os.environ.get("GUNICORN_WORKERS", "2"))
+threads = int(os.environ.get("GUNICORN_THREADS", "8"))
+worker_class = os.environ.get("GUNICORN_WORKER_CLASS", "gthread")
+
+# Workers write metric snapshots here; /metrics in any worker sums them.
+os.environ.setdefault("SHOP_METRICS_DIR", os.path.join(tempfile.gettempdir(), f"shop-metrics-{os.getpid()}"))
+
+
+def on_starting(server):
+    metrics_dir = os.environ["SHOP_METRICS_DIR"]
+    os.makedirs(metrics_dir, exist_ok=True)
+    for path in glob.glob(os.path.join(metrics_dir, "*.json")):
+        os.remove(path)
+
+    # Migrate and seed once in the master, before any worker exists.
+    from app import DB_POOL, app, build_assets, init_db
+
+    with app.app_context():
+        applied, seeded = init_db()
+    DB_POOL.close_all()
+    build_assets()
+    server.log.info("database ready: migrations %s, seed %s", applied or "none", "applied" if seeded else "unchanged")
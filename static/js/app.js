@@ -50,7 +50,7 @@ const updateCartCount = count => {
   if (badge) badge.textContent = count;
 };
 
-const addToCart = async productId => {
+const addToCart = async (productId, btn) => {
   const res = await fetch("/api/cart/add", {
     method: "POST",
     headers: { "Content-Type": "application/json" },
@@ -58,6 +58,10 @@ const addToCart = async productId => {
   });
   const data = await res.json();
   if (data.ok) updateCartCount(data.count);
+  else if (data.error === "out_of_stock" && btn) {
+    btn.disabled = true;
+    btn.textContent = data.message;
+  }
 };
 
 const removeFromCart = async productId => {
@@ -70,14 +74,75 @@ const removeFromCart = async productId => {
   if (data.ok) window.location.reload();
 };
 
+const buildCommentCard = (comment, opts) => {
+  const card = document.createElement("div");
+  card.className = "comment-card";
+  const meta = document.createElement("div");
+  meta.className = "comment-meta";
+  const author = document.createElement("strong");
+  author.textContent = comment.author;
+  const date = document.createElement("span");
+  date.textContent = comment.created_at.slice(0, 10);
+  meta.append(author, date);
+  const body = document.createElement("p");
+  body.textContent = comment.content;
+  card.append(meta, body);
+
+  if (comment.can_edit) {
+    const form = document.createElement("form");
+    form.className = "comment-edit";
+    form.method = "post";
+    form.action = `/comment/${comment.id}/edit?lang=${opts.lang}`;
+    const pid = document.createElement("input");
+    pid.type = "hidden";
+    pid.name = "product_id";
+    pid.value = opts.loadComments;
+    const text = document.createElement("textarea");
+    text.name = "content";
+    text.rows = 3;
+    text.value = comment.content;
+    const actions = document.createElement("div");
+    actions.className = "comment-actions";
+    const save = document.createElement("button");
+    save.className = "ghost";
+    save.type = "submit";
+    save.textContent = opts.saveLabel;
+    const del = document.createElement("button");
+    del.className = "ghost danger";
+    del.type = "submit";
+    del.formAction = `/comment/${comment.id}/delete?lang=${opts.lang}`;
+    del.textContent = opts.deleteLabel;
+    actions.append(save, del);
+    form.append(pid, text, actions);
+    card.appendChild(form);
+  }
+  return card;
+};
+
+const loadMoreComments = async btn => {
+  btn.disabled = true;
+  const res = await fetch(`/api/product/${btn.dataset.loadComments}/comments?before=${btn.dataset.before}`);
+  const data = await res.json();
+  btn.disabled = false;
+  if (!data.ok) return;
+  const list = document.querySelector(".comment-list");
+  data.comments.forEach(comment => list.appendChild(buildCommentCard(comment, btn.dataset)));
+  if (data.next_before) btn.dataset.before = data.next_before;
+  else btn.remove();
+};
+
 const bindActions = () => {
   document.querySelectorAll("[data-add-to-cart]").forEach(btn => {
-    btn.addEventListener("click", () => addToCart(btn.dataset.addToCart));
+    btn.addEventListener("click", () => addToCart(btn.dataset.addToCart, btn));
   });
 
   document.querySelectorAll("[data-remove-from-cart]").forEach(btn => {
     btn.addEventListener("click", () => removeFromCart(btn.dataset.removeFromCart));
   });
+
+  document.querySelectorAll("[data-load-comments]").forEach(btn => {
+    btn.addEventListener("click", () => loadMoreComments(btn));
+  });
 };
 
 const bindLoader = () => {